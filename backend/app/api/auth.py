@@ -2,23 +2,29 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from datetime import timedelta
 from typing import cast
-from app.models.database import get_db
+import anyio
+from app.models.database import get_write_db
 from app.models.models import AdminUser
 from app.models.schemas import AdminLogin, Token
-from app.core.security import verify_password, create_access_token, get_hashed_password
+from app.core.security import create_access_token
+from app.core.passwords import verify_password_async, hash_password_async
 from app.core.config import settings
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+def _find_admin(db: Session, username: str):
+    return db.query(AdminUser).filter(AdminUser.username == username).first()
+
 @router.post("/login", response_model=Token)
-def login(credentials: AdminLogin, db: Session = Depends(get_db)):
+async def login(credentials: AdminLogin, db: Session = Depends(get_write_db)):
     """
     Admin login endpoint
     Returns JWT access token
+    bcrypt runs on the dedicated password pool; 503 with Retry-After when it is saturated
     """
-    user = db.query(AdminUser).filter(AdminUser.username == credentials.username).first()
+    user = await anyio.to_thread.run_sync(_find_admin, db, credentials.username)
     
-    if not user or not verify_password(credentials.password, cast(str, user.hashed_password)):
+    if not user or not await verify_password_async(user.username, credentials.password, cast(str, user.hashed_password)):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
@@ -32,14 +38,32 @@ def login(credentials: AdminLogin, db: Session = Depends(get_db)):
     
     return {"access_token": access_token, "token_type": "bearer"}
 
+def _create_first_admin(db: Session, username: str, hashed_password: str) -> AdminUser:
+    # Checked again after hashing, another request may have created it meanwhile
+    if db.query(AdminUser).first():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Admin user already exists"
+        )
+    
+    admin = AdminUser(
+        username=username,
+        hashed_password=hashed_password
+    )
+    
+    db.add(admin)
+    db.commit()
+    db.refresh(admin)
+    return admin
+
 @router.post("/init-admin")
-def init_admin(credentials: AdminLogin, db: Session = Depends(get_db)):
+async def init_admin(credentials: AdminLogin, db: Session = Depends(get_write_db)):
     """
     Initialize first admin user (only if no admin exists)
     This endpoint is only for initial setup
     """
     # Check if any admin exists
-    existing_admin = db.query(AdminUser).first()
+    existing_admin = await anyio.to_thread.run_sync(db.query(AdminUser).first)
     if existing_admin:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -47,14 +71,7 @@ def init_admin(credentials: AdminLogin, db: Session = Depends(get_db)):
         )
     
     # Create first admin
-    hashed_password = get_hashed_password(credentials.password)
-    admin = AdminUser(
-        username=credentials.username,
-        hashed_password=hashed_password
-    )
-    
-    db.add(admin)
-    db.commit()
-    db.refresh(admin)
+    hashed_password = await hash_password_async(credentials.password)
+    admin = await anyio.to_thread.run_sync(_create_first_admin, db, credentials.username, hashed_password)
     
     return {"message": "Admin user created successfully", "username": admin.username}
\ No newline at end of file
@@ -1,31 +1,38 @@
-from fastapi import Depends, HTTPException, status, Query
+from fastapi import Depends, HTTPException, status, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
-from app.models.database import get_db
+from app.models.database import get_read_db, get_write_db
 from app.models.models import AdminUser, APIToken
 from app.core.security import decode_access_token
-from datetime import datetime
+from app.core.timing import timed
+from app.core.rate_limit import enforce_rate_limit
+from app.core.admission import forget_token, mark_token_verified
+from app.core.progress import NULL_PUBLISHER, progress_publisher
+from app.services.token_usage import get_usage_recorder
+from typing import Optional
+import hashlib
 
 security = HTTPBearer()
 
 def get_current_admin(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ) -> AdminUser:
     """
     Dependency to get current authenticated admin user
     Validates JWT token
     """
-    token = credentials.credentials
-    username = decode_access_token(token)
-    
-    if username is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials"
-        )
-    
-    user = db.query(AdminUser).filter(AdminUser.username == username).first()
+    with timed("auth"):
+        token = credentials.credentials
+        username = decode_access_token(token)
+        
+        if username is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials"
+            )
+        
+        user = db.query(AdminUser).filter(AdminUser.username == username).first()
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -36,29 +43,93 @@ def get_current_admin(
 
 def validate_api_token(
     token: str = Query(..., description="API token for authentication"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_write_db)
 ) -> APIToken:
     """
     Dependency to validate API token for merchant uploads
-    Updates token usage statistics
+    Enforces the token's request rate limit (429 with Retry-After) and
+    records usage statistics, both without writing to the database
     """
-    api_token = db.query(APIToken).filter(
-        APIToken.token == token,
-        APIToken.is_active == True
-    ).first()
+    with timed("auth"):
+        api_token = db.query(APIToken).filter(
+            APIToken.token == token,
+            APIToken.is_active == True
+        ).first()
+        
+        if not api_token:
+            forget_token(token)
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or inactive API token"
+            )
+        
+        # Later uploads of this token get their own admission fair share
+        mark_token_verified(token)
+        enforce_rate_limit(int(api_token.id), "requests", api_token.rate_limit_requests)
+        # Buffered and written in batches, see TokenUsageRecorder
+        get_usage_recorder().record(int(api_token.id))
     
-    if not api_token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or inactive API token"
-        )
-    
-    # Update token usage at the DB level to avoid assigning to a ColumnElement
-    db.query(APIToken).filter(APIToken.token == token).update({
-        APIToken.usage_count: APIToken.usage_count + 1,
-        APIToken.last_used_at: datetime.utcnow()
-    }, synchronize_session=False)
-    db.commit()
-    db.refresh(api_token)
+    return api_token
+
+def enforce_record_limit(api_token: APIToken, record_count: int):
+    """Take an upload's records from the token's record rate limit, 429 when exhausted"""
+    enforce_rate_limit(int(api_token.id), "records", api_token.rate_limit_records, record_count)
+
+async def get_body_digest(request: Request) -> str:
+    """
+    Dependency returning the SHA-256 of the raw request body
+    FastAPI has already read and cached the body when parsing it
+    """
+    return hashlib.sha256(await request.body()).hexdigest()
+
+async def get_body_size(request: Request) -> int:
+    """Dependency returning the size of the (decoded) request body in bytes"""
+    return len(await request.body())
+
+def get_upload_progress(
+    progress_id: Optional[str] = Query(
+        None,
+        max_length=64,
+        pattern=r"^[A-Za-z0-9_-]*[A-Za-z_-][A-Za-z0-9_-]*$",
+        description="Client chosen id to follow this upload at GET /api/upload/{progress_id}/events (not purely numeric)"
+    ),
+    api_token: APIToken = Depends(validate_api_token)
+):
+    """
+    Dependency yielding the progress publisher of a single request upload,
+    a no-op publisher without progress_id
+    A request failing with an error publishes the terminal "failed" event
+    """
+    if not progress_id:
+        yield NULL_PUBLISHER
+        return
     
-    return api_token
\ No newline at end of file
+    progress = progress_publisher((int(api_token.id), progress_id))
+    try:
+        yield progress
+    except HTTPException as e:
+        progress.publish("failed", status_code=e.status_code, detail=e.detail)
+        raise
+    except Exception:
+        progress.publish("failed", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error")
+        raise
+
+def get_session_progress(
+    session_id: int,
+    api_token: APIToken = Depends(validate_api_token)
+):
+    """
+    Dependency yielding the progress publisher of a chunked upload session,
+    followed at GET /api/upload/{session_id}/events
+    A failing chunk or finalize request publishes "error", which doesn't end
+    the stream: the request can be retried
+    """
+    progress = progress_publisher((int(api_token.id), str(session_id)))
+    try:
+        yield progress
+    except HTTPException as e:
+        progress.publish("error", status_code=e.status_code, detail=e.detail)
+        raise
+    except Exception:
+        progress.publish("error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error")
+        raise
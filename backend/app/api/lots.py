@@ -1,110 +1,207 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header, Request
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from typing import Optional
-from app.models.database import get_db
-from app.models.models import AdminUser, Lot, UploadSession, APIToken
-from app.models.schemas import LotsListResponse, LotResponse, StatsResponse, DownloadMultipleRequest, DownloadMultipleResponse
+from typing import Literal, Optional
+from datetime import datetime
+from app.models.database import get_read_db, get_write_db
+from app.models.models import AdminUser, Lot, LotSegment, LotSource, UploadSession, APIToken, CleanupJob
+from app.models.schemas import (
+    LotsListResponse, LotResponse, StatsResponse, AggregateResponse, DownloadMultipleRequest, DownloadMultipleResponse,
+    BulkDeleteRequest, BulkDeleteResponse, CleanupJobResponse
+)
 from app.api.deps import get_current_admin
+from app.core.timing import timed
+from app.core.profiling import profiled
+from app.core.logger import get_logger
+from app.core.lanes import lane, lane_route
+from app.core.response_cache import bump_generation, cached_json_response
+from app.services.lot_search import filter_lot_number
+from app.services.export import EXPORT_MEDIA_TYPES, arrow_available, export_query, stream_export
+from app.services.lot_segments import lot_file_paths, lot_sidecar_paths, open_lot_files, remove_files
+from app.services.sidecar import aggregate_lots
+from app.services.cleanup import delete_lots, release_duplicate_reports
+from urllib.parse import quote
 import os
+import shutil
 
-router = APIRouter(prefix="/lots", tags=["Lots"])
+logger = get_logger(__name__)
+
+router = APIRouter(prefix="/lots", tags=["Lots"], route_class=lane_route("read"))
 
 @router.get("", response_model=LotsListResponse)
+@profiled("list_lots")
 def list_lots(
+    request: Request,
     page: int = Query(1, ge=1, description="Page number"),
     limit: int = Query(50, ge=1, le=100, description="Items per page"),
     lot_number: Optional[str] = Query(None, description="Filter by lot number"),
-    db: Session = Depends(get_db),
+    search: Literal["substring", "prefix", "exact"] = Query("substring", description="How lot_number is matched"),
+    db: Session = Depends(get_read_db),
     current_admin: AdminUser = Depends(get_current_admin)
 ):
     """
     Get paginated list of all lots
     Requires admin authentication
+    lot_number search is index backed: prefix and exact use the B-tree,
+    substring (case-insensitive) a trigram index
+    Responses carry an ETag and are cached until the next upload, deletion or
+    token change; send If-None-Match to get 304 when nothing changed
     """
-    query = db.query(Lot)
-    
-    # Filter by lot_number if provided
-    if lot_number:
-        query = query.filter(Lot.lot_number.contains(lot_number))
-    
-    # Get total count
-    total = query.count()
-    
-    # Paginate
-    offset = (page - 1) * limit
-    lots = query.order_by(Lot.uploaded_at.desc()).offset(offset).limit(limit).all()
-    
-    # Add token name to each lot
-    lots_with_token = []
-    for lot in lots:
-        lot_dict = LotResponse.model_validate(lot).model_dump()
+    def build():
+        query = db.query(Lot)
+        
+        # Filter by lot_number if provided
+        if lot_number:
+            query = filter_lot_number(query, lot_number, search)
+        
+        # Get total count
+        total = query.count()
         
-        # Get token name
-        upload_session = db.query(UploadSession).filter(
-            UploadSession.id == lot.upload_session_id
-        ).first()
+        # Paginate
+        offset = (page - 1) * limit
+        lots = query.order_by(Lot.uploaded_at.desc()).offset(offset).limit(limit).all()
         
-        if upload_session and upload_session.token:
-            lot_dict['uploaded_by_token'] = upload_session.token.name
+        # Add token name to each lot
+        lots_with_token = []
+        for lot in lots:
+            lot_dict = LotResponse.model_validate(lot).model_dump()
+            
+            # Get token name
+            upload_session = db.query(UploadSession).filter(
+                UploadSession.id == lot.upload_session_id
+            ).first()
+            
+            if upload_session and upload_session.token:
+                lot_dict['uploaded_by_token'] = upload_session.token.name
+            
+            lots_with_token.append(LotResponse(**lot_dict))
         
-        lots_with_token.append(LotResponse(**lot_dict))
+        return LotsListResponse(
+            total=total,
+            page=page,
+            limit=limit,
+            lots=lots_with_token
+        )
+    
+    params = {"page": page, "limit": limit, "lot_number": lot_number, "search": search}
+    return cached_json_response(request, "list_lots", params, build)
+
+@router.get("/export")
+def export_lots(
+    format: Literal["ndjson", "csv", "arrow"] = Query("ndjson", description="Output format"),
+    since: Optional[datetime] = Query(None, description="Lots with records uploaded at or after this time"),
+    until: Optional[datetime] = Query(None, description="Lots with records uploaded before this time"),
+    token_id: Optional[int] = Query(None, description="Lots uploaded with this API token"),
+    lot_number: Optional[str] = Query(None, description="Filter by lot number"),
+    search: Literal["substring", "prefix", "exact"] = Query("substring", description="How lot_number is matched"),
+    db: Session = Depends(get_read_db),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """
+    Stream every record of the matching lots as one NDJSON, CSV or Arrow IPC stream
+    Requires admin authentication
+    Lots are read page by page and file by file as the client consumes the
+    response, memory use doesn't depend on the export size
+    """
+    if format == "arrow" and not arrow_available():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Arrow export requires pyarrow on the server"
+        )
     
-    return LotsListResponse(
-        total=total,
-        page=page,
-        limit=limit,
-        lots=lots_with_token
+    query = export_query(db, since, until, token_id, lot_number, search)
+    logger.info("Export started", extra={
+        "format": format,
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat() if until else None,
+        "token_id": token_id,
+        "lot_number": lot_number
+    })
+    
+    extension = "arrows" if format == "arrow" else format
+    filename = f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return StreamingResponse(
+        stream_export(query, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
 
 @router.get("/download/{lot_id}")
 def download_lot(
     lot_id: int,
-    db: Session = Depends(get_db),
+    accept_encoding: Optional[str] = Header(None, include_in_schema=False),
+    db: Session = Depends(get_read_db),
     current_admin: AdminUser = Depends(get_current_admin)
 ):
     """
     Download CSV file for a specific lot
+    Appended lots are streamed as one CSV with a single header
+    Archived lots are sent gzip encoded to clients accepting it, decompressed otherwise
     Requires admin authentication
     """
-    print(f"[DEBUG] Download requested for lot_id: {lot_id}")
+    logger.debug("Download requested", extra={"lot_id": lot_id})
     
     lot = db.query(Lot).filter(Lot.id == lot_id).first()
     
     if not lot:
-        print(f"[DEBUG] Lot {lot_id} not found in database")
-        # List available lots for debugging
-        all_lots = db.query(Lot.id, Lot.lot_number).all()
-        available_ids = [str(l.id) for l in all_lots]
-        print(f"[DEBUG] Available lot IDs: {', '.join(available_ids) if available_ids else 'None'}")
-        
+        logger.info("Lot not found for download", extra={"lot_id": lot_id})
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Lot with ID {lot_id} not found. Available lot IDs: {', '.join(available_ids) if available_ids else 'none - please upload data first'}"
+            detail=f"Lot with ID {lot_id} not found"
         )
     
-    print(f"[DEBUG] Lot found: {lot.lot_number}, file_path: {lot.file_path}")
+    logger.debug("Lot found", extra={"lot_id": lot_id, "lot_number": lot.lot_number, "file_path": lot.file_path})
     
-    file_path = str(lot.file_path)
-    if not os.path.exists(file_path):
-        print(f"[DEBUG] File not found at path: {file_path}")
+    with timed("file"):
+        files = open_lot_files(db, lot)
+    if files is None:
+        logger.warning("Lot file missing on disk", extra={"lot_id": lot_id, "file_path": lot.file_path})
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"File not found on server: {lot.file_name}"
         )
     
-    print(f"[DEBUG] Sending file: {file_path}")
-    return FileResponse(
-        path=file_path,
-        filename=str(lot.file_name),
-        media_type='text/csv'
+    archived = lot.archived_at is not None
+    
+    if len(files) == 1 and (not archived or "gzip" in (accept_encoding or "")):
+        file_path = files[0].name
+        files[0].close()
+        logger.debug("Sending file", extra={"lot_id": lot_id, "file_path": file_path})
+        return FileResponse(
+            path=file_path,
+            filename=str(lot.file_name),
+            media_type='text/csv',
+            # The archive is the gzip encoded CSV, sent as is
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"} if archived else None
+        )
+    
+    # Appended lot: the lot file (with the header) followed by its headerless segments,
+    # or an archive decompressed for a client without gzip support
+    logger.debug("Streaming lot files", extra={"lot_id": lot_id, "files": len(files), "archived": archived})
+    headers = {"Content-Disposition": f"attachment; filename*=utf-8''{quote(str(lot.file_name))}"}
+    if not archived:
+        headers["Content-Length"] = str(sum(os.fstat(f.fileno()).st_size for f in files))
+    
+    def stream_files():
+        try:
+            for f in files:
+                while chunk := f.read(1 << 20):
+                    yield chunk
+        finally:
+            for f in files:
+                f.close()
+    
+    return StreamingResponse(
+        stream_files(),
+        media_type='text/csv',
+        headers=headers
     )
 
 @router.post("/download-multiple", response_model=DownloadMultipleResponse)
 def download_multiple_lots(
     request: DownloadMultipleRequest,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_admin: AdminUser = Depends(get_current_admin)
 ):
     """
@@ -126,7 +223,7 @@ def download_multiple_lots(
             "lot_id": lot.id,
             "lot_number": lot.lot_number,
             "file_name": lot.file_name,
-            "available": os.path.exists(str(lot.file_path))
+            "available": all(os.path.exists(path) for path in lot_file_paths(db, lot))
         })
     
     return DownloadMultipleResponse(
@@ -137,33 +234,135 @@ def download_multiple_lots(
 
 @router.get("/stats", response_model=StatsResponse)
 def get_stats(
-    db: Session = Depends(get_db),
+    request: Request,
+    db: Session = Depends(get_read_db),
     current_admin: AdminUser = Depends(get_current_admin)
 ):
     """
     Get statistics about uploads
     Requires admin authentication
+    Cached with an ETag like the lot list
+    """
+    def build():
+        total_lots = db.query(func.count(Lot.id)).scalar()
+        total_records = db.query(func.sum(Lot.record_count)).scalar() or 0
+        total_uploads = db.query(func.count(UploadSession.id)).scalar()
+        active_tokens = db.query(func.count(APIToken.id)).filter(APIToken.is_active == True).scalar()
+        
+        return StatsResponse(
+            total_lots=total_lots,
+            total_records=total_records,
+            total_uploads=total_uploads,
+            active_tokens=active_tokens
+        )
+    
+    return cached_json_response(request, "get_stats", {}, build)
+
+@router.get("/stats/aggregate", response_model=AggregateResponse)
+@lane("heavy")
+def aggregate_records(
+    group_by: Literal["print_format", "day", "lot_number"] = Query(..., description="Count records per print format, upload day (UTC) or lot number"),
+    since: Optional[datetime] = Query(None, description="Lots with records uploaded at or after this time"),
+    until: Optional[datetime] = Query(None, description="Lots with records uploaded before this time"),
+    token_id: Optional[int] = Query(None, description="Lots uploaded with this API token"),
+    lot_number: Optional[str] = Query(None, description="Filter by lot number"),
+    search: Literal["substring", "prefix", "exact"] = Query("substring", description="How lot_number is matched"),
+    db: Session = Depends(get_read_db),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """
+    Record counts of the matching lots grouped by print format, day or lot number
+    Requires admin authentication
+    Reads only the grouped column of the lots' Parquet/Arrow sidecars; lots
+    written without a sidecar are counted from their CSV
+    """
+    query = export_query(db, since, until, token_id, lot_number, search)
+    with timed("aggregate"):
+        result = aggregate_lots(query, group_by)
+    
+    groups = sorted(result["counts"].items(), key=lambda item: (item[0] is None, item[0] or ""))
+    return AggregateResponse(
+        group_by=group_by,
+        total_records=sum(result["counts"].values()),
+        lots=result["lots"],
+        csv_files_scanned=result["csv_files"],
+        groups=[{"key": key, "count": count} for key, count in groups]
+    )
+
+@router.post("/bulk-delete", response_model=BulkDeleteResponse)
+@lane("heavy")
+def bulk_delete_lots(
+    request: BulkDeleteRequest,
+    db: Session = Depends(get_write_db),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """
+    Delete many lots at once, by ids or by the export filters
+    Requires admin authentication
+    Lot rows are deleted in one transaction; files (and, with
+    cascade_identifiers, the lots' QR identifiers) are removed by a
+    background job whose progress is at GET /lots/bulk-delete/{job_id}
     """
-    total_lots = db.query(func.count(Lot.id)).scalar()
-    total_records = db.query(func.sum(Lot.record_count)).scalar() or 0
-    total_uploads = db.query(func.count(UploadSession.id)).scalar()
-    active_tokens = db.query(func.count(APIToken.id)).filter(APIToken.is_active == True).scalar()
+    if request.lot_ids is not None:
+        lot_ids = list(set(request.lot_ids))
+    else:
+        query = export_query(db, request.since, request.until, request.token_id, request.lot_number, request.search)
+        lot_ids = [row.id for row in query.with_entities(Lot.id).all()]
     
-    return StatsResponse(
-        total_lots=total_lots,
-        total_records=total_records,
-        total_uploads=total_uploads,
-        active_tokens=active_tokens
+    deleted, job = delete_lots(db, lot_ids, request.cascade_identifiers)
+    
+    logger.info("Bulk deleted lots", extra={
+        "deleted_lots": deleted,
+        "cleanup_job_id": job.id if job else None,
+        "cascade_identifiers": request.cascade_identifiers
+    })
+    return BulkDeleteResponse(
+        message="Lots deleted, files are being removed" if job else "No matching lots",
+        deleted_lots=deleted,
+        cleanup_job_id=job.id if job else None
+    )
+
+@router.get("/bulk-delete/{job_id}", response_model=CleanupJobResponse)
+def get_bulk_delete_job(
+    job_id: int,
+    db: Session = Depends(get_write_db),
+    current_admin: AdminUser = Depends(get_current_admin)
+):
+    """
+    Progress of the background cleanup of a bulk deletion
+    Requires admin authentication
+    """
+    job = db.query(CleanupJob).filter(CleanupJob.id == job_id).first()
+    
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Cleanup job not found"
+        )
+    
+    return CleanupJobResponse(
+        id=job.id,
+        status=job.status,
+        total_files=job.total_files,
+        removed_files=job.removed_files,
+        missing_files=job.missing_files,
+        failed_files=job.failed_files,
+        deleted_identifiers=job.deleted_identifiers,
+        cascade_identifiers=job.identifier_keys is not None,
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+        error=job.error
     )
 
 @router.delete("/{lot_id}")
 def delete_lot(
     lot_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_write_db),
     current_admin: AdminUser = Depends(get_current_admin)
 ):
     """
-    Delete a lot and its CSV file
+    Delete a lot and its CSV files (including appended segments), and the
+    duplicate reports of upload sessions left without lots
     Requires admin authentication
     """
     lot = db.query(Lot).filter(Lot.id == lot_id).first()
@@ -174,19 +373,24 @@ def delete_lot(
             detail="Lot not found"
         )
     
-    # Delete file if exists
-    file_path = str(lot.file_path)
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-            print(f"[DEBUG] Deleted file: {file_path}")
-        except Exception as e:
-            # Log error but continue with database deletion
-            print(f"[ERROR] Error deleting file: {e}")
+    # Delete files, errors are logged and the database rows removed anyway
+    file_paths = lot_file_paths(db, lot) + lot_sidecar_paths(db, lot)
+    remove_files(file_paths)
+    logger.debug("Deleted lot files", extra={"lot_id": lot_id, "files": len(file_paths)})
     
     # Delete from database
+    session_ids = {lot.upload_session_id}
+    session_ids.update(row.upload_session_id for row in db.query(LotSource.upload_session_id).filter(LotSource.lot_id == lot_id))
+    db.query(LotSegment).filter(LotSegment.lot_id == lot_id).delete(synchronize_session=False)
+    db.query(LotSource).filter(LotSource.lot_id == lot_id).delete(synchronize_session=False)
     db.delete(lot)
+    db.flush()
+    report_paths = release_duplicate_reports(db, session_ids)
     db.commit()
+    bump_generation()
+    
+    for path in report_paths:
+        shutil.rmtree(path, ignore_errors=True)
     
-    print(f"[DEBUG] Deleted lot {lot_id} from database")
+    logger.info("Deleted lot", extra={"lot_id": lot_id})
     return {"message": "Lot deleted successfully"}
\ No newline at end of file
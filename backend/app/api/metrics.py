@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List
+from app.models.models import AdminUser
+from app.models.schemas import AdmissionStats, LaneStats
+from app.api.deps import get_current_admin
+from app.core.lanes import lane_stats
+from app.core.admission import get_admission_controller
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+@router.get("/lanes", response_model=List[LaneStats])
+async def get_lane_stats(current_admin: AdminUser = Depends(get_current_admin)):
+    """
+    Capacity, threads in use, queue depth and accumulated wait of each lane
+    Requires admin authentication
+    Counters are per worker process
+    """
+    return lane_stats()
+
+@router.get("/admission", response_model=AdmissionStats)
+async def get_admission_stats(current_admin: AdminUser = Depends(get_current_admin)):
+    """
+    Upload admission control: bytes in flight, queue depth and counters
+    Requires admin authentication
+    Counters are per worker process
+    """
+    controller = get_admission_controller()
+    if controller is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Admission control is disabled"
+        )
+    return controller.stats()
@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+import json
+from app.models.database import get_read_db
+from app.models.models import APIToken
+from app.models.schemas import QRLookupRequest, QRLookupResult
+from app.api.deps import validate_api_token
+from app.services.validator import DataValidator
+from app.core.logger import get_logger
+from app.core.lanes import lane_route
+
+router = APIRouter(prefix="/qr", tags=["QR"], route_class=lane_route("read"))
+
+logger = get_logger(__name__)
+
+@router.post(
+    "/lookup",
+    response_class=StreamingResponse,
+    responses={200: {
+        "description": "One QRLookupResult JSON object per line, in request order (qr_ids first)",
+        "content": {"application/x-ndjson": {"schema": QRLookupResult.model_json_schema()}}
+    }}
+)
+def lookup_qr(
+    request: QRLookupRequest,
+    db: Session = Depends(get_read_db),
+    api_token: APIToken = Depends(validate_api_token)
+):
+    """
+    Check whether QR IDs and/or QR texts are already registered, and where
+    Requires valid API token as query parameter
+    Up to 100k items per request; results are streamed as NDJSON while the
+    lookup batches run, so large requests don't wait for the whole result
+    """
+    logger.info("QR lookup", extra={
+        "token_id": api_token.id,
+        "qr_ids": len(request.qr_ids),
+        "qr_texts": len(request.qr_texts)
+    })
+    validator = DataValidator(db)
+
+    def stream_results():
+        buffer = []
+        for result in validator.lookup_identifiers(request.qr_ids, request.qr_texts):
+            buffer.append(json.dumps(result))
+            if len(buffer) >= 1000:
+                yield '\n'.join(buffer) + '\n'
+                buffer = []
+        if buffer:
+            yield '\n'.join(buffer) + '\n'
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
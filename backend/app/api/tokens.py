@@ -1,16 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 import secrets
-from app.models.database import get_db
-from app.models.models import APIToken
-from app.models.schemas import APITokenCreate, APITokenResponse
+from app.models.database import get_read_db, get_write_db
+from app.models.models import APIToken, TokenUsageHourly
+from app.models.schemas import APITokenCreate, APITokenResponse, APITokenLimits, TokenUsageBucket, TokenUsageResponse
+from app.services.token_usage import as_utc, hour_bucket
+from app.core.response_cache import bump_generation
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/tokens", tags=["API Tokens"])
 
 # Validation schema for public token generation
-class PublicTokenCreate(BaseModel):
+class PublicTokenCreate(APITokenLimits):
     name: str
     validation_string: str
 
@@ -23,7 +26,7 @@ def generate_token() -> str:
 @router.post("/generate", response_model=APITokenResponse)
 def create_api_token(
     token_data: PublicTokenCreate,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_write_db)
 ):
     """
     Generate a new API token for merchant access
@@ -43,30 +46,79 @@ def create_api_token(
     api_token = APIToken(
         token=token,
         name=token_data.name,
-        is_active=True
+        is_active=True,
+        rate_limit_requests=token_data.rate_limit_requests,
+        rate_limit_records=token_data.rate_limit_records
     )
     db.add(api_token)
     db.commit()
+    bump_generation()
     db.refresh(api_token)
     
     return api_token
 
 @router.get("", response_model=List[APITokenResponse])
 def list_api_tokens(
-    db: Session = Depends(get_db)
+    response: Response,
+    page: Optional[int] = Query(None, ge=1, description="Page number, all tokens when omitted"),
+    limit: int = Query(50, ge=1, le=500, description="Items per page"),
+    db: Session = Depends(get_write_db)
 ):
     """
-    Get all API tokens
+    Get all API tokens, or one page of them with page (total in X-Total-Count)
     PUBLIC ENDPOINT - No authentication required
     """
-    tokens = db.query(APIToken).order_by(APIToken.created_at.desc()).all()
-    return tokens
+    query = db.query(APIToken).order_by(APIToken.created_at.desc(), APIToken.id.desc())
+    if page is None:
+        return query.all()
+    
+    response.headers["X-Total-Count"] = str(query.count())
+    return query.offset((page - 1) * limit).limit(limit).all()
+
+@router.get("/{token_id}/usage", response_model=TokenUsageResponse)
+def get_api_token_usage(
+    token_id: int,
+    since: Optional[datetime] = Query(None, alias="from", description="Hours starting at or after this time (UTC if no offset)"),
+    until: Optional[datetime] = Query(None, alias="to", description="Hours starting before this time (UTC if no offset)"),
+    page: int = Query(1, ge=1, description="Page number"),
+    limit: int = Query(168, ge=1, le=1000, description="Hours per page"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Hourly uploads, records and bytes of an API token, oldest hour first
+    Reads the token_usage_hourly rollups only; hours without uploads are omitted
+    PUBLIC ENDPOINT - No authentication required
+    """
+    if not db.query(APIToken.id).filter(APIToken.id == token_id).first():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Token not found"
+        )
+    
+    # Served by the (token_id, bucket_start) primary key
+    query = db.query(TokenUsageHourly).filter(TokenUsageHourly.token_id == token_id)
+    if since is not None:
+        # A partial first hour is included
+        query = query.filter(TokenUsageHourly.bucket_start >= hour_bucket(since))
+    if until is not None:
+        query = query.filter(TokenUsageHourly.bucket_start < as_utc(until))
+    
+    total = query.count()
+    buckets = query.order_by(TokenUsageHourly.bucket_start).offset((page - 1) * limit).limit(limit).all()
+    
+    return TokenUsageResponse(
+        token_id=token_id,
+        total=total,
+        page=page,
+        limit=limit,
+        buckets=[TokenUsageBucket.model_validate(bucket) for bucket in buckets]
+    )
 
 @router.delete("/{token_id}")
 def delete_api_token(
     token_id: int,
     validation_string: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_write_db)
 ):
     """
     Delete an API token
@@ -87,8 +139,10 @@ def delete_api_token(
             detail="Token not found"
         )
     
+    db.query(TokenUsageHourly).filter(TokenUsageHourly.token_id == token_id).delete(synchronize_session=False)
     db.delete(token)
     db.commit()
+    bump_generation()
     
     return {"message": "Token deleted successfully"}
 
@@ -96,7 +150,7 @@ def delete_api_token(
 def toggle_api_token(
     token_id: int,
     validation_string: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_write_db)
 ):
     """
     Toggle API token active status
@@ -121,7 +175,44 @@ def toggle_api_token(
     current_status = bool(token.is_active)
     token.is_active = not current_status
     
+    db.commit()
+    bump_generation()
+    db.refresh(token)
+    
+    return {"message": "Token status updated", "is_active": bool(token.is_active)}
+
+@router.put("/{token_id}/limits", response_model=APITokenResponse)
+def update_api_token_limits(
+    token_id: int,
+    limits: APITokenLimits,
+    validation_string: str,
+    db: Session = Depends(get_write_db)
+):
+    """
+    Set the per-minute request and record rate limits of an API token
+    null uses the server default, 0 means unlimited
+    Running workers pick the new limits up on the token's next request
+    PUBLIC ENDPOINT - Requires validation string as query parameter
+    """
+    # Validate the secret string
+    if validation_string != REQUIRED_VALIDATION_STRING:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Invalid validation string"
+        )
+    
+    token = db.query(APIToken).filter(APIToken.id == token_id).first()
+    
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Token not found"
+        )
+    
+    token.rate_limit_requests = limits.rate_limit_requests
+    token.rate_limit_records = limits.rate_limit_records
+    
     db.commit()
     db.refresh(token)
     
-    return {"message": "Token status updated", "is_active": bool(token.is_active)}
\ No newline at end of file
+    return token
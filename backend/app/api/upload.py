@@ -1,98 +1,710 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Header, Response, Query, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from app.models.database import get_db
-from app.models.models import APIToken, UploadSession, Lot
-from app.models.schemas import UploadRequest, UploadResponse
-from app.api.deps import validate_api_token
+import json
+from app.models.database import get_read_db, get_write_db, mark_token_write
+from app.models.models import APIToken, UploadSession, UploadChunk, Lot, LotSource
+from app.models.schemas import UploadRequest, UploadResponse, UploadSessionResponse, ChunkUploadResponse
+from app.api.deps import (
+    validate_api_token, get_body_digest, get_body_size, enforce_record_limit,
+    get_upload_progress, get_session_progress
+)
 from app.services.validator import DataValidator
 from app.services.csv_generator import CSVGenerator
+from app.services.ingest_lock import ingest_lock
+from app.services.idempotency import IdempotencyService
+from app.services.token_usage import record_upload_usage
+from app.services.duplicate_report import DuplicateReport, UPLOAD_PART, chunk_part
+from app.services.cleanup import discard_upload_session, abort_upload_session
+from app.services.lot_segments import find_append_target, append_segment, needs_compaction, compact_lot, remove_files
+from typing import List, Optional
+from app.core.timing import timed
+from app.core.profiling import profiled
+from app.core.logger import get_logger
+from app.core.lanes import lane_route
+from app.core.response_cache import bump_generation
+from app.core.progress import TERMINAL_EVENTS, get_progress_hub
+from app.core.config import settings
 
-router = APIRouter(prefix="/upload", tags=["Upload"])
+router = APIRouter(prefix="/upload", tags=["Upload"], route_class=lane_route("heavy"))
+
+logger = get_logger(__name__)
+
+APPEND_DESCRIPTION = "Append records to the existing lot with the same lot_number (uploaded with this token) instead of creating a new lot"
+
+def duplicates_url(session_id: int, chunk_number: Optional[int] = None) -> str:
+    url = f"/api/upload/{session_id}/duplicates"
+    return url if chunk_number is None else f"{url}?chunk_number={chunk_number}"
+
+def schedule_compaction(db: Session, background_tasks: BackgroundTasks, lot_ids: List[int]):
+    """Merge the segments of lots that reached LOT_COMPACT_SEGMENTS after the response is sent"""
+    for lot_id in lot_ids:
+        if needs_compaction(db, lot_id):
+            background_tasks.add_task(compact_lot, lot_id)
 
 @router.post("", response_model=UploadResponse)
+@profiled("upload_data")
 def upload_data(
     request: UploadRequest,
-    db: Session = Depends(get_db),
-    api_token: APIToken = Depends(validate_api_token)
+    background_tasks: BackgroundTasks,
+    append: bool = Query(False, description=APPEND_DESCRIPTION),
+    db: Session = Depends(get_write_db),
+    api_token: APIToken = Depends(validate_api_token),
+    body_digest: str = Depends(get_body_digest),
+    body_size: int = Depends(get_body_size),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    progress=Depends(get_upload_progress)
 ):
     """
     Public endpoint for merchants to upload data
     Requires valid API token as query parameter
     
+    Send an Idempotency-Key header to make retries safe: repeating the
+    request with the same key and body returns the original response
+    without processing the records again
+    
+    Pass progress_id to follow the upload at GET /api/upload/{progress_id}/events
+    
+    With append=true, records for a lot_number this token uploaded before are
+    added to that lot as a new segment instead of creating another lot
+    
     Process:
     1. Validate data
     2. Check for duplicates
-    3. Group by lot_number
-    4. Generate CSV files
-    5. Save metadata
+    3. Save QR identifiers
+    4. Group by lot_number
+    5. Generate CSV files
+    6. Save metadata
+    
+    Steps 2-3 hold the ingest lock so concurrent uploads (also across
+    worker processes) can't both accept the same QR identifier
     """
+    idempotency = IdempotencyService(db, int(api_token.id), idempotency_key, body_digest)
+    cached = idempotency.cached_response()
+    if cached is not None:
+        progress.publish("completed", replayed=True)
+        return Response(content=cached, media_type="application/json")
+    
     # Convert Pydantic models to dicts
     records = [record.model_dump() for record in request.data]
+    enforce_record_limit(api_token, len(records))
     
     # Initialize services
-    validator = DataValidator(db)
-    csv_generator = CSVGenerator()
+    validator = DataValidator(db, progress)
+    csv_generator = CSVGenerator(progress)
+    progress.publish("received", total_records=len(records))
+    
+    with ingest_lock(db, records):
+        # A concurrent request with the same key may have completed while waiting
+        cached = idempotency.cached_response(locked=True)
+        if cached is not None:
+            progress.publish("completed", replayed=True)
+            return Response(content=cached, media_type="application/json")
+        
+        # Validate and check duplicates
+        with timed("validation"):
+            validation_result = validator.validate_records(records)
+        
+        valid_records = validation_result['valid_records']
+        duplicate_records = validation_result['duplicate_records']
+        
+        if not valid_records:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="All records are duplicates. No data to upload."
+            )
+        
+        # Create upload session
+        upload_session = UploadSession()
+        upload_session.token_id = int(api_token.id)  # Explicit cast
+        upload_session.total_records = validation_result['total_records']
+        upload_session.valid_records = validation_result['valid_count']
+        upload_session.duplicate_records = validation_result['duplicate_count']
+        idempotency.attach(upload_session)
+        
+        db.add(upload_session)
+        record_upload_usage(
+            db, upload_session.token_id,
+            uploads=1,
+            total_records=validation_result['total_records'],
+            valid_records=validation_result['valid_count'],
+            duplicate_records=validation_result['duplicate_count'],
+            body_bytes=body_size
+        )
+        db.commit()
+        db.refresh(upload_session)
+        
+        # Get the actual ID value as int
+        session_id = int(upload_session.id)
+        progress.publish("session", upload_session_id=session_id)
+        
+        # Save QR identifiers for future duplicate checking
+        # Use the int value, not the Column
+        # From here on a failure discards the session, or its committed
+        # identifiers would reject every retry of these records as duplicates
+        try:
+            validator.save_identifiers(valid_records, session_id)
+        except Exception:
+            discard_upload_session(db, session_id)
+            raise
     
-    # Validate and check duplicates
-    validation_result = validator.validate_records(records)
+    written = []
+    try:
+        # Full duplicate list, outside the ingest lock; the path commits with the lots
+        upload_session.duplicates_path = DuplicateReport(session_id).write(UPLOAD_PART, duplicate_records)
+        
+        # Group records by lot_number
+        lots_data = validator.group_by_lot(valid_records)
+        
+        # Generate CSV files for each lot
+        lots_created = []
+        lots_appended = []
+        appended_lot_ids = []
+        for lot_number, lot_records in lots_data.items():
+            target = find_append_target(db, upload_session.token_id, lot_number) if append else None
+            if target is not None:
+                segment_path = csv_generator.save_segment(lot_records)
+                written.append(segment_path)
+                sidecar_path = csv_generator.save_sidecar(segment_path, lot_records)
+                if sidecar_path:
+                    written.append(sidecar_path)
+                append_segment(db, target.id, session_id, segment_path, len(lot_records), sidecar_path)
+                lots_appended.append(lot_number)
+                appended_lot_ids.append(target.id)
+                continue
+            
+            # Save to CSV
+            file_info = csv_generator.save_to_csv(lot_number, lot_records)
+            written.append(file_info['file_path'])
+            
+            # Save lot metadata
+            lot = Lot()
+            lot.lot_number = lot_number
+            lot.record_count = len(lot_records)
+            lot.file_path = file_info['file_path']
+            lot.file_name = file_info['file_name']
+            lot.sidecar_path = csv_generator.save_sidecar(file_info['file_path'], lot_records)
+            if lot.sidecar_path:
+                written.append(lot.sidecar_path)
+            lot.upload_session_id = session_id  # Use the int value
+            
+            db.add(lot)
+            lots_created.append(lot_number)
+        
+        # Prepare response, cached for Idempotency-Key retries in the same commit as the lots
+        response = UploadResponse(
+            message="Data uploaded successfully",
+            total_records=validation_result['total_records'],
+            valid_records=validation_result['valid_count'],
+            duplicate_records=validation_result['duplicate_count'],
+            lots_created=lots_created,
+            lots_appended=lots_appended,
+            duplicates=duplicate_records[:100] if duplicate_records else None,  # Limit to first 100
+            duplicates_url=duplicates_url(session_id) if duplicate_records else None
+        )
+        idempotency.store_response(upload_session, response)
+        
+        db.commit()
+    except Exception:
+        discard_upload_session(db, session_id, written)
+        raise
     
-    valid_records = validation_result['valid_records']
-    duplicate_records = validation_result['duplicate_records']
+    bump_generation()
+    mark_token_write(api_token.token)
+    schedule_compaction(db, background_tasks, appended_lot_ids)
+    
+    logger.info("Upload completed", extra={
+        "upload_session_id": session_id,
+        "token_id": upload_session.token_id,
+        "total_records": validation_result['total_records'],
+        "valid_records": validation_result['valid_count'],
+        "duplicate_records": validation_result['duplicate_count'],
+        "lots_created": len(lots_created),
+        "lots_appended": len(lots_appended)
+    })
+    
+    progress.publish("completed", upload_session_id=session_id, **response.model_dump(exclude={"duplicates"}))
+    
+    return response
+
+# Chunked uploads
+# 1. POST /upload/sessions opens a session
+# 2. PUT /upload/sessions/{id}/chunks/{n} sends numbered chunks, each validated,
+#    deduped and staged on disk as it arrives; re-sending a chunk is a no-op
+# 3. POST /upload/sessions/{id}/finalize creates the lots from the staged chunks
+# DELETE /upload/sessions/{id} aborts an open session instead
+
+def get_token_session(db: Session, session_id: int, api_token: APIToken) -> UploadSession:
+    """Load an upload session owned by the calling token"""
+    upload_session = db.query(UploadSession).filter(
+        UploadSession.id == session_id,
+        UploadSession.token_id == api_token.id
+    ).first()
     
-    if not valid_records:
+    if not upload_session:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="All records are duplicates. No data to upload."
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload session not found"
         )
     
-    # Create upload session
+    return upload_session
+
+def session_response(db: Session, upload_session: UploadSession) -> UploadSessionResponse:
+    chunk_numbers = db.query(UploadChunk.chunk_number).filter(
+        UploadChunk.upload_session_id == upload_session.id
+    ).order_by(UploadChunk.chunk_number).all()
+    
+    return UploadSessionResponse(
+        upload_session_id=upload_session.id,
+        status=upload_session.status,
+        total_records=upload_session.total_records,
+        valid_records=upload_session.valid_records,
+        duplicate_records=upload_session.duplicate_records,
+        chunks_received=[c.chunk_number for c in chunk_numbers]
+    )
+
+@router.post("/sessions", response_model=UploadSessionResponse)
+def open_upload_session(
+    db: Session = Depends(get_write_db),
+    api_token: APIToken = Depends(validate_api_token)
+):
+    """
+    Open a chunked upload session
+    Requires valid API token as query parameter
+    """
     upload_session = UploadSession()
-    upload_session.token_id = int(api_token.id)  # Explicit cast
-    upload_session.total_records = validation_result['total_records']
-    upload_session.valid_records = validation_result['valid_count']
-    upload_session.duplicate_records = validation_result['duplicate_count']
+    upload_session.token_id = int(api_token.id)
+    upload_session.total_records = 0
+    upload_session.valid_records = 0
+    upload_session.duplicate_records = 0
+    upload_session.status = "open"
     
     db.add(upload_session)
     db.commit()
+    bump_generation()
+    mark_token_write(api_token.token)
     db.refresh(upload_session)
     
-    # Get the actual ID value as int
-    session_id = int(upload_session.id)
+    return session_response(db, upload_session)
+
+@router.get("/sessions/{session_id}", response_model=UploadSessionResponse)
+def get_upload_session(
+    session_id: int,
+    db: Session = Depends(get_read_db),
+    api_token: APIToken = Depends(validate_api_token)
+):
+    """
+    Get session status and received chunk numbers, to resume an interrupted upload
+    """
+    upload_session = get_token_session(db, session_id, api_token)
+    return session_response(db, upload_session)
+
+@router.delete("/sessions/{session_id}")
+def delete_upload_session(
+    session_id: int,
+    db: Session = Depends(get_write_db),
+    api_token: APIToken = Depends(validate_api_token),
+    progress=Depends(get_session_progress)
+):
+    """
+    Abort an open chunked session: its staged chunks are dropped and the QR
+    identifiers they reserved are released, so the records can be uploaded again
+    Sessions left open are aborted after UPLOAD_SESSION_TTL_HOURS without a chunk
+    """
+    upload_session = get_token_session(db, session_id, api_token)
+    
+    if upload_session.status != "open":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload session is {upload_session.status}"
+        )
+    
+    if not abort_upload_session(db, session_id):
+        # Finalize started meanwhile
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload session is no longer open"
+        )
+    
+    mark_token_write(api_token.token)
+    progress.publish("failed", status_code=status.HTTP_410_GONE, detail="Upload session aborted")
+    return {"message": "Upload session aborted"}
+
+@router.put("/sessions/{session_id}/chunks/{chunk_number}", response_model=ChunkUploadResponse)
+@profiled("upload_chunk")
+def upload_chunk(
+    request: UploadRequest,
+    session_id: int,
+    chunk_number: int = Path(..., ge=0),
+    db: Session = Depends(get_write_db),
+    api_token: APIToken = Depends(validate_api_token),
+    body_digest: str = Depends(get_body_digest),
+    body_size: int = Depends(get_body_size),
+    progress=Depends(get_session_progress)
+):
+    """
+    Upload one numbered chunk of a chunked session
+    Records are validated, deduped (against the database and earlier chunks)
+    and staged on disk right away
+    Idempotent: re-sending a received chunk with the same body returns its
+    original result, a different body for the same number is rejected
+    """
+    upload_session = get_token_session(db, session_id, api_token)
     
-    # Group records by lot_number
-    lots_data = validator.group_by_lot(valid_records)
+    if upload_session.status != "open":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload session is {upload_session.status}"
+        )
     
-    # Generate CSV files for each lot
-    lots_created = []
-    for lot_number, lot_records in lots_data.items():
-        # Save to CSV
-        file_info = csv_generator.save_to_csv(lot_number, lot_records)
+    def existing_chunk_response():
+        chunk = db.query(UploadChunk).filter(
+            UploadChunk.upload_session_id == session_id,
+            UploadChunk.chunk_number == chunk_number
+        ).first()
+        if chunk is None:
+            return None
         
-        # Save lot metadata
-        lot = Lot()
-        lot.lot_number = lot_number
-        lot.record_count = len(lot_records)
-        lot.file_path = file_info['file_path']
-        lot.file_name = file_info['file_name']
-        lot.upload_session_id = session_id  # Use the int value
+        if chunk.body_digest != body_digest:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Chunk {chunk_number} was already received with a different body"
+            )
         
-        db.add(lot)
-        lots_created.append(lot_number)
+        return ChunkUploadResponse(
+            upload_session_id=session_id,
+            chunk_number=chunk_number,
+            total_records=chunk.total_records,
+            valid_records=chunk.valid_records,
+            duplicate_records=chunk.duplicate_records,
+            replayed=True,
+            duplicates_url=duplicates_url(session_id, chunk_number) if chunk.duplicate_records else None
+        )
     
-    db.commit()
+    # Cheap check first, retries don't need the lock
+    replay = existing_chunk_response()
+    if replay is not None:
+        return replay
     
-    # Save QR identifiers for future duplicate checking
-    # Use the int value, not the Column
-    validator.save_identifiers(valid_records, session_id)
+    records = [record.model_dump() for record in request.data]
+    enforce_record_limit(api_token, len(records))
+    validator = DataValidator(db, progress)
+    csv_generator = CSVGenerator(progress)
+    progress.publish("chunk_received", chunk_number=chunk_number, total_records=len(records))
     
-    # Prepare response
-    response = UploadResponse(
-        message="Data uploaded successfully",
+    with ingest_lock(db, records):
+        # A concurrent retry of the same chunk may have completed meanwhile
+        replay = existing_chunk_response()
+        if replay is not None:
+            return replay
+        
+        with timed("validation"):
+            validation_result = validator.validate_records(records)
+        
+        valid_records = validation_result['valid_records']
+        lots_data = validator.group_by_lot(valid_records)
+        
+        # Stage first: if anything below fails the chunk is simply re-sent
+        csv_generator.stage_chunk(session_id, chunk_number, lots_data)
+        duplicates_path = DuplicateReport(session_id).write(chunk_part(chunk_number), validation_result['duplicate_records'])
+        
+        # Identifiers, chunk row and session counters commit together; on
+        # failure identifiers the shard files already committed are deleted
+        try:
+            validator.save_identifiers(valid_records, session_id, commit=False)
+            db.add(UploadChunk(
+                upload_session_id=session_id,
+                chunk_number=chunk_number,
+                body_digest=body_digest,
+                total_records=validation_result['total_records'],
+                valid_records=validation_result['valid_count'],
+                duplicate_records=validation_result['duplicate_count'],
+                lot_counts=json.dumps({lot_number: len(lot_records) for lot_number, lot_records in lots_data.items()})
+            ))
+            still_open = db.query(UploadSession).filter(
+                UploadSession.id == session_id,
+                UploadSession.status == "open"
+            ).update({
+                UploadSession.total_records: UploadSession.total_records + validation_result['total_records'],
+                UploadSession.valid_records: UploadSession.valid_records + validation_result['valid_count'],
+                UploadSession.duplicate_records: UploadSession.duplicate_records + validation_result['duplicate_count'],
+                UploadSession.duplicates_path: func.coalesce(UploadSession.duplicates_path, duplicates_path)
+            }, synchronize_session=False)
+            
+            if not still_open:
+                # Finalize or abort started while this chunk was being validated
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Upload session is no longer open"
+                )
+            
+            record_upload_usage(
+                db, upload_session.token_id,
+                total_records=validation_result['total_records'],
+                valid_records=validation_result['valid_count'],
+                duplicate_records=validation_result['duplicate_count'],
+                body_bytes=body_size
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            validator.discard_unsaved_identifiers()
+            raise
+        mark_token_write(api_token.token)
+    
+    duplicate_records = validation_result['duplicate_records']
+    response = ChunkUploadResponse(
+        upload_session_id=session_id,
+        chunk_number=chunk_number,
         total_records=validation_result['total_records'],
         valid_records=validation_result['valid_count'],
         duplicate_records=validation_result['duplicate_count'],
-        lots_created=lots_created,
-        duplicates=duplicate_records[:100] if duplicate_records else None  # Limit to first 100
+        duplicates=duplicate_records[:100] if duplicate_records else None,  # Limit to first 100
+        duplicates_url=duplicates_url(session_id, chunk_number) if duplicate_records else None
+    )
+    progress.publish("chunk_stored", **response.model_dump(exclude={"duplicates"}))
+    return response
+
+@router.post("/sessions/{session_id}/finalize", response_model=UploadResponse)
+def finalize_upload_session(
+    session_id: int,
+    background_tasks: BackgroundTasks,
+    append: bool = Query(False, description=APPEND_DESCRIPTION),
+    db: Session = Depends(get_write_db),
+    api_token: APIToken = Depends(validate_api_token),
+    progress=Depends(get_session_progress)
+):
+    """
+    Finalize a chunked session: one Lot and CSV per lot_number
+    Records were validated when their chunk arrived, so this only
+    concatenates staged fragments and writes lot metadata
+    Finalizing an already finalized session returns the same result
+    With append=true, lots this token uploaded before get the records as a new segment
+    """
+    upload_session = get_token_session(db, session_id, api_token)
+    
+    if upload_session.status == "aborting":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload session is being aborted"
+        )
+    
+    if upload_session.status in ("open", "finalizing"):
+        # Stop accepting chunks; a chunk committing concurrently either lands
+        # before this update (and is read below) or is rejected
+        db.query(UploadSession).filter(
+            UploadSession.id == session_id,
+            UploadSession.status == "open"
+        ).update({UploadSession.status: "finalizing"}, synchronize_session=False)
+        db.commit()
+        
+        chunks = db.query(UploadChunk.chunk_number, UploadChunk.lot_counts).filter(
+            UploadChunk.upload_session_id == session_id
+        ).order_by(UploadChunk.chunk_number).all()
+        
+        # Record count and chunks per lot, in order of first appearance
+        lot_counts = {}
+        lot_chunks = {}
+        for chunk in chunks:
+            for lot_number, count in json.loads(chunk.lot_counts).items():
+                lot_counts[lot_number] = lot_counts.get(lot_number, 0) + count
+                lot_chunks.setdefault(lot_number, []).append(chunk.chunk_number)
+        
+        if not lot_counts:
+            # Nothing to finalize yet, keep accepting chunks
+            db.query(UploadSession).filter(UploadSession.id == session_id).update(
+                {UploadSession.status: "open"}, synchronize_session=False
+            )
+            db.commit()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="All records are duplicates. No data to upload."
+            )
+        
+        csv_generator = CSVGenerator(progress)
+        assembled = []
+        appended_lot_ids = []
+        for lot_number, record_count in lot_counts.items():
+            target = find_append_target(db, upload_session.token_id, lot_number) if append else None
+            file_info = csv_generator.assemble_lot(session_id, lot_number, lot_chunks[lot_number], header=target is None)
+            sidecar_path = csv_generator.save_sidecar(file_info['file_path'], header=target is None)
+            assembled += [path for path in (file_info['file_path'], sidecar_path) if path]
+            
+            if target is not None:
+                append_segment(db, target.id, session_id, file_info['file_path'], record_count, sidecar_path)
+                appended_lot_ids.append(target.id)
+                continue
+            
+            lot = Lot()
+            lot.lot_number = lot_number
+            lot.record_count = record_count
+            lot.file_path = file_info['file_path']
+            lot.file_name = file_info['file_name']
+            lot.sidecar_path = sidecar_path
+            lot.upload_session_id = session_id
+            db.add(lot)
+        
+        won = db.query(UploadSession).filter(
+            UploadSession.id == session_id,
+            UploadSession.status == "finalizing"
+        ).update({UploadSession.status: "finalized"}, synchronize_session=False)
+        
+        if won:
+            # Records and bytes were counted as the chunks arrived
+            record_upload_usage(db, upload_session.token_id, uploads=1)
+            db.commit()
+            bump_generation()
+            mark_token_write(api_token.token)
+            csv_generator.discard_staging(session_id)
+            schedule_compaction(db, background_tasks, appended_lot_ids)
+            logger.info("Chunked upload finalized", extra={
+                "upload_session_id": session_id,
+                "token_id": upload_session.token_id,
+                "total_records": upload_session.total_records,
+                "valid_records": upload_session.valid_records,
+                "lots_created": len(lot_counts) - len(appended_lot_ids),
+                "lots_appended": len(appended_lot_ids)
+            })
+        else:
+            # A concurrent finalize of the same session committed first
+            db.rollback()
+            remove_files(assembled)
+        
+        db.refresh(upload_session)
+    
+    lots = db.query(Lot.lot_number).filter(Lot.upload_session_id == session_id).order_by(Lot.id).all()
+    appended = db.query(Lot.lot_number).join(LotSource, LotSource.lot_id == Lot.id).filter(
+        LotSource.upload_session_id == session_id
+    ).order_by(Lot.id).all()
+    
+    response = UploadResponse(
+        message="Data uploaded successfully",
+        total_records=upload_session.total_records,
+        valid_records=upload_session.valid_records,
+        duplicate_records=upload_session.duplicate_records,
+        lots_created=[lot.lot_number for lot in lots],
+        lots_appended=[lot.lot_number for lot in appended],
+        duplicates_url=duplicates_url(session_id) if upload_session.duplicates_path else None
+    )
+    progress.publish("completed", upload_session_id=session_id, **response.model_dump(exclude={"duplicates"}))
+    return response
+
+@router.get(
+    "/{session_id}/duplicates",
+    response_class=StreamingResponse,
+    responses={200: {
+        "description": "One duplicate record ({qr_id, lot_number, reason}) per line, X-Total-Count holds the total",
+        "content": {"application/x-ndjson": {}}
+    }}
+)
+def get_upload_duplicates(
+    session_id: int,
+    offset: int = Query(0, ge=0, description="Duplicates to skip"),
+    limit: Optional[int] = Query(None, ge=1, description="Duplicates to return, all when omitted"),
+    chunk_number: Optional[int] = Query(None, ge=0, description="Only the duplicates of this chunk (chunked uploads)"),
+    db: Session = Depends(get_read_db),
+    api_token: APIToken = Depends(validate_api_token)
+):
+    """
+    Full list of the duplicate records rejected by an upload, streamed as NDJSON
+    in the order validation reported them (chunk by chunk for chunked uploads)
+    Page through it with offset and limit; upload responses only carry the first 100
+    Kept for RETENTION_DUPLICATE_REPORTS_DAYS and until the upload's lots are deleted
+    """
+    upload_session = get_token_session(db, session_id, api_token)
+    
+    if chunk_number is not None and upload_session.status == "completed":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="chunk_number only applies to chunked upload sessions"
+        )
+    
+    parts = []
+    if upload_session.duplicates_path is not None:
+        if upload_session.status == "completed":
+            parts = [(UPLOAD_PART, upload_session.duplicate_records)]
+        else:
+            query = db.query(UploadChunk.chunk_number, UploadChunk.duplicate_records).filter(
+                UploadChunk.upload_session_id == session_id,
+                UploadChunk.duplicate_records > 0
+            )
+            if chunk_number is not None:
+                query = query.filter(UploadChunk.chunk_number == chunk_number)
+            parts = [(chunk_part(chunk.chunk_number), chunk.duplicate_records) for chunk in query.order_by(UploadChunk.chunk_number)]
+    
+    lines = DuplicateReport(session_id).iter_lines(parts, offset, limit)
+    
+    def stream_lines():
+        buffer = []
+        for line in lines:
+            buffer.append(line)
+            if len(buffer) >= 1000:
+                yield ''.join(buffer)
+                buffer = []
+        if buffer:
+            yield ''.join(buffer)
+    
+    return StreamingResponse(
+        stream_lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Total-Count": str(sum(count for _, count in parts))}
     )
+
+# Seconds between keep-alive comments of an idle event stream
+EVENTS_KEEPALIVE_SECONDS = 15.0
+
+def format_event(event) -> str:
+    return f"id: {event.id}\nevent: {event.name}\ndata: {json.dumps(event.data, default=str)}\n\n"
+
+@router.get(
+    "/{upload_id}/events",
+    response_class=StreamingResponse,
+    responses={200: {
+        "description": "Server-sent progress events, ending after completed or failed",
+        "content": {"text/event-stream": {}}
+    }}
+)
+async def get_upload_events(
+    upload_id: str = Path(..., max_length=64, description="Session id of a chunked upload, or the progress_id of an upload"),
+    api_token: APIToken = Depends(validate_api_token)
+):
+    """
+    Stream the progress of an upload as server-sent events: records_hashed,
+    batch_checked, identifiers_saved and lot_written with running counts,
+    then completed (or failed) with the upload's result
+    A stream opened late starts with the latest event. Events are kept in the
+    worker process handling the upload, so send both requests to the same one
+    A client reading slower than events arrive skips older ones, the counts
+    are cumulative
+    """
+    if settings.PROGRESS_MAX_CHANNELS <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Progress events are disabled"
+        )
     
-    return response
\ No newline at end of file
+    hub = get_progress_hub()
+    key = (int(api_token.id), upload_id)
+    
+    async def stream_events():
+        # Subscribed once streaming starts, so the finally below always unsubscribes
+        subscription = hub.subscribe(key)
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                events = await subscription.next_events(EVENTS_KEEPALIVE_SECONDS)
+                if not events:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield "".join(format_event(event) for event in events)
+                if any(event.name in TERMINAL_EVENTS for event in events):
+                    return
+        finally:
+            hub.unsubscribe(key, subscription)
+    
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,292 @@
+import json
+import math
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Deque, Dict, Optional
+from urllib.parse import parse_qs
+import anyio
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.timing import current_timings
+
+logger = get_logger(__name__)
+
+# Decoded size assumed per byte of a gzip/zstd encoded body (JSON compresses well)
+ENCODED_BODY_RATIO = 8
+# Tokens remembered as authenticated, see admission_key
+VERIFIED_TOKENS_SIZE = 4096
+# Fair share key of requests whose token hasn't authenticated in this process
+UNVERIFIED_KEY = ""
+
+
+class _Waiter:
+    __slots__ = ("token", "cost", "event", "granted")
+
+    def __init__(self, token: str, cost: int):
+        self.token = token
+        self.cost = cost
+        self.event = anyio.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    Budget of upload body bytes in flight in this worker process
+    A request is admitted when its estimated size fits in the remaining
+    budget and its token stays within a fair share: the budget divided
+    by the tokens currently holding or waiting for capacity. Requests that
+    don't fit queue in arrival order for a bounded time; when the queue is
+    full, the token with the most queued requests gives up its newest one
+    to a token with fewer. A request larger than the whole budget is
+    admitted alone
+    All state is touched from the event loop only, no locking needed
+    """
+
+    def __init__(self, budget: int, max_queued: int, queue_timeout: float):
+        self.budget = budget
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.by_token: Dict[str, int] = {}
+        self.waiters: Deque[_Waiter] = deque()
+        self.admitted = 0
+        self.rejected = 0
+
+    def _fair_share(self, token: str) -> float:
+        tokens = set(self.by_token) | {waiter.token for waiter in self.waiters} | {token}
+        return self.budget / len(tokens)
+
+    def _fits(self, token: str, cost: int) -> bool:
+        if self.in_flight == 0:
+            return True
+        if self.in_flight + cost > self.budget:
+            return False
+        held = self.by_token.get(token, 0)
+        # A token's first request always fits its share, so every merchant makes progress
+        return held == 0 or held + cost <= self._fair_share(token)
+
+    def _take(self, token: str, cost: int):
+        self.in_flight += cost
+        self.by_token[token] = self.by_token.get(token, 0) + cost
+        self.admitted += 1
+
+    def release(self, token: str, cost: int):
+        self.in_flight -= cost
+        held = self.by_token.get(token, 0) - cost
+        if held > 0:
+            self.by_token[token] = held
+        else:
+            self.by_token.pop(token, None)
+        self._grant_waiters()
+
+    def _grant_waiters(self):
+        # In arrival order, skipping waiters whose token is over its share
+        for waiter in list(self.waiters):
+            if self._fits(waiter.token, waiter.cost):
+                self.waiters.remove(waiter)
+                self._take(waiter.token, waiter.cost)
+                waiter.granted = True
+                waiter.event.set()
+
+    async def acquire(self, token: str, cost: int) -> bool:
+        """Wait for capacity, False when the request is rejected (queue full, evicted or timed out)"""
+        cost = min(cost, self.budget)
+        if not self.waiters and self._fits(token, cost):
+            self._take(token, cost)
+            return True
+
+        if len(self.waiters) >= self.max_queued and not self._evict_for(token):
+            self.rejected += 1
+            return False
+
+        waiter = _Waiter(token, cost)
+        self.waiters.append(waiter)
+        # Queued behind others, but its token may still fit where theirs don't
+        self._grant_waiters()
+
+        try:
+            with anyio.move_on_after(self.queue_timeout):
+                await waiter.event.wait()
+        except BaseException:
+            # Client went away while queued
+            self._abandon(waiter)
+            raise
+
+        if waiter.granted:
+            return True
+        self._abandon(waiter)
+        self.rejected += 1
+        return False
+
+    def _evict_for(self, token: str) -> bool:
+        """
+        Make room in a full queue for a token with fewer waiters than the
+        token with the most, whose newest waiter is rejected
+        """
+        if not self.waiters:
+            # Nothing queued to give way (ADMISSION_MAX_QUEUED=0)
+            return False
+        counts = Counter(waiter.token for waiter in self.waiters)
+        top_token, top_count = counts.most_common(1)[0]
+        if counts.get(token, 0) + 1 >= top_count:
+            return False
+
+        victim = next(waiter for waiter in reversed(self.waiters) if waiter.token == top_token)
+        self.waiters.remove(victim)
+        victim.event.set()
+        return True
+
+    def _abandon(self, waiter: _Waiter):
+        if waiter.granted:
+            self.release(waiter.token, waiter.cost)
+            return
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+        # Its token no longer counts towards the fair share of the others
+        self._grant_waiters()
+
+    def stats(self) -> dict:
+        return {
+            "budget_bytes": self.budget,
+            "in_flight_bytes": self.in_flight,
+            "active_tokens": len(self.by_token),
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+_controller: Optional[AdmissionController] = None
+_verified_tokens: "OrderedDict[str, None]" = OrderedDict()
+_verified_lock = threading.Lock()
+
+
+def mark_token_verified(token: str):
+    """Record a token that authenticated, called by validate_api_token"""
+    with _verified_lock:
+        _verified_tokens[token] = None
+        _verified_tokens.move_to_end(token)
+        if len(_verified_tokens) > VERIFIED_TOKENS_SIZE:
+            _verified_tokens.popitem(last=False)
+
+
+def forget_token(token: str):
+    """Drop a token that failed to authenticate (e.g. deactivated)"""
+    with _verified_lock:
+        _verified_tokens.pop(token, None)
+
+
+def admission_key(token: str) -> str:
+    """
+    Fair share key of an upload, decided before the request is authenticated:
+    its token once that token has authenticated in this process, otherwise
+    one bucket shared by all unknown and missing tokens, so rotating made up
+    tokens doesn't buy extra shares
+    """
+    with _verified_lock:
+        return token if token in _verified_tokens else UNVERIFIED_KEY
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """Process-wide controller, None when ADMISSION_MAX_INFLIGHT_BYTES is 0"""
+    global _controller
+
+    if _controller is None and settings.ADMISSION_MAX_INFLIGHT_BYTES > 0:
+        _controller = AdmissionController(
+            settings.ADMISSION_MAX_INFLIGHT_BYTES,
+            settings.ADMISSION_MAX_QUEUED,
+            settings.ADMISSION_QUEUE_TIMEOUT
+        )
+    return _controller
+
+
+def estimate_body_size(headers) -> int:
+    """
+    Decoded body size from Content-Length; encoded bodies are scaled by
+    ENCODED_BODY_RATIO and chunked bodies of unknown length count as the
+    largest allowed. A request with neither header has no body
+    """
+    content_length = None
+    encoded = False
+    chunked = False
+    for name, value in headers:
+        if name == b"content-length":
+            try:
+                content_length = int(value)
+            except ValueError:
+                pass
+        elif name == b"content-encoding" and value.strip().lower() not in (b"", b"identity"):
+            encoded = True
+        elif name == b"transfer-encoding" and b"chunked" in value.lower():
+            chunked = True
+
+    if content_length is None:
+        return settings.MAX_UPLOAD_SIZE if chunked else 0
+    if encoded:
+        return min(content_length * ENCODED_BODY_RATIO, settings.MAX_UPLOAD_SIZE)
+    return content_length
+
+
+class UploadAdmissionMiddleware:
+    """
+    ASGI middleware applying admission control to upload requests before
+    their body is read; rejected requests get 429 with Retry-After
+    Capacity is held until the response has been sent. Requests without a
+    body (opening or finalizing a chunked session) are not admission controlled
+    """
+
+    def __init__(self, app, path_prefix: str = "/api/upload"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "Upload capacity exhausted, retry later"}).encode()
+        retry_after = max(1, math.ceil(settings.ADMISSION_QUEUE_TIMEOUT))
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        controller = get_admission_controller()
+        if (controller is None
+                or scope["type"] != "http"
+                or scope["method"] not in ("POST", "PUT")
+                or not scope["path"].startswith(self.path_prefix)):
+            await self.app(scope, receive, send)
+            return
+
+        cost = estimate_body_size(scope["headers"])
+        if cost == 0:
+            await self.app(scope, receive, send)
+            return
+
+        # Uploads authenticate with ?token=, only tokens known to be valid get a share of their own
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        token = admission_key(query.get("token", [""])[0])
+
+        started = time.perf_counter()
+        admitted = await controller.acquire(token, cost)
+        timings = current_timings()
+        if timings is not None:
+            timings.add("admission_wait", time.perf_counter() - started)
+
+        if not admitted:
+            logger.warning("Upload rejected by admission control", extra={
+                "estimated_bytes": cost,
+                **controller.stats()
+            })
+            await self._reject(send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(token, min(cost, controller.budget))
@@ -0,0 +1,175 @@
+import json
+import zlib
+from typing import Optional
+from fastapi import HTTPException, status
+from app.core.config import settings
+
+
+class _GzipStream:
+    """Incremental gzip (or zlib) decoder with a bound on the output size"""
+
+    def __init__(self):
+        # 32 + MAX_WBITS: accept both gzip and zlib headers
+        self._decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        try:
+            return self._decompressor.decompress(data, max_length)
+        except zlib.error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid gzip request body")
+
+    @property
+    def eof(self) -> bool:
+        return self._decompressor.eof
+
+
+class _ZstdStream:
+    """
+    Incremental zstd decoder
+    Uses compression.zstd (Python 3.14+) which bounds each output, otherwise the
+    optional zstandard package, where the size is checked after each chunk
+    """
+
+    def __init__(self):
+        try:
+            from compression import zstd
+            self._decompressor = zstd.ZstdDecompressor()
+            self._bounded = True
+            self._error = zstd.ZstdError
+        except ImportError:
+            try:
+                import zstandard
+            except ImportError:
+                raise HTTPException(
+                    status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                    detail="zstd request bodies are not supported by this server"
+                )
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+            self._bounded = False
+            self._error = zstandard.ZstdError
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        try:
+            if self._bounded:
+                return self._decompressor.decompress(data, max_length)
+            return self._decompressor.decompress(data)
+        except self._error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid zstd request body")
+
+    @property
+    def eof(self) -> bool:
+        return getattr(self._decompressor, "eof", True)
+
+
+DECODERS = {
+    "gzip": _GzipStream,
+    "x-gzip": _GzipStream,
+    "deflate": _GzipStream,
+    "zstd": _ZstdStream,
+}
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,  # Content Too Large
+        detail=f"Request body exceeds the {limit} byte limit"
+    )
+
+
+class UploadBodyMiddleware:
+    """
+    ASGI middleware for upload request bodies
+    - Enforces MAX_COMPRESSED_UPLOAD_SIZE on the bytes received and
+      MAX_UPLOAD_SIZE on the decoded body, incrementally while the body
+      streams in, so oversized requests are rejected before being fully read
+    - Accepts Content-Encoding: gzip / zstd and decodes as a stream; the app
+      sees a plain body
+    """
+
+    def __init__(self, app, path_prefix: str = "/api/upload"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def _reject(self, send, exc: HTTPException):
+        body = json.dumps({"detail": exc.detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": exc.status_code,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http"
+                or scope["method"] not in ("POST", "PUT")
+                or not scope["path"].startswith(self.path_prefix)):
+            await self.app(scope, receive, send)
+            return
+
+        encoding = ""
+        content_length: Optional[int] = None
+        passthrough_headers = []
+        for name, value in scope["headers"]:
+            if name == b"content-encoding":
+                encoding = value.decode("latin-1").strip().lower()
+                continue
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    pass
+            passthrough_headers.append((name, value))
+
+        max_decoded = settings.MAX_UPLOAD_SIZE
+        if encoding in ("", "identity"):
+            decoder = None
+            max_received = max_decoded
+        elif encoding in DECODERS:
+            try:
+                decoder = DECODERS[encoding]()
+            except HTTPException as exc:
+                await self._reject(send, exc)
+                return
+            max_received = settings.MAX_COMPRESSED_UPLOAD_SIZE
+            # Content-Length describes the encoded body, the app gets the decoded one
+            passthrough_headers = [(n, v) for n, v in passthrough_headers if n != b"content-length"]
+        else:
+            await self._reject(send, HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail=f"Unsupported Content-Encoding: {encoding}"
+            ))
+            return
+
+        # Declared size over the limit: reject without reading anything
+        if content_length is not None and content_length > max_received:
+            await self._reject(send, _too_large(max_received))
+            return
+
+        received = 0
+        decoded = 0
+
+        async def receive_limited():
+            nonlocal received, decoded
+
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+
+            body = message.get("body", b"")
+            received += len(body)
+            if received > max_received:
+                raise _too_large(max_received)
+
+            if decoder is not None:
+                # Ask for one byte more than allowed to detect overflow
+                body = decoder.decompress(body, max_decoded - decoded + 1)
+                if not message.get("more_body", False) and not decoder.eof and len(body) <= max_decoded - decoded:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Truncated compressed request body")
+
+            decoded += len(body)
+            if decoded > max_decoded:
+                raise _too_large(max_decoded)
+
+            return {**message, "body": body}
+
+        await self.app({**scope, "headers": passthrough_headers}, receive_limited, send)
@@ -9,19 +9,100 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str = "sqlite:///./data.db"
+    DATABASE_READ_URL: Optional[str] = None  # Replica (e.g. PostgreSQL streaming replica) for read-only endpoints
+    # Without DATABASE_READ_URL, read-only endpoints use a pool of their own: read-only WAL
+    # connections to the same file on SQLite, the primary otherwise
+    DATABASE_READ_SPLIT: bool = True
+    READ_YOUR_WRITES_SECONDS: float = 5.0  # With a replica, a token reads from the primary this long after uploading
     
     # Security
     SECRET_KEY: str = "dev-secret-key-change-in-production-12345678"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 1440
+    PASSWORD_POOL_WORKERS: int = 2  # bcrypt processes, 0 uses threads of a dedicated pool instead
+    PASSWORD_POOL_MAX_PENDING: int = 16  # Running + queued hash/verify calls before logins get 503
+    PASSWORD_CACHE_TTL_SECONDS: int = 60  # Successful verifications reused for this long, 0 disables
+    PASSWORD_CACHE_SIZE: int = 1024
     
     # Upload settings
     UPLOAD_DIR: str = "./uploads"
-    MAX_UPLOAD_SIZE: int = 524288000  # 500MB
+    MAX_UPLOAD_SIZE: int = 524288000  # 500MB, decoded request body
+    MAX_COMPRESSED_UPLOAD_SIZE: int = 104857600  # 100MB, gzip/zstd encoded request body
+    IDEMPOTENCY_KEY_TTL_HOURS: int = 24  # Cached upload responses are replayed for this long
+    IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS: int = 600  # A keyed upload without a response after this long is retried as failed
+    UPLOAD_SESSION_TTL_HOURS: int = 24  # Open chunked sessions without a chunk for this long are aborted by the retention run, 0 disables
+    # Upload admission control per worker process (app/core/admission.py), 0 disables
+    ADMISSION_MAX_INFLIGHT_BYTES: int = 536870912  # 512MB of request bodies, estimated from Content-Length
+    ADMISSION_MAX_QUEUED: int = 32  # Uploads waiting for capacity before new ones get 429
+    ADMISSION_QUEUE_TIMEOUT: float = 10.0  # Seconds an upload may wait, also the Retry-After hint
+    # Per-token rate limits (app/core/rate_limit.py), used when the token has no limit of its own; 0 disables
+    RATE_LIMIT_REQUESTS_PER_MINUTE: int = 600  # Requests authenticated with the token
+    RATE_LIMIT_RECORDS_PER_MINUTE: int = 0  # Records uploaded (single uploads and chunks)
+    RATE_LIMIT_BACKEND: str = "memory"  # memory (each worker process enforces the limit) or sqlite (shared by the workers of a host)
+    RATE_LIMIT_SQLITE_PATH: str = "./rate_limits.db"
+    TOKEN_USAGE_FLUSH_SECONDS: float = 5.0  # usage_count / last_used_at are written in batches this often
+    # Upload progress events streamed at /api/upload/{id}/events (app/core/progress.py), per worker process
+    PROGRESS_MAX_CHANNELS: int = 1024  # Uploads followed at once, 0 disables
+    PROGRESS_BUFFER_SIZE: int = 64  # Events buffered per stream, the oldest are dropped for slow clients
+    PROGRESS_RETAIN_SECONDS: float = 60.0  # Final state of an upload stays available this long
+    CLEANUP_JOB_STALE_SECONDS: int = 300  # A running bulk delete cleanup without progress for this long is requeued
+    LOT_COMPACT_SEGMENTS: int = 8  # Appended segments per lot before they are merged in the background
+    LOT_SIDECAR_FORMAT: Optional[str] = None  # parquet or arrow: columnar copy of each lot for reports (needs pyarrow)
+    
+    # Retention (python -m app.services.retention, 0 disables a policy)
+    RETENTION_ARCHIVE_LOTS_DAYS: int = 0  # Lots without uploads for this long are moved to gzip archives
+    RETENTION_COLD_IDENTIFIERS_DAYS: int = 0  # Identifiers older than this move to the cold tier
+    RETENTION_DUPLICATE_REPORTS_DAYS: int = 30  # Full duplicate lists of older uploads are deleted
+    RETENTION_BATCH_SIZE: int = 10000
+    
+    # QR identifier partitioning (0 disables)
+    # PostgreSQL: hash partitions of qr_identifiers, SQLite: shard files in QR_SHARD_DIR
+    QR_PARTITIONS: int = 0
+    QR_SHARD_DIR: str = "./qr_shards"
+    QR_PARTITION_WORKERS: int = 4
+    
+    # On-disk digest index used as the first duplicate check
+    DIGEST_INDEX_ENABLED: bool = False
+    DIGEST_INDEX_DIR: str = "./digest_index"
+    DIGEST_INDEX_DELTA_LIMIT: int = 200000  # In-memory digests before flushing a segment
+    DIGEST_INDEX_MAX_SEGMENTS: int = 8  # Segments per kind before compaction
+    DIGEST_INDEX_SYNC_OVERLAP: int = 10000  # Ids re-read on PostgreSQL, where commits can land out of order
+    
+    # Production server (run_server.py --prod)
+    SERVER_WORKERS: int = 0  # 0 uses the CPU count
+    SERVER_MAX_REQUESTS: int = 10000  # Worker is recycled after this many requests
+    SERVER_MAX_REQUESTS_JITTER: int = 1000
+    SERVER_GRACEFUL_TIMEOUT: int = 30  # Seconds
+    # Apply pending migrations when the startup version check finds the schema behind,
+    # otherwise startup fails until migrate.py is run (production workers)
+    INIT_DB_ON_STARTUP: bool = True
+    INGEST_LOCK_BUCKETS: int = 64  # Advisory lock buckets for concurrent dedupe+insert
+    
+    # Threads per lane for sync endpoints (app/core/lanes.py)
+    LANE_HEAVY_SIZE: int = 4  # Uploads, bulk deletes, aggregations
+    LANE_READ_SIZE: int = 16  # Lot listings, stats, downloads, QR lookups
+    LANE_DEFAULT_SIZE: int = 40  # AnyIO's shared limiter: other endpoints and dependencies
+    
+    # ETag cache of lot listings and stats per worker process (app/core/response_cache.py), 0 disables
+    RESPONSE_CACHE_SIZE: int = 256
     
     # CORS
     FRONTEND_URL: str = "http://localhost:3000"
     
+    # Request timing / profiling
+    SERVER_TIMING_ENABLED: bool = True
+    PROFILING_ENABLED: bool = False
+    PROFILE_SAMPLE_RATE: float = 0.0  # Fraction of requests profiled, 0.0 - 1.0
+    PROFILE_HEADER: str = "X-Profile"
+    PROFILER: str = "cprofile"  # cprofile or pyinstrument
+    PROFILE_DIR: str = "./profiles"
+    
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"  # json or text
+    LOG_SAMPLE_RATE: float = 1.0  # Fraction of DEBUG records kept
+    LOG_FILE: Optional[str] = None
+    
     model_config = {
         "env_file": ".env",
         "env_file_encoding": "utf-8",
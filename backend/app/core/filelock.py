@@ -0,0 +1,37 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Fallback when advisory file locks are unavailable: serializes within this process only
+_local_locks: dict = {}
+_local_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Exclusive advisory lock on a file, shared by all worker processes
+    The lock file is created if needed and never removed
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    if fcntl is None:
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(os.path.abspath(path), threading.Lock())
+        with lock:
+            yield
+        return
+
+    with open(path, "a+b") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
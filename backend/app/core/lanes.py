@@ -0,0 +1,125 @@
+import functools
+import inspect
+import time
+from typing import Callable, Dict, List, Optional, Type
+import anyio
+from fastapi.routing import APIRoute
+from app.core.config import settings
+from app.core.timing import current_timings
+
+
+class Lane:
+    """
+    Capacity limit of its own for the sync endpoints of one class of work
+    Endpoints in a lane run in worker threads like other sync endpoints,
+    but never more than size at a time, and never take threads from the
+    shared AnyIO limiter that dependencies and the other endpoints use
+    """
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.limiter = anyio.CapacityLimiter(size)
+        self.requests = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def run(self, func: Callable):
+        queued = time.perf_counter()
+        started = None
+
+        def call():
+            nonlocal started
+            started = time.perf_counter()
+            return func()
+
+        try:
+            return await anyio.to_thread.run_sync(call, limiter=self.limiter)
+        finally:
+            if started is not None:
+                self._record(started - queued)
+
+    def _record(self, wait: float):
+        self.requests += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        timings = current_timings()
+        if timings is not None:
+            timings.add("lane_wait", wait)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "capacity": int(self.limiter.total_tokens),
+            "in_use": int(self.limiter.borrowed_tokens),
+            "waiting": self.limiter.statistics().tasks_waiting,
+            "requests": self.requests,
+            "wait_seconds_total": self.wait_total,
+            "wait_seconds_max": self.wait_max,
+        }
+
+
+# heavy: uploads and other bulk CPU/DB work; read: latency-sensitive listings and downloads
+_lanes: Dict[str, Lane] = {
+    "heavy": Lane("heavy", settings.LANE_HEAVY_SIZE),
+    "read": Lane("read", settings.LANE_READ_SIZE),
+}
+
+
+def get_lane(name: str) -> Lane:
+    return _lanes[name]
+
+
+def lane(name: str):
+    """Decorator moving one endpoint to another lane than its router's"""
+    get_lane(name)
+
+    def decorator(func):
+        func.lane = name
+        return func
+    return decorator
+
+
+def _run_in_lane(endpoint: Callable, lane_: Lane) -> Callable:
+    # Async wrapper, so FastAPI awaits it instead of using its own threadpool;
+    # functools.wraps keeps the signature FastAPI reads the parameters from
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        return await lane_.run(functools.partial(endpoint, *args, **kwargs))
+    return wrapper
+
+
+class LaneRoute(APIRoute):
+    """Route class running sync endpoints in lane_name, or the lane set with @lane"""
+    lane_name: Optional[str] = None
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        name = getattr(endpoint, "lane", None) or self.lane_name
+        if name is not None and not inspect.iscoroutinefunction(inspect.unwrap(endpoint)):
+            endpoint = _run_in_lane(endpoint, get_lane(name))
+        super().__init__(path, endpoint, **kwargs)
+
+
+def lane_route(name: str) -> Type[APIRoute]:
+    """route_class for an APIRouter whose sync endpoints run in the named lane"""
+    get_lane(name)
+    return type(f"{name.title()}LaneRoute", (LaneRoute,), {"lane_name": name})
+
+
+def configure_default_limiter():
+    """Size AnyIO's shared limiter (other sync endpoints, dependencies), call in the event loop"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.LANE_DEFAULT_SIZE
+
+
+def lane_stats() -> List[dict]:
+    """Current load and accumulated wait of every lane, plus the shared default limiter"""
+    default = anyio.to_thread.current_default_thread_limiter()
+    stats = [{
+        "name": "default",
+        "capacity": int(default.total_tokens),
+        "in_use": int(default.borrowed_tokens),
+        "waiting": default.statistics().tasks_waiting,
+        "requests": None,
+        "wait_seconds_total": None,
+        "wait_seconds_max": None,
+    }]
+    return stats + [lane_.stats() for lane_ in _lanes.values()]
@@ -0,0 +1,25 @@
+import importlib
+import threading
+from types import ModuleType
+from typing import Dict, Optional
+
+# Optional dependencies are imported on first use rather than at startup:
+# pyarrow and numpy alone add a few hundred milliseconds to every worker start
+_modules: Dict[str, Optional[ModuleType]] = {}
+_lock = threading.Lock()
+
+
+def optional_import(name: str) -> Optional[ModuleType]:
+    """Module by name, imported on the first call; None when it isn't installed"""
+    try:
+        return _modules[name]
+    except KeyError:
+        pass
+
+    with _lock:
+        if name not in _modules:
+            try:
+                _modules[name] = importlib.import_module(name)
+            except ImportError:
+                _modules[name] = None
+    return _modules[name]
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.security import get_hashed_password, verify_password
+
+logger = get_logger(__name__)
+
+# Keys recent successful verifications; random per process so the cache
+# never holds anything that could be checked against a password offline
+_CACHE_KEY = secrets.token_bytes(32)
+
+
+class PasswordPool:
+    """
+    Dedicated bounded pool for bcrypt hashing and verification
+    Keeps bcrypt off the AnyIO threadpool that serves uploads and downloads.
+    Requests beyond PASSWORD_POOL_MAX_PENDING (running + queued) are rejected
+    at once with 503 instead of queueing behind a burst of logins
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+        self._pid: Optional[int] = None
+
+    def _get_executor(self) -> Executor:
+        # Created in the process that uses it: a pool inherited through fork is unusable
+        if self._executor is None or self._pid != os.getpid():
+            if self.workers > 0:
+                # spawn, forking a process with running threads is unsafe
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._executor = ThreadPoolExecutor(max(1, self.max_pending), thread_name_prefix="password")
+            self._pid = os.getpid()
+        return self._executor
+
+    def _release(self, future: Future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                logger.warning("Password pool full, request rejected", extra={"pending": self._pending})
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many concurrent authentication requests, retry shortly",
+                    headers={"Retry-After": "1"}
+                )
+            self._pending += 1
+            executor = self._get_executor()
+
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        # Released when the work ends, not when a disconnected client stops waiting
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+
+class VerificationCache:
+    """Recent successful verifications, keyed by username, stored hash and an HMAC of the password"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, bytes], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(username: str, password: str, hashed_password: str) -> Tuple[str, str, bytes]:
+        # The stored hash is part of the key, so a password change invalidates the entry
+        digest = hmac.new(_CACHE_KEY, password.encode("utf-8"), hashlib.sha256).digest()
+        return username, hashed_password, digest
+
+    def hit(self, key) -> bool:
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, key):
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_pool: Optional[PasswordPool] = None
+_pool_lock = threading.Lock()
+_cache = VerificationCache(settings.PASSWORD_CACHE_TTL_SECONDS, settings.PASSWORD_CACHE_SIZE)
+
+
+def get_password_pool() -> PasswordPool:
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PasswordPool(settings.PASSWORD_POOL_WORKERS, settings.PASSWORD_POOL_MAX_PENDING)
+    return _pool
+
+
+async def verify_password_async(username: str, password: str, hashed_password: str) -> bool:
+    """verify_password on the password pool, answering repeated successful logins from the cache"""
+    use_cache = settings.PASSWORD_CACHE_TTL_SECONDS > 0
+    key = VerificationCache.key(username, password, hashed_password) if use_cache else None
+    if use_cache and _cache.hit(key):
+        return True
+
+    valid = await get_password_pool().run(verify_password, password, hashed_password)
+    if valid and use_cache:
+        _cache.add(key)
+    return valid
+
+
+async def hash_password_async(password: str) -> str:
+    """get_hashed_password on the password pool"""
+    return await get_password_pool().run(get_hashed_password, password)
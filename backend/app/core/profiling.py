@@ -0,0 +1,84 @@
+import cProfile
+import functools
+import os
+import threading
+from datetime import datetime
+from app.core.config import settings
+from app.core.timing import current_timings
+
+# Only one profiler can be active in the interpreter at a time
+_profiler_lock = threading.Lock()
+
+
+def _profile_path(name: str, extension: str) -> str:
+    """
+    Generate unique profile filename
+    Format: {name}_{timestamp}_{pid}_{thread}.{extension}
+    """
+    if not os.path.exists(settings.PROFILE_DIR):
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    filename = f"{name}_{timestamp}_{os.getpid()}_{threading.get_ident()}.{extension}"
+    return os.path.join(settings.PROFILE_DIR, filename)
+
+
+def _pyinstrument_available() -> bool:
+    try:
+        import pyinstrument  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _run_pyinstrument(name: str, func, args, kwargs):
+    from pyinstrument import Profiler
+
+    profiler = Profiler()
+    profiler.start()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.stop()
+        with open(_profile_path(name, "html"), "w", encoding="utf-8") as f:
+            f.write(profiler.output_html())
+
+
+def _run_cprofile(name: str, func, args, kwargs):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(_profile_path(name, "prof"))
+
+
+def profiled(name: str):
+    """
+    Decorator for sync endpoints: capture a profile of the call when the
+    current request was sampled by ServerTimingMiddleware
+    cProfile output (.prof) can be opened with snakeviz or pstats,
+    pyinstrument output (.html) in a browser
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            timings = current_timings()
+            if timings is None or not timings.profile:
+                return func(*args, **kwargs)
+
+            # Skip instead of waiting if another request is being profiled
+            if not _profiler_lock.acquire(blocking=False):
+                return func(*args, **kwargs)
+
+            try:
+                # pyinstrument is optional, fall back to cProfile
+                if settings.PROFILER == "pyinstrument" and _pyinstrument_available():
+                    return _run_pyinstrument(name, func, args, kwargs)
+                return _run_cprofile(name, func, args, kwargs)
+            finally:
+                _profiler_lock.release()
+
+        return wrapper
+    return decorator
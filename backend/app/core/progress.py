@@ -0,0 +1,179 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Hashable, List, Optional, Set
+from app.core.config import settings
+
+# Events after which a channel's stream ends (errors of a chunk or finalize
+# attempt are published as "error", the session can still complete)
+TERMINAL_EVENTS = ("completed", "failed")
+
+
+class ProgressEvent:
+    __slots__ = ("id", "name", "data")
+
+    def __init__(self, id: int, name: str, data: dict):
+        self.id = id
+        self.name = name
+        self.data = data
+
+
+class Subscription:
+    """
+    Bounded buffer of one stream's pending events; when the client reads
+    slower than events arrive the oldest are dropped (events carry
+    cumulative counts, the newest one is what matters)
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, size: int):
+        self.events: Deque[ProgressEvent] = deque(maxlen=size)
+        self.dropped = 0
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def push(self, event: ProgressEvent):
+        # Called from the publishing worker thread
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # Loop closed, the stream is gone
+            pass
+
+    async def next_events(self, timeout: float) -> List[ProgressEvent]:
+        """Pending events, waiting up to timeout for some; empty on timeout"""
+        if not self.events:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._wakeup.clear()
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+
+class _Channel:
+    __slots__ = ("subscribers", "last", "finished_at")
+
+    def __init__(self):
+        self.subscribers: Set[Subscription] = set()
+        self.last: Optional[ProgressEvent] = None
+        self.finished_at: Optional[float] = None
+
+
+class ProgressHub:
+    """
+    In-process pub/sub of upload progress, one channel per upload
+    Publishing is a dict lookup plus one append per subscriber, and the
+    services publish per batch, never per record. The last event of each
+    channel is kept so a stream opened mid-upload (or shortly after it
+    finished) starts from the current state; at most max_channels are kept
+    """
+
+    def __init__(self, max_channels: int, buffer_size: int, retain_seconds: float):
+        self.max_channels = max_channels
+        self.buffer_size = buffer_size
+        self.retain_seconds = retain_seconds
+        self._channels: "OrderedDict[Hashable, _Channel]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _channel(self, key: Hashable) -> _Channel:
+        channel = self._channels.get(key)
+        if channel is None:
+            channel = self._channels[key] = _Channel()
+            self._evict()
+        self._channels.move_to_end(key)
+        return channel
+
+    def _evict(self):
+        # Oldest idle channels first: finished ones past retention, then any without subscribers
+        now = time.monotonic()
+        for key, channel in list(self._channels.items()):
+            if len(self._channels) <= self.max_channels:
+                return
+            expired = channel.finished_at is not None and now - channel.finished_at > self.retain_seconds
+            if expired or not channel.subscribers:
+                del self._channels[key]
+
+    def publish(self, key: Hashable, name: str, data: dict):
+        event = ProgressEvent(next(self._ids), name, data)
+        with self._lock:
+            channel = self._channel(key)
+            channel.last = event
+            if name in TERMINAL_EVENTS:
+                channel.finished_at = time.monotonic()
+            subscribers = list(channel.subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+
+    def subscribe(self, key: Hashable) -> Subscription:
+        """Call in the event loop; the channel's last event, if any, is delivered first"""
+        subscription = Subscription(asyncio.get_running_loop(), self.buffer_size)
+        with self._lock:
+            channel = self._channel(key)
+            # A finished channel past retention belongs to an earlier upload with the same id
+            if channel.finished_at is not None and time.monotonic() - channel.finished_at > self.retain_seconds:
+                channel.last = None
+                channel.finished_at = None
+            if channel.last is not None:
+                subscription.events.append(channel.last)
+            channel.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, key: Hashable, subscription: Subscription):
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is not None:
+                channel.subscribers.discard(subscription)
+
+
+class ProgressPublisher:
+    """Publishes the events of one upload to its channel"""
+
+    def __init__(self, hub: ProgressHub, key: Hashable):
+        self.hub = hub
+        self.key = key
+
+    def publish(self, name: str, **data):
+        self.hub.publish(self.key, name, data)
+
+
+class NullPublisher:
+    """Publisher of services used outside an upload, or with progress disabled"""
+
+    def publish(self, name: str, **data):
+        pass
+
+
+NULL_PUBLISHER = NullPublisher()
+
+_hub: Optional[ProgressHub] = None
+_hub_lock = threading.Lock()
+
+
+def get_progress_hub() -> ProgressHub:
+    global _hub
+
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = ProgressHub(
+                    settings.PROGRESS_MAX_CHANNELS,
+                    settings.PROGRESS_BUFFER_SIZE,
+                    settings.PROGRESS_RETAIN_SECONDS
+                )
+    return _hub
+
+
+def progress_publisher(key: Hashable):
+    """Publisher for a channel, the no-op publisher when PROGRESS_MAX_CHANNELS is 0"""
+    if settings.PROGRESS_MAX_CHANNELS <= 0:
+        return NULL_PUBLISHER
+    return ProgressPublisher(get_progress_hub(), key)
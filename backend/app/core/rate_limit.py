@@ -0,0 +1,233 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, status
+from app.core.config import settings
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Remaining: whole tokens left after this request; reset_after: seconds until the bucket is full again
+RateLimitResult = namedtuple("RateLimitResult", ["allowed", "limit", "remaining", "reset_after", "retry_after"])
+
+# Header prefix per limit kind
+HEADER_PREFIXES = {
+    "requests": "X-RateLimit",
+    "records": "X-RateLimit-Records",
+}
+
+_current_headers: ContextVar[Optional[Dict[str, str]]] = ContextVar("rate_limit_headers", default=None)
+
+# Idle buckets are dropped from memory once there are more than this many (a full bucket equals no bucket)
+MEMORY_PRUNE_THRESHOLD = 10000
+
+
+def _take(tokens: float, elapsed: float, capacity: float, rate: float, cost: float) -> Tuple[bool, float]:
+    """
+    Refill a bucket for the elapsed time and take cost from it
+    A cost above the capacity is admitted from a full bucket and leaves it in
+    debt, so large uploads still pass at the configured long-run rate
+    """
+    tokens = min(capacity, tokens + max(elapsed, 0.0) * rate)
+    if tokens >= min(cost, capacity):
+        return True, tokens - cost
+    return False, tokens
+
+
+class MemoryBucketStore:
+    """Buckets of this worker process, each worker enforces the full limit"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float, cost: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            allowed, tokens = _take(tokens, now - updated, capacity, rate, cost)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > MEMORY_PRUNE_THRESHOLD:
+                self._prune(now, capacity / rate)
+        return allowed, tokens
+
+    def _prune(self, now: float, full_after: float):
+        for key, (_, updated) in list(self._buckets.items()):
+            if now - updated > full_after:
+                del self._buckets[key]
+
+
+class SQLiteBucketStore:
+    """
+    Buckets in a local SQLite file shared by the workers of one host
+    Separate from the application database; each check is one short
+    IMMEDIATE transaction on a per-thread connection
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # A connection inherited through fork must not be used
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key: str, capacity: float, rate: float, cost: float) -> Tuple[bool, float]:
+        conn = self._connection()
+        # Wall clock, monotonic clocks aren't comparable across processes
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row is not None else (capacity, now)
+            allowed, tokens = _take(tokens, now - updated, capacity, rate, cost)
+            conn.execute(
+                "INSERT INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, tokens
+
+
+class RateLimiter:
+    """
+    Token buckets holding limit_per_minute tokens, refilled continuously at
+    limit_per_minute / 60 per second; a request takes cost tokens
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def check(self, key: str, limit_per_minute: int, cost: int = 1) -> RateLimitResult:
+        capacity = float(limit_per_minute)
+        rate = capacity / 60.0
+        allowed, tokens = self.store.take(key, capacity, rate, float(cost))
+        reset_after = max(0.0, (capacity - tokens) / rate)
+        retry_after = 0.0 if allowed else (min(cost, capacity) - tokens) / rate
+        return RateLimitResult(allowed, limit_per_minute, max(0, math.floor(tokens)), reset_after, retry_after)
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide limiter on the RATE_LIMIT_BACKEND store"""
+    global _limiter
+
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                if settings.RATE_LIMIT_BACKEND == "sqlite":
+                    store = SQLiteBucketStore(settings.RATE_LIMIT_SQLITE_PATH)
+                elif settings.RATE_LIMIT_BACKEND == "memory":
+                    store = MemoryBucketStore()
+                else:
+                    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {settings.RATE_LIMIT_BACKEND}")
+                _limiter = RateLimiter(store)
+    return _limiter
+
+
+def rate_limit_headers(kind: str, result: RateLimitResult) -> Dict[str, str]:
+    prefix = HEADER_PREFIXES[kind]
+    headers = {
+        f"{prefix}-Limit": str(result.limit),
+        f"{prefix}-Remaining": str(result.remaining),
+        f"{prefix}-Reset": str(math.ceil(result.reset_after)),
+    }
+    if not result.allowed:
+        headers["Retry-After"] = str(max(1, math.ceil(result.retry_after)))
+    return headers
+
+
+def default_limit(kind: str) -> int:
+    if kind == "records":
+        return settings.RATE_LIMIT_RECORDS_PER_MINUTE
+    return settings.RATE_LIMIT_REQUESTS_PER_MINUTE
+
+
+def enforce_rate_limit(token_id: int, kind: str, limit_per_minute: Optional[int], cost: int = 1):
+    """
+    Take cost from the token's bucket of the given kind, 429 with Retry-After when empty
+    The limit headers are added to the response of the current request
+    limit_per_minute None uses the setting for the kind, 0 means unlimited
+    """
+    if limit_per_minute is None:
+        limit_per_minute = default_limit(kind)
+    if limit_per_minute <= 0:
+        return
+
+    result = get_rate_limiter().check(f"{kind}:{token_id}", limit_per_minute, cost)
+    headers = rate_limit_headers(kind, result)
+    pending = _current_headers.get()
+    if pending is not None:
+        pending.update(headers)
+
+    if not result.allowed:
+        logger.warning("Rate limit exceeded", extra={
+            "token_id": token_id,
+            "kind": kind,
+            "limit_per_minute": limit_per_minute,
+            "cost": cost
+        })
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Rate limit of {limit_per_minute} {kind} per minute exceeded",
+            headers=headers
+        )
+
+
+class RateLimitHeadersMiddleware:
+    """
+    ASGI middleware adding the X-RateLimit-* headers set by enforce_rate_limit
+    to the response, whatever response class the endpoint returns
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Mutated in place from the dependency threads, which run in a copy of this context
+        pending: Dict[str, str] = {}
+        reset = _current_headers.set(pending)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and pending:
+                headers: List[Tuple[bytes, bytes]] = list(message.get("headers", []))
+                present = {name.lower() for name, _ in headers}
+                for name, value in pending.items():
+                    if name.lower().encode() not in present:
+                        headers.append((name.lower().encode(), value.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _current_headers.reset(reset)
@@ -0,0 +1,63 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Optional
+from app.core.config import settings
+from app.core.filelock import file_lock
+
+SLOT_FORMAT = "<d"
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT)
+# Keys hash into this many slots; a collision only sends a few more reads to the primary
+SLOTS = 4096
+
+
+class RecentWrites:
+    """
+    Time of the last write per key (an API token) shared by the worker
+    processes of a host: wall clock timestamps in a memory-mapped file,
+    read and written without locking
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._map: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+
+    def _mapped(self) -> mmap.mmap:
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    with file_lock(self.path + ".lock"):
+                        with open(self.path, "a+b") as f:
+                            if os.fstat(f.fileno()).st_size < SLOTS * SLOT_SIZE:
+                                f.truncate(SLOTS * SLOT_SIZE)
+                            self._map = mmap.mmap(f.fileno(), SLOTS * SLOT_SIZE)
+        return self._map
+
+    @staticmethod
+    def _offset(key: str) -> int:
+        return (zlib.crc32(key.encode()) % SLOTS) * SLOT_SIZE
+
+    def mark(self, key: str):
+        struct.pack_into(SLOT_FORMAT, self._mapped(), self._offset(key), time.time())
+
+    def written_within(self, key: str, seconds: float) -> bool:
+        written_at = struct.unpack_from(SLOT_FORMAT, self._mapped(), self._offset(key))[0]
+        return time.time() - written_at < seconds
+
+
+_recent_writes: Optional[RecentWrites] = None
+_recent_writes_lock = threading.Lock()
+
+
+def get_recent_writes() -> RecentWrites:
+    global _recent_writes
+
+    if _recent_writes is None:
+        with _recent_writes_lock:
+            if _recent_writes is None:
+                _recent_writes = RecentWrites(os.path.join(settings.UPLOAD_DIR, ".recent_writes"))
+    return _recent_writes
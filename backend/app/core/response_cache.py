@@ -0,0 +1,180 @@
+import hashlib
+import json
+import mmap
+import os
+import secrets
+import struct
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+from fastapi import Request, Response
+from pydantic import BaseModel
+from app.core.config import settings
+from app.core.filelock import file_lock
+from app.core.recent_writes import get_recent_writes
+from app.core.timing import current_timings
+
+COUNTER_FORMAT = "<Q"
+COUNTER_SIZE = struct.calcsize(COUNTER_FORMAT)
+# Recent writes key of generation bumps, no API token starts with a NUL
+GENERATION_WRITE_KEY = "\0generation"
+
+
+class GenerationCounter:
+    """
+    Data generation shared by the worker processes of a host (and the
+    retention job): a 64-bit counter in a memory-mapped file, so reading it
+    is a memory access and bumping it is a locked increment
+    A new file starts at a random value, so ETags issued before it was
+    (re)created never match again
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._map: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+
+    def _mapped(self) -> mmap.mmap:
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    with file_lock(self.path + ".lock"):
+                        with open(self.path, "a+b") as f:
+                            if os.fstat(f.fileno()).st_size < COUNTER_SIZE:
+                                f.truncate(0)
+                                f.write(struct.pack(COUNTER_FORMAT, secrets.randbits(48)))
+                                f.flush()
+                            self._map = mmap.mmap(f.fileno(), COUNTER_SIZE)
+        return self._map
+
+    def value(self) -> int:
+        return struct.unpack_from(COUNTER_FORMAT, self._mapped())[0]
+
+    def bump(self):
+        mapped = self._mapped()
+        with file_lock(self.path + ".lock"):
+            struct.pack_into(COUNTER_FORMAT, mapped, 0, struct.unpack_from(COUNTER_FORMAT, mapped)[0] + 1)
+
+
+class ResponseCache:
+    """LRU of serialized responses, each stored with the generation it was built at"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[int, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str], generation: int) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Tuple[str, str], generation: int, body: bytes):
+        with self._lock:
+            current = self._entries.get(key)
+            # A slower request that read an older generation mustn't replace a newer entry
+            if current is not None and current[0] > generation:
+                return
+            self._entries[key] = (generation, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_counter: Optional[GenerationCounter] = None
+_cache: Optional[ResponseCache] = None
+_init_lock = threading.Lock()
+
+
+def get_generation_counter() -> GenerationCounter:
+    global _counter
+
+    if _counter is None:
+        with _init_lock:
+            if _counter is None:
+                _counter = GenerationCounter(os.path.join(settings.UPLOAD_DIR, ".cache_generation"))
+    return _counter
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+
+    if _cache is None:
+        with _init_lock:
+            if _cache is None:
+                _cache = ResponseCache(settings.RESPONSE_CACHE_SIZE)
+    return _cache
+
+
+def bump_generation():
+    """
+    Invalidate cached lot listings and stats, call after committing a change to
+    lots, upload sessions or tokens (after, so no request caches the old data
+    under the new generation)
+    """
+    if settings.RESPONSE_CACHE_SIZE > 0:
+        get_generation_counter().bump()
+        if _replica_may_lag():
+            get_recent_writes().mark(GENERATION_WRITE_KEY)
+
+
+def _replica_may_lag() -> bool:
+    return bool(settings.DATABASE_READ_URL) and settings.READ_YOUR_WRITES_SECONDS > 0
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Weak comparison, as for GET
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
+def cached_json_response(request: Request, name: str, params: dict, build: Callable[[], BaseModel]) -> Response:
+    """
+    JSON response of build() for an endpoint and its parameters, answered with
+    304 when If-None-Match holds the current ETag and from the cache when this
+    worker built it at the current generation; build() runs only on a miss
+    build() reads from the read engine: within READ_YOUR_WRITES_SECONDS of a
+    bump a replica may not have the change yet, so the response is neither
+    cached nor given an ETag
+    """
+    if settings.RESPONSE_CACHE_SIZE <= 0:
+        return Response(content=build().model_dump_json(), media_type="application/json")
+
+    if _replica_may_lag() and get_recent_writes().written_within(GENERATION_WRITE_KEY, settings.READ_YOUR_WRITES_SECONDS):
+        _record("replica_lag")
+        return Response(
+            content=build().model_dump_json(),
+            media_type="application/json",
+            headers={"Cache-Control": "no-store"}
+        )
+
+    # Read before building: a write committing meanwhile bumps past this generation
+    generation = get_generation_counter().value()
+    params_key = json.dumps(params, sort_keys=True, default=str)
+    digest = hashlib.sha256(f"{name}\0{params_key}".encode()).hexdigest()[:16]
+    etag = f'W/"{generation:x}-{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        _record("not_modified")
+        return Response(status_code=304, headers=headers)
+
+    cache = get_response_cache()
+    body = cache.get((name, params_key), generation)
+    if body is None:
+        body = build().model_dump_json().encode()
+        cache.put((name, params_key), generation, body)
+    else:
+        _record("hit")
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _record(outcome: str):
+    timings = current_timings()
+    if timings is not None:
+        timings.add(f"cache_{outcome}", 0.0)
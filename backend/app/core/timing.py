@@ -0,0 +1,113 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.core.config import settings
+
+_current_timings: ContextVar[Optional["RequestTimings"]] = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Accumulated per-request time spent in each phase (auth, db, validation, file)"""
+
+    def __init__(self, profile: bool = False):
+        self.started = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.profile = profile
+
+    def add(self, name: str, seconds: float):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def header_value(self) -> str:
+        """
+        Format as a Server-Timing header value
+        Phases may overlap (db time is also counted inside validation)
+        """
+        metrics = []
+        for name, seconds in self.durations.items():
+            metrics.append(f'{name};dur={seconds * 1000:.2f};desc="{self.counts[name]}x"')
+        total = time.perf_counter() - self.started
+        metrics.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """Timings of the request being handled, None outside a request"""
+    return _current_timings.get()
+
+
+@contextmanager
+def timed(name: str):
+    """Record the time spent in the block under the given Server-Timing metric"""
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def install_db_timing(engine: Engine):
+    """Attach cursor execution hooks so every SQL statement counts towards the db metric"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add("db", time.perf_counter() - conn.info["query_start"])
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that collects per-request timings and emits them
+    as a Server-Timing header, visible in the browser devtools
+    Also decides whether the request is sampled for profiling
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _should_profile(self, scope) -> bool:
+        if not settings.PROFILING_ENABLED:
+            return False
+
+        header_name = settings.PROFILE_HEADER.lower().encode()
+        for name, value in scope["headers"]:
+            if name == header_name and value not in (b"", b"0", b"false"):
+                return True
+
+        return random.random() < settings.PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.SERVER_TIMING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(profile=self._should_profile(scope))
+        token = _current_timings.set(timings)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.header_value().encode()))
+                headers.append((b"timing-allow-origin", settings.FRONTEND_URL.encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_timings.reset(token)
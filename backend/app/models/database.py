@@ -1,35 +1,99 @@
-from sqlalchemy import create_engine
+from typing import Optional
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.core.recent_writes import get_recent_writes
+from app.core.timing import install_db_timing
+
+def normalize_url(url: str) -> str:
+    # Fix for postgres:// URL - SQLAlchemy requires postgresql://
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql://", 1)
+    return url
+
+def create_app_engine(url: str):
+    # Create engine with appropriate connect_args
+    connect_args = {}
+    if "sqlite" in url.lower():
+        connect_args = {"check_same_thread": False}
+
+    new_engine = create_engine(url, connect_args=connect_args)
+    install_db_timing(new_engine)
+    return new_engine
+
+def sqlite_read_only_url(url: str) -> Optional[str]:
+    """Read-only URI for the file of a SQLite URL, None for in-memory databases"""
+    database = make_url(url).database
+    if not database or database == ":memory:":
+        return None
+    return f"sqlite:///file:{database}?mode=ro&uri=true"
 
 # Get DATABASE_URL and ensure it's a string
-database_url = str(settings.DATABASE_URL)
+database_url = normalize_url(str(settings.DATABASE_URL))
+
+# Write engine: uploads, deletions, migrations, background jobs
+engine = create_app_engine(database_url)
+
+# Read engine for read-only endpoints, with a connection pool of its own:
+# the replica at DATABASE_READ_URL, read-only connections to the same file on
+# SQLite (in WAL mode, so they neither wait for nor block the writer), or the
+# primary otherwise
+read_database_url = None
+if settings.DATABASE_READ_URL:
+    read_database_url = normalize_url(settings.DATABASE_READ_URL)
+elif settings.DATABASE_READ_SPLIT and engine.dialect.name == "sqlite":
+    read_database_url = sqlite_read_only_url(database_url)
+elif settings.DATABASE_READ_SPLIT:
+    read_database_url = database_url
 
-# Fix for postgres:// URL - SQLAlchemy requires postgresql://
-if database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
+if engine.dialect.name == "sqlite" and read_database_url is not None:
+    @event.listens_for(engine, "connect")
+    def _enable_wal(dbapi_connection, connection_record):
+        # Persistent in the database file, readers then see a consistent snapshot without locking
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
 
-# Create engine with appropriate connect_args
-connect_args = {}
-if "sqlite" in database_url.lower():
-    connect_args = {"check_same_thread": False}
+read_engine = create_app_engine(read_database_url) if read_database_url is not None else engine
 
-engine = create_engine(database_url, connect_args=connect_args)
+if read_engine is not engine and read_engine.dialect.name == "postgresql":
+    # Read-only transactions, also when the read pool points at the primary
+    read_engine = read_engine.execution_options(postgresql_readonly=True)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 Base = declarative_base()
 
-def get_db():
-    """Dependency for database session"""
+def get_write_db():
+    """Dependency for a database session on the write engine"""
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
-def init_db():
-    """Initialize database tables"""
-    from app.models import models  # Import here to avoid circular imports
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+def get_read_db(request: Request):
+    """
+    Dependency for a read-only database session on the read engine
+    With a replica, requests of an API token that uploaded within
+    READ_YOUR_WRITES_SECONDS read from the primary instead, so they see
+    their own upload even while the replica lags
+    """
+    session_factory = ReadSessionLocal
+    token = request.query_params.get("token")
+    if settings.DATABASE_READ_URL and token and settings.READ_YOUR_WRITES_SECONDS > 0:
+        if get_recent_writes().written_within(token, settings.READ_YOUR_WRITES_SECONDS):
+            session_factory = SessionLocal
+
+    db = session_factory()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def mark_token_write(token: str):
+    """Record an upload commit of an API token for the read-your-writes guard of get_read_db"""
+    if settings.DATABASE_READ_URL and settings.READ_YOUR_WRITES_SECONDS > 0:
+        get_recent_writes().mark(token)
@@ -0,0 +1,410 @@
+"""
+Versioned schema migrations
+
+    python migrate.py            apply pending migrations
+    python migrate.py --status   show the current and latest version
+
+Applied versions are recorded in schema_version; app startup only compares
+the recorded version with LATEST_VERSION (see check_schema).
+
+Every step must be idempotent: a fresh database gets the current tables from
+step 1 (so later steps may find their change already made), and a step that
+was interrupted before its version was recorded runs again. Indexes on large
+tables go through create_index_online, which doesn't block writes on PostgreSQL.
+"""
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from app.core.config import settings
+from app.core.filelock import file_lock
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+Migration = namedtuple("Migration", ["version", "description", "apply"])
+
+version_metadata = MetaData()
+schema_version_table = Table(
+    "schema_version",
+    version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+# pg_advisory_lock key held while migrating, first half in the ingest_lock style
+MIGRATION_LOCK_KEY = (0x4D494752, 0)  # "MIGR"
+
+
+class SchemaVersionError(RuntimeError):
+    """The database schema is older than this version of the app"""
+
+
+def create_index_online(engine: Engine, name: str, table: str, definition: str, unique: bool = False):
+    """
+    CREATE [UNIQUE] INDEX name ON table definition, e.g. definition="(qr_id, lot_number)"
+    PostgreSQL builds it CONCURRENTLY, without blocking writes; a partitioned
+    table (which doesn't support that) gets one concurrent build per partition,
+    attached to an index created on the parent only
+    """
+    create = "CREATE UNIQUE INDEX" if unique else "CREATE INDEX"
+    if engine.dialect.name != "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text(f"{create} IF NOT EXISTS {name} ON {table} {definition}"))
+        return
+
+    # CONCURRENTLY can't run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        partitions = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table ORDER BY c.relname"
+        ), {"table": table}).scalars().all()
+
+        if not partitions:
+            _drop_if_invalid(conn, name)
+            conn.execute(text(f"{create} CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"))
+            return
+
+        conn.execute(text(f"{create} IF NOT EXISTS {name} ON ONLY {table} {definition}"))
+        for position, partition in enumerate(partitions):
+            partition_index = f"{name}_p{position:03d}"
+            _drop_if_invalid(conn, partition_index)
+            conn.execute(text(f"{create} CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} {definition}"))
+            # No-op when already attached; the parent index is valid once all partitions are
+            conn.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}"))
+
+
+def _drop_if_invalid(conn: Connection, name: str):
+    """An interrupted concurrent build leaves an invalid index that IF NOT EXISTS would keep"""
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {"name": name}).first()
+    if invalid:
+        logger.warning("Dropping invalid index left by an interrupted build", extra={"index": name})
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+# Steps
+
+def _create_partitioned_identifiers(engine: Engine):
+    """
+    Create qr_identifiers as a PostgreSQL hash-partitioned table on qr_text_hash
+    Must run before metadata.create_all, which then skips the existing table
+    Only applies to new databases, an existing plain table is left as is
+    """
+    if inspect(engine).has_table("qr_identifiers"):
+        return
+
+    partitions = settings.QR_PARTITIONS
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE qr_identifiers (
+                id BIGSERIAL,
+                qr_id VARCHAR(100) NOT NULL,
+                qr_text_hash VARCHAR(64) NOT NULL,
+                lot_number VARCHAR(50) NOT NULL,
+                upload_session_id INTEGER NOT NULL REFERENCES upload_sessions (id),
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+                PRIMARY KEY (id, qr_text_hash)
+            ) PARTITION BY HASH (qr_text_hash)
+        """))
+        for remainder in range(partitions):
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS qr_identifiers_p{remainder:03d} "
+                f"PARTITION OF qr_identifiers FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            ))
+        # Indexes on the parent are created on every partition
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_qr_identifiers_qr_id ON qr_identifiers (qr_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_qr_identifiers_qr_text_hash ON qr_identifiers (qr_text_hash)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_qr_identifiers_upload_session_id ON qr_identifiers (upload_session_id)"))
+
+
+def _is_partitioned(engine: Engine, table: str) -> bool:
+    """Whether table is a PostgreSQL partitioned table"""
+    if engine.dialect.name != "postgresql":
+        return False
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT 1 FROM pg_class WHERE relname = :table AND relkind = 'p'"
+        ), {"table": table}).first() is not None
+
+
+def _add_missing_columns(engine: Engine):
+    """
+    Add columns and indexes introduced after a table was created by an app
+    version without migrations; create_all never alters existing tables
+    A partitioned qr_identifiers keeps the index set it was created with
+    """
+    from app.models.database import Base
+
+    inspector = inspect(engine)
+    missing_indexes = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name) or _is_partitioned(engine, table.name):
+                continue
+
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                default = column.server_default.arg if column.server_default is not None else None
+                if isinstance(default, str):
+                    ddl += f" DEFAULT '{default}'"
+                if not column.nullable and default is not None:
+                    ddl += " NOT NULL"
+                conn.execute(text(ddl))
+
+            # Indexes declared on tables that already existed
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            missing_indexes += [index for index in table.indexes if index.name not in existing_indexes]
+
+    for index in missing_indexes:
+        definition = "(" + ", ".join(column.name for column in index.columns) + ")"
+        create_index_online(engine, index.name, index.table.name, definition, unique=index.unique)
+
+
+def _initial_schema(engine: Engine):
+    """Tables of the models, also brings databases created by init_db up to date"""
+    from app.models import models  # noqa: F401 - registers the tables
+    from app.models.database import Base
+
+    if settings.QR_PARTITIONS > 0 and engine.dialect.name == "postgresql":
+        # qr_identifiers references upload_sessions, so create the other tables first
+        tables = [t for t in Base.metadata.sorted_tables if t.name != "qr_identifiers"]
+        Base.metadata.create_all(bind=engine, tables=tables)
+        _create_partitioned_identifiers(engine)
+
+    Base.metadata.create_all(bind=engine)
+    _add_missing_columns(engine)
+
+
+# SQLite external content FTS5 table over lots.lot_number, kept in sync by triggers
+SQLITE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS lots_fts USING fts5(
+        lot_number, content='lots', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS lots_fts_insert AFTER INSERT ON lots BEGIN
+        INSERT INTO lots_fts(rowid, lot_number) VALUES (new.id, new.lot_number);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lots_fts_delete AFTER DELETE ON lots BEGIN
+        INSERT INTO lots_fts(lots_fts, rowid, lot_number) VALUES ('delete', old.id, old.lot_number);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lots_fts_update AFTER UPDATE OF lot_number ON lots BEGIN
+        INSERT INTO lots_fts(lots_fts, rowid, lot_number) VALUES ('delete', old.id, old.lot_number);
+        INSERT INTO lots_fts(rowid, lot_number) VALUES (new.id, new.lot_number);
+    END""",
+]
+
+
+def _lot_search_indexes(engine: Engine):
+    """
+    lot_number search structures used by lot_search.filter_lot_number
+    PostgreSQL: a B-tree usable by LIKE 'x%' whatever the collation and a trigram GIN for '%x%'
+    SQLite: an FTS5 trigram table
+    Missing extensions (pg_trgm, FTS5 trigram tokenizer) only disable the
+    indexed substring search, which then falls back to a scan
+    """
+    if engine.dialect.name == "postgresql":
+        create_index_online(engine, "idx_lots_lot_number_pattern", "lots", "(lot_number varchar_pattern_ops)")
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except DBAPIError:
+            logger.warning("pg_trgm unavailable, substring lot search will scan the table")
+            return
+        create_index_online(engine, "idx_lots_lot_number_trgm", "lots", "USING gin (lot_number gin_trgm_ops)")
+        return
+
+    if engine.dialect.name != "sqlite":
+        return
+
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lots_fts'"
+            )).first()
+            for ddl in SQLITE_FTS_DDL:
+                conn.execute(text(ddl))
+            if not exists:
+                # Index the lots created before the table existed
+                conn.execute(text("INSERT INTO lots_fts(lots_fts) VALUES ('rebuild')"))
+    except DBAPIError:
+        logger.warning("SQLite FTS5 trigram tokenizer unavailable, substring lot search will scan the table")
+
+
+def _identifier_lot_index(engine: Engine):
+    """(upload_session_id, lot_number) index for the identifier cascade of lot deletions"""
+    from app.services.identifier_store import create_shard_engines, is_sharded
+
+    if not is_sharded():
+        create_index_online(engine, "ix_qr_identifiers_session_lot", "qr_identifiers", "(upload_session_id, lot_number)")
+        return
+
+    for shard_engine in create_shard_engines():
+        try:
+            with shard_engine.begin() as conn:
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_shard_session_lot ON qr_identifiers (upload_session_id, lot_number)"
+                ))
+        finally:
+            shard_engine.dispose()
+
+
+def _add_columns_if_missing(engine: Engine, table: str, columns: List[Tuple[str, str]]):
+    """ALTER TABLE ADD COLUMN for the (name, SQL type) columns the table doesn't have yet"""
+    existing = {column["name"] for column in inspect(engine).get_columns(table)}
+    with engine.begin() as conn:
+        for name, sql_type in columns:
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}"))
+
+
+def _token_rate_limits(engine: Engine):
+    """Nullable per-token rate limit columns on api_tokens"""
+    _add_columns_if_missing(engine, "api_tokens", [
+        ("rate_limit_requests", "INTEGER"),
+        ("rate_limit_records", "INTEGER"),
+    ])
+
+
+def _token_usage_rollups(engine: Engine):
+    """token_usage_hourly table"""
+    from app.models.models import TokenUsageHourly
+
+    TokenUsageHourly.__table__.create(bind=engine, checkfirst=True)
+
+
+def _upload_session_duplicates(engine: Engine):
+    """upload_sessions.duplicates_path, directory of the session's duplicate report"""
+    _add_columns_if_missing(engine, "upload_sessions", [("duplicates_path", "VARCHAR(500)")])
+
+
+def _lot_sources(engine: Engine):
+    """lot_sources table, filled from the segments not yet compacted or archived"""
+    from app.models.models import LotSource
+
+    LotSource.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO lot_sources (lot_id, upload_session_id) "
+            "SELECT DISTINCT s.lot_id, s.upload_session_id FROM lot_segments s "
+            "WHERE NOT EXISTS (SELECT 1 FROM lot_sources t "
+            "WHERE t.lot_id = s.lot_id AND t.upload_session_id = s.upload_session_id)"
+        ))
+
+
+def _cleanup_job_heartbeat(engine: Engine):
+    """cleanup_jobs.heartbeat_at and error, for requeueing jobs of dead workers and reporting failures"""
+    _add_columns_if_missing(engine, "cleanup_jobs", [
+        ("heartbeat_at", "TIMESTAMP WITH TIME ZONE"),
+        ("error", "TEXT"),
+    ])
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Initial schema", _initial_schema),
+    Migration(2, "lot_number search indexes", _lot_search_indexes),
+    Migration(3, "qr_identifiers (upload_session_id, lot_number) index", _identifier_lot_index),
+    Migration(4, "api_tokens rate limit columns", _token_rate_limits),
+    Migration(5, "token_usage_hourly table", _token_usage_rollups),
+    Migration(6, "upload_sessions duplicate report path", _upload_session_duplicates),
+    Migration(7, "lot_sources table", _lot_sources),
+    Migration(8, "cleanup_jobs heartbeat and error columns", _cleanup_job_heartbeat),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(engine: Engine) -> int:
+    """Recorded schema version, 0 for a database that was never migrated"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(schema_version_table.c.version))).scalar() or 0
+    except DBAPIError:
+        # schema_version doesn't exist yet
+        return 0
+
+
+def pending_migrations(engine: Engine) -> List[Migration]:
+    version = current_version(engine)
+    return [migration for migration in MIGRATIONS if migration.version > version]
+
+
+@contextmanager
+def _migration_lock(engine: Engine):
+    """One migrating process at a time, across hosts on PostgreSQL"""
+    if engine.dialect.name != "postgresql":
+        with file_lock(os.path.join(settings.UPLOAD_DIR, ".migrate.lock")):
+            yield
+        return
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:a, :b)"), {"a": MIGRATION_LOCK_KEY[0], "b": MIGRATION_LOCK_KEY[1]})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:a, :b)"), {"a": MIGRATION_LOCK_KEY[0], "b": MIGRATION_LOCK_KEY[1]})
+
+
+def migrate(engine: Optional[Engine] = None) -> List[Migration]:
+    """Apply pending migrations in order, returns the ones applied"""
+    if engine is None:
+        from app.models.database import engine
+
+    with _migration_lock(engine):
+        version_metadata.create_all(bind=engine)
+        # Read under the lock, another process may have just migrated
+        pending = pending_migrations(engine)
+
+        for migration in pending:
+            logger.info("Applying migration", extra={"version": migration.version, "description": migration.description})
+            migration.apply(engine)
+            with engine.begin() as conn:
+                conn.execute(schema_version_table.insert().values(
+                    version=migration.version,
+                    description=migration.description,
+                    applied_at=datetime.now(timezone.utc)
+                ))
+
+    return pending
+
+
+def check_schema(engine: Optional[Engine] = None, apply: bool = False) -> int:
+    """
+    Startup check: a single query comparing the recorded version with LATEST_VERSION
+    Pending migrations are applied when apply is set, otherwise SchemaVersionError
+    is raised. A newer schema (code rolled back) is only logged, migrations are additive
+    Returns the schema version
+    """
+    if engine is None:
+        from app.models.database import engine
+
+    version = current_version(engine)
+    if version == LATEST_VERSION:
+        return version
+
+    if version > LATEST_VERSION:
+        logger.warning("Database schema is newer than the app", extra={
+            "schema_version": version,
+            "app_schema_version": LATEST_VERSION
+        })
+        return version
+
+    if not apply:
+        raise SchemaVersionError(
+            f"Database schema is at version {version}, the app needs {LATEST_VERSION}: run python migrate.py"
+        )
+
+    migrate(engine)
+    return LATEST_VERSION
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Index
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, ForeignKey, Text, Index, UniqueConstraint, LargeBinary
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -25,6 +25,9 @@ class APIToken(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     last_used_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
     usage_count: Mapped[int] = mapped_column(Integer, default=0)
+    # Per-minute limits, None uses the RATE_LIMIT_* setting and 0 means unlimited
+    rate_limit_requests: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    rate_limit_records: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     
     # Relationship
     upload_sessions: Mapped[List["UploadSession"]] = relationship("UploadSession", back_populates="token")
@@ -39,10 +42,64 @@ class UploadSession(Base):
     total_records: Mapped[int] = mapped_column(Integer, nullable=False)
     valid_records: Mapped[int] = mapped_column(Integer, nullable=False)
     duplicate_records: Mapped[int] = mapped_column(Integer, nullable=False)
+    # completed (single request upload), open (chunked, receiving chunks), finalizing, finalized or aborting (chunked)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="completed", server_default="completed")
+    # Directory of the full duplicate list (gzip NDJSON, see DuplicateReport), None when there were none
+    duplicates_path: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    
+    # Idempotency-Key of the request that created the session, with its cached response
+    idempotency_key: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    request_digest: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    response_body: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    idempotency_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
     
     # Relationships
     token: Mapped["APIToken"] = relationship("APIToken", back_populates="upload_sessions")
     lots: Mapped[List["Lot"]] = relationship("Lot", back_populates="upload_session")
+    chunks: Mapped[List["UploadChunk"]] = relationship("UploadChunk", back_populates="upload_session")
+    
+    __table_args__ = (
+        # Keys are scoped per token, cleared keys (NULL) don't collide
+        Index('uq_upload_session_idempotency_key', 'token_id', 'idempotency_key', unique=True),
+    )
+
+class UploadChunk(Base):
+    """Chunk received for a chunked upload session, validated and staged on disk"""
+    __tablename__ = "upload_chunks"
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    upload_session_id: Mapped[int] = mapped_column(Integer, ForeignKey("upload_sessions.id"), nullable=False)
+    chunk_number: Mapped[int] = mapped_column(Integer, nullable=False)
+    body_digest: Mapped[str] = mapped_column(String(64), nullable=False)
+    total_records: Mapped[int] = mapped_column(Integer, nullable=False)
+    valid_records: Mapped[int] = mapped_column(Integer, nullable=False)
+    duplicate_records: Mapped[int] = mapped_column(Integer, nullable=False)
+    lot_counts: Mapped[str] = mapped_column(Text, nullable=False)  # JSON {lot_number: valid record count}
+    received_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    
+    # Relationships
+    upload_session: Mapped["UploadSession"] = relationship("UploadSession", back_populates="chunks")
+    
+    __table_args__ = (
+        UniqueConstraint('upload_session_id', 'chunk_number', name='uq_upload_chunk_number'),
+    )
+
+class TokenUsageHourly(Base):
+    """
+    Per-token upload totals per hour, upserted in the transaction that commits
+    the upload so usage reports never scan upload_sessions
+    A single upload or finalized chunked session counts as one upload; records
+    and bytes count when they are received (single upload or chunk)
+    """
+    __tablename__ = "token_usage_hourly"
+    
+    token_id: Mapped[int] = mapped_column(Integer, ForeignKey("api_tokens.id"), primary_key=True)
+    bucket_start: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)  # UTC hour
+    uploads: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    total_records: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    valid_records: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    duplicate_records: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    bytes: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)  # Decoded request bodies
 
 class Lot(Base):
     """Lot metadata and file information"""
@@ -53,11 +110,63 @@ class Lot(Base):
     record_count: Mapped[int] = mapped_column(Integer, nullable=False)
     file_path: Mapped[str] = mapped_column(String(500), nullable=False)
     file_name: Mapped[str] = mapped_column(String(255), nullable=False)
+    sidecar_path: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)  # Columnar copy for reports
     upload_session_id: Mapped[int] = mapped_column(Integer, ForeignKey("upload_sessions.id"), nullable=False)
     uploaded_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)  # Last append
+    archived_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)  # file_path is a gzip archive
     
     # Relationships
     upload_session: Mapped["UploadSession"] = relationship("UploadSession", back_populates="lots")
+    segments: Mapped[List["LotSegment"]] = relationship("LotSegment", back_populates="lot", order_by="LotSegment.id")
+
+class LotSegment(Base):
+    """
+    Records appended to an existing lot, stored as a headerless CSV file
+    The lot's content is its file_path followed by its segments in id order
+    """
+    __tablename__ = "lot_segments"
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    lot_id: Mapped[int] = mapped_column(Integer, ForeignKey("lots.id"), nullable=False, index=True)
+    upload_session_id: Mapped[int] = mapped_column(Integer, ForeignKey("upload_sessions.id"), nullable=False)
+    record_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    file_path: Mapped[str] = mapped_column(String(500), nullable=False)
+    sidecar_path: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    
+    # Relationships
+    lot: Mapped["Lot"] = relationship("Lot", back_populates="segments")
+
+class LotSource(Base):
+    """
+    Upload session that appended records to a lot
+    Outlives the segment, which compaction and archival merge away, so
+    deleting the lot still finds the identifiers of every session in it
+    """
+    __tablename__ = "lot_sources"
+    
+    lot_id: Mapped[int] = mapped_column(Integer, ForeignKey("lots.id"), primary_key=True)
+    upload_session_id: Mapped[int] = mapped_column(Integer, ForeignKey("upload_sessions.id"), primary_key=True, index=True)
+
+class CleanupJob(Base):
+    """Background removal of the files (and optionally identifiers) of bulk deleted lots"""
+    __tablename__ = "cleanup_jobs"
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="queued")  # queued, running, completed, failed
+    file_paths: Mapped[str] = mapped_column(Text, nullable=False)  # JSON list
+    identifier_keys: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # JSON [[upload_session_id, lot_number]], when cascading
+    total_files: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    removed_files: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    missing_files: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    failed_files: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    deleted_identifiers: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    # Written by the running worker after every batch, a stale one means its process died
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
 class QRIdentifier(Base):
     """QR identifiers for duplicate checking"""
@@ -74,4 +183,18 @@ class QRIdentifier(Base):
     __table_args__ = (
         Index('idx_qr_id_lot', 'qr_id', 'lot_number'),
         Index('idx_qr_text_hash_lot', 'qr_text_hash', 'lot_number'),
-    )
\ No newline at end of file
+    )
+
+class QRIdentifierCold(Base):
+    """
+    QR identifiers moved out of qr_identifiers by retention
+    Checked for duplicates only after the hot table. Stores a 16 byte text
+    digest instead of the hex hash and has no composite indexes
+    """
+    __tablename__ = "qr_identifiers_cold"
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    qr_id: Mapped[str] = mapped_column(String(100), nullable=False, index=True)
+    qr_text_digest: Mapped[bytes] = mapped_column(LargeBinary(16), nullable=False, index=True)  # First 16 bytes of the SHA-256
+    lot_number: Mapped[str] = mapped_column(String(50), nullable=False)
+    upload_session_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
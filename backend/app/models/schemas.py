@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, model_validator
+from typing import List, Literal, Optional
 from datetime import datetime
 
 # Authentication Schemas
@@ -25,6 +25,30 @@ class APITokenResponse(BaseModel):
     created_at: datetime
     last_used_at: Optional[datetime] = None
     usage_count: int
+    rate_limit_requests: Optional[int] = None
+    rate_limit_records: Optional[int] = None
+
+class APITokenLimits(BaseModel):
+    # Per minute; None uses the server default, 0 means unlimited
+    rate_limit_requests: Optional[int] = Field(None, ge=0)
+    rate_limit_records: Optional[int] = Field(None, ge=0)
+
+class TokenUsageBucket(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    
+    bucket_start: datetime  # Start of the UTC hour
+    uploads: int
+    total_records: int
+    valid_records: int
+    duplicate_records: int
+    bytes: int
+
+class TokenUsageResponse(BaseModel):
+    token_id: int
+    total: int
+    page: int
+    limit: int
+    buckets: List[TokenUsageBucket]
 
 # Upload Schemas
 class QRData(BaseModel):
@@ -42,7 +66,50 @@ class UploadResponse(BaseModel):
     valid_records: int
     duplicate_records: int
     lots_created: List[str]
-    duplicates: Optional[List[dict]] = None
+    lots_appended: List[str] = []  # Existing lots the records were appended to (append mode)
+    duplicates: Optional[List[dict]] = None  # First 100, the full list is at duplicates_url
+    duplicates_url: Optional[str] = None
+
+class UploadSessionResponse(BaseModel):
+    upload_session_id: int
+    status: str
+    total_records: int
+    valid_records: int
+    duplicate_records: int
+    chunks_received: List[int] = []
+
+class ChunkUploadResponse(BaseModel):
+    upload_session_id: int
+    chunk_number: int
+    total_records: int
+    valid_records: int
+    duplicate_records: int
+    replayed: bool = False  # Chunk was already received, nothing was re-validated
+    duplicates: Optional[List[dict]] = None  # First 100, the full list is at duplicates_url
+    duplicates_url: Optional[str] = None
+
+# QR lookup Schemas
+MAX_LOOKUP_ITEMS = 100000
+
+class QRLookupRequest(BaseModel):
+    qr_ids: List[str] = Field(default=[], max_length=MAX_LOOKUP_ITEMS)
+    qr_texts: List[str] = Field(default=[], max_length=MAX_LOOKUP_ITEMS)
+    
+    @model_validator(mode='after')
+    def check_total(self):
+        if not self.qr_ids and not self.qr_texts:
+            raise ValueError("Provide qr_ids or qr_texts")
+        if len(self.qr_ids) + len(self.qr_texts) > MAX_LOOKUP_ITEMS:
+            raise ValueError(f"At most {MAX_LOOKUP_ITEMS} qr_ids and qr_texts per request")
+        return self
+
+class QRLookupResult(BaseModel):
+    kind: str  # qr_id or qr_text
+    value: str
+    status: str  # registered or not_registered
+    qr_id: Optional[str] = None
+    lot_number: Optional[str] = None
+    upload_session_id: Optional[int] = None
 
 # Lot Schemas
 class LotResponse(BaseModel):
@@ -53,6 +120,8 @@ class LotResponse(BaseModel):
     record_count: int
     file_name: str
     uploaded_at: datetime
+    updated_at: Optional[datetime] = None
+    archived_at: Optional[datetime] = None
     uploaded_by_token: Optional[str] = None
 
 class LotsListResponse(BaseModel):
@@ -67,6 +136,71 @@ class StatsResponse(BaseModel):
     total_uploads: int
     active_tokens: int
 
+class AggregateGroup(BaseModel):
+    key: Optional[str] = None
+    count: int
+
+class AggregateResponse(BaseModel):
+    group_by: str
+    total_records: int
+    lots: int
+    csv_files_scanned: int  # Files without a sidecar, parsed as CSV
+    groups: List[AggregateGroup]
+
+class BulkDeleteRequest(BaseModel):
+    """Lots to delete: explicit ids, or every lot matching the filters"""
+    lot_ids: Optional[List[int]] = Field(default=None, max_length=100000)
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    token_id: Optional[int] = None
+    lot_number: Optional[str] = None
+    search: Literal["substring", "prefix", "exact"] = "substring"
+    cascade_identifiers: bool = False  # Also delete the QR identifiers of the deleted lots
+    
+    @model_validator(mode='after')
+    def check_selection(self):
+        has_filter = any(v is not None for v in (self.since, self.until, self.token_id)) or bool(self.lot_number)
+        if self.lot_ids is None and not has_filter:
+            raise ValueError("Provide lot_ids or at least one filter")
+        if self.lot_ids is not None and has_filter:
+            raise ValueError("Provide either lot_ids or filters, not both")
+        return self
+
+class BulkDeleteResponse(BaseModel):
+    message: str
+    deleted_lots: int
+    cleanup_job_id: Optional[int] = None
+
+class CleanupJobResponse(BaseModel):
+    id: int
+    status: str
+    total_files: int
+    removed_files: int
+    missing_files: int
+    failed_files: int
+    deleted_identifiers: int
+    cascade_identifiers: bool
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None  # Why the job failed
+
+class LaneStats(BaseModel):
+    name: str
+    capacity: int
+    in_use: int
+    waiting: int  # Queue depth
+    requests: Optional[int] = None  # Not tracked for the shared default limiter
+    wait_seconds_total: Optional[float] = None
+    wait_seconds_max: Optional[float] = None
+
+class AdmissionStats(BaseModel):
+    budget_bytes: int
+    in_flight_bytes: int
+    active_tokens: int
+    queued: int
+    admitted: int
+    rejected: int
+
 class DownloadMultipleRequest(BaseModel):
     lot_ids: List[int]
 
@@ -0,0 +1,352 @@
+import json
+import os
+import queue
+import shutil
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Set, Tuple
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.response_cache import bump_generation
+from app.models.database import SessionLocal
+from app.models.models import CleanupJob, Lot, LotSegment, LotSource, UploadChunk, UploadSession
+from app.services.csv_generator import CSVGenerator
+from app.services.duplicate_report import DuplicateReport
+from app.services.identifier_store import ColdIdentifierStore, get_identifier_store
+from app.services.lot_segments import remove_files
+
+logger = get_logger(__name__)
+
+# Files removed / identifier keys deleted between progress updates
+FILE_BATCH_SIZE = 500
+IDENTIFIER_BATCH_SIZE = 200
+# Bound on ids per IN (...) statement
+ID_CHUNK_SIZE = 5000
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def release_duplicate_reports(db: Session, upload_session_ids: Set[int]) -> List[str]:
+    """
+    Duplicate report directories of the given sessions that no longer have a
+    lot (created or appended to), cleared on the sessions; call after deleting
+    lots, in the same transaction, and remove the returned directories after commit
+    """
+    paths = []
+    for ids in _chunks(sorted(upload_session_ids), ID_CHUNK_SIZE):
+        in_use = {row.upload_session_id for row in db.query(Lot.upload_session_id).filter(Lot.upload_session_id.in_(ids))}
+        in_use.update(row.upload_session_id for row in db.query(LotSource.upload_session_id).filter(LotSource.upload_session_id.in_(ids)))
+        released = [session_id for session_id in ids if session_id not in in_use]
+        if not released:
+            continue
+
+        paths += [row.duplicates_path for row in db.query(UploadSession.duplicates_path).filter(
+            UploadSession.id.in_(released),
+            UploadSession.duplicates_path.isnot(None)
+        )]
+        db.query(UploadSession).filter(UploadSession.id.in_(released)).update(
+            {UploadSession.duplicates_path: None}, synchronize_session=False
+        )
+    return paths
+
+
+def delete_lots(db: Session, lot_ids: List[int], cascade_identifiers: bool = False) -> Tuple[int, Optional[CleanupJob]]:
+    """
+    Delete lots with set-based statements and queue their files (and
+    identifiers when cascading) for the background cleanup worker, with the
+    duplicate reports of sessions left without lots
+    Returns (number of lots deleted, cleanup job or None when there was nothing to delete)
+    """
+    lots = []
+    segments = []
+    sources = []
+    for chunk in _chunks(lot_ids, ID_CHUNK_SIZE):
+        lots += db.query(Lot.id, Lot.lot_number, Lot.upload_session_id, Lot.file_path, Lot.sidecar_path).filter(
+            Lot.id.in_(chunk)
+        ).all()
+        segments += db.query(LotSegment.lot_id, LotSegment.file_path, LotSegment.sidecar_path).filter(
+            LotSegment.lot_id.in_(chunk)
+        ).all()
+        sources += db.query(LotSource.lot_id, LotSource.upload_session_id).filter(
+            LotSource.lot_id.in_(chunk)
+        ).all()
+
+    if not lots:
+        return 0, None
+
+    file_paths = [path for row in lots + segments for path in (row.file_path, row.sidecar_path) if path]
+
+    identifier_keys = None
+    if cascade_identifiers:
+        # Appending sessions come from lot_sources, segments may have been compacted away
+        lot_numbers = {lot.id: lot.lot_number for lot in lots}
+        keys = {(lot.upload_session_id, lot.lot_number) for lot in lots}
+        keys.update((source.upload_session_id, lot_numbers[source.lot_id]) for source in sources)
+        identifier_keys = json.dumps(sorted(keys))
+
+    found_ids = [lot.id for lot in lots]
+    for chunk in _chunks(found_ids, ID_CHUNK_SIZE):
+        db.query(LotSegment).filter(LotSegment.lot_id.in_(chunk)).delete(synchronize_session=False)
+        db.query(LotSource).filter(LotSource.lot_id.in_(chunk)).delete(synchronize_session=False)
+        db.query(Lot).filter(Lot.id.in_(chunk)).delete(synchronize_session=False)
+
+    session_ids = {lot.upload_session_id for lot in lots} | {source.upload_session_id for source in sources}
+    file_paths += release_duplicate_reports(db, session_ids)
+
+    # The job commits with the deletion, files can't be orphaned by a crash in between
+    job = CleanupJob(
+        status="queued",
+        file_paths=json.dumps(file_paths),
+        identifier_keys=identifier_keys,
+        total_files=len(file_paths)
+    )
+    db.add(job)
+    db.commit()
+    bump_generation()
+    db.refresh(job)
+
+    get_cleanup_worker().enqueue(job.id)
+    return len(found_ids), job
+
+
+def discard_upload_session(db: Session, upload_session_id: int, file_paths: List[str] = (), keep_session: bool = False):
+    """
+    Undo an upload that failed after its identifiers were saved (or an aborted
+    chunked session): the identifiers, the session row (with its
+    Idempotency-Key and chunks), its duplicate report, staged chunks and the
+    given files it wrote, so the same records can be sent again
+    keep_session leaves the row (marked aborting) to expire_upload_sessions
+    Errors are logged, the caller re-raises the failure that got it here
+    """
+    try:
+        db.rollback()
+        deleted = get_identifier_store(db).delete_for_session(upload_session_id)
+        db.query(UploadChunk).filter(UploadChunk.upload_session_id == upload_session_id).delete(synchronize_session=False)
+        if not keep_session:
+            db.query(UploadSession).filter(UploadSession.id == upload_session_id).delete(synchronize_session=False)
+        db.commit()
+        bump_generation()
+        remove_files(file_paths)
+        DuplicateReport(upload_session_id).remove()
+        CSVGenerator().discard_staging(upload_session_id)
+        logger.warning("Discarded failed upload", extra={
+            "upload_session_id": upload_session_id,
+            "deleted_identifiers": deleted
+        })
+    except Exception:
+        db.rollback()
+        logger.exception("Error discarding failed upload", extra={"upload_session_id": upload_session_id})
+
+
+def abort_upload_session(db: Session, upload_session_id: int) -> bool:
+    """
+    Abort an open chunked session and release the QR identifiers its chunks
+    reserved; False when the session isn't open (finalizing or already gone)
+    Chunks arriving meanwhile fail their own status check and roll back
+    The session row goes in discard_upload_session, which bumps the generation
+    """
+    claimed = db.query(UploadSession).filter(
+        UploadSession.id == upload_session_id,
+        UploadSession.status == "open"
+    ).update({UploadSession.status: "aborting"}, synchronize_session=False)
+    db.commit()
+    if not claimed:
+        return False
+
+    discard_upload_session(db, upload_session_id)
+    return True
+
+
+def expire_upload_sessions(db: Session, idle_before: datetime) -> int:
+    """
+    Abort open chunked sessions without a chunk since idle_before (and those
+    left aborting by an interrupted abort), returns the number aborted
+    """
+    last_activity = func.coalesce(func.max(UploadChunk.received_at), UploadSession.uploaded_at)
+    idle_ids = db.query(UploadSession.id).outerjoin(
+        UploadChunk, UploadChunk.upload_session_id == UploadSession.id
+    ).filter(
+        UploadSession.status == "open"
+    ).group_by(UploadSession.id).having(last_activity < idle_before).all()
+
+    expired = sum(abort_upload_session(db, row.id) for row in idle_ids)
+
+    for row in db.query(UploadSession.id).filter(UploadSession.status == "aborting").all():
+        discard_upload_session(db, row.id)
+        expired += 1
+
+    return expired
+
+
+def run_cleanup_job(job_id: int):
+    """
+    Remove a job's files and identifiers in batches, recording progress and a
+    heartbeat on the job row; a job that raises is marked failed with the error
+    A requeued job continues after the files it already went through
+    """
+    db = SessionLocal()
+    try:
+        # Claim the job, another worker process may be resuming it
+        claimed = db.query(CleanupJob).filter(
+            CleanupJob.id == job_id,
+            CleanupJob.status == "queued"
+        ).update({
+            CleanupJob.status: "running",
+            CleanupJob.heartbeat_at: datetime.now(timezone.utc)
+        }, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return
+
+        job = db.query(CleanupJob).filter(CleanupJob.id == job_id).one()
+        done = job.removed_files + job.missing_files + job.failed_files
+        file_paths = json.loads(job.file_paths)[done:]
+
+        for batch in _chunks(file_paths, FILE_BATCH_SIZE):
+            removed = missing = failed = 0
+            for path in batch:
+                try:
+                    if os.path.isdir(path):
+                        # Duplicate report directory
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    missing += 1
+                except OSError:
+                    logger.exception("Error deleting lot file", extra={"cleanup_job_id": job_id, "file_path": path})
+                    failed += 1
+
+            db.query(CleanupJob).filter(CleanupJob.id == job_id).update({
+                CleanupJob.removed_files: CleanupJob.removed_files + removed,
+                CleanupJob.missing_files: CleanupJob.missing_files + missing,
+                CleanupJob.failed_files: CleanupJob.failed_files + failed,
+                CleanupJob.heartbeat_at: datetime.now(timezone.utc)
+            }, synchronize_session=False)
+            db.commit()
+
+        if job.identifier_keys:
+            hot = get_identifier_store(db)
+            cold = ColdIdentifierStore(db)
+            keys = [tuple(key) for key in json.loads(job.identifier_keys)]
+            for batch in _chunks(keys, IDENTIFIER_BATCH_SIZE):
+                deleted = hot.delete_for_lots(batch) + cold.delete_for_lots(batch)
+                db.query(CleanupJob).filter(CleanupJob.id == job_id).update({
+                    CleanupJob.deleted_identifiers: CleanupJob.deleted_identifiers + deleted,
+                    CleanupJob.heartbeat_at: datetime.now(timezone.utc)
+                }, synchronize_session=False)
+                db.commit()
+
+        db.query(CleanupJob).filter(CleanupJob.id == job_id).update({
+            CleanupJob.status: "completed",
+            CleanupJob.finished_at: datetime.now(timezone.utc)
+        }, synchronize_session=False)
+        db.commit()
+
+        db.refresh(job)
+        logger.info("Cleanup job completed", extra={
+            "cleanup_job_id": job_id,
+            "removed_files": job.removed_files,
+            "missing_files": job.missing_files,
+            "failed_files": job.failed_files,
+            "deleted_identifiers": job.deleted_identifiers
+        })
+    except Exception as e:
+        db.rollback()
+        logger.exception("Cleanup job failed", extra={"cleanup_job_id": job_id})
+        _mark_failed(db, job_id, f"{type(e).__name__}: {e}")
+    finally:
+        db.close()
+
+
+def _mark_failed(db: Session, job_id: int, error: str):
+    # If even this fails the job stays running and is requeued once its heartbeat is stale
+    try:
+        db.query(CleanupJob).filter(
+            CleanupJob.id == job_id,
+            CleanupJob.status == "running"
+        ).update({
+            CleanupJob.status: "failed",
+            CleanupJob.error: error,
+            CleanupJob.finished_at: datetime.now(timezone.utc)
+        }, synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception("Error marking cleanup job failed", extra={"cleanup_job_id": job_id})
+
+
+class CleanupWorker:
+    """
+    Single background thread per process running cleanup jobs in order
+    Started with the app; it picks up queued jobs, and running jobs whose
+    heartbeat is older than CLEANUP_JOB_STALE_SECONDS (their process died),
+    at start and whenever it has been idle that long
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[int]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="cleanup-worker", daemon=True)
+            self._thread.start()
+
+    def _resume_queued(self):
+        db = SessionLocal()
+        try:
+            stale_before = datetime.now(timezone.utc) - timedelta(seconds=settings.CLEANUP_JOB_STALE_SECONDS)
+            requeued = db.query(CleanupJob).filter(
+                CleanupJob.status == "running",
+                or_(CleanupJob.heartbeat_at.is_(None), CleanupJob.heartbeat_at < stale_before)
+            ).update({CleanupJob.status: "queued"}, synchronize_session=False)
+            db.commit()
+            if requeued:
+                logger.warning("Requeued stale cleanup jobs", extra={"cleanup_jobs": requeued})
+
+            for job_id in db.execute(select(CleanupJob.id).where(CleanupJob.status == "queued")).scalars():
+                self._queue.put(job_id)
+        except Exception:
+            db.rollback()
+            logger.exception("Error resuming cleanup jobs")
+        finally:
+            db.close()
+
+    def enqueue(self, job_id: int):
+        self.start()
+        self._queue.put(job_id)
+
+    def _run(self):
+        self._resume_queued()
+        while True:
+            try:
+                job_id = self._queue.get(timeout=settings.CLEANUP_JOB_STALE_SECONDS)
+            except queue.Empty:
+                self._resume_queued()
+                continue
+            run_cleanup_job(job_id)
+
+
+_worker: Optional[CleanupWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_cleanup_worker() -> CleanupWorker:
+    """Process-wide cleanup worker, its thread starts in the app lifespan (after a fork) or on first use"""
+    global _worker
+
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = CleanupWorker()
+    return _worker
@@ -1,14 +1,36 @@
 import csv
+import glob
+import gzip
+import hashlib
 import os
+import shutil
+import uuid
 from datetime import datetime
-from typing import List, Dict
+from typing import Iterable, List, Dict, Optional
 from app.core.config import settings
+from app.core.timing import timed
+from app.core.logger import get_logger
+from app.core.progress import NULL_PUBLISHER
+
+logger = get_logger(__name__)
+
+# CSV headers
+HEADERS = ['qr_id', 'qr_text', 'lot_number', 'print_format']
+# Same header line csv.DictWriter writes
+HEADER_LINE = (','.join(HEADERS) + '\r\n').encode('utf-8')
+
+def open_lot_file(file_path: str):
+    """Open a lot file or segment for binary reading, gzip archives are decompressed"""
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rb')
+    return open(file_path, 'rb')
 
 class CSVGenerator:
     """Service for generating CSV files from validated data"""
     
-    def __init__(self):
+    def __init__(self, progress=NULL_PUBLISHER):
         self.upload_dir = settings.UPLOAD_DIR
+        self.progress = progress
         self._ensure_upload_dir()
     
     def _ensure_upload_dir(self):
@@ -33,12 +55,9 @@ class CSVGenerator:
         filename = self.generate_filename(lot_number)
         file_path = os.path.join(self.upload_dir, filename)
         
-        # CSV headers
-        headers = ['qr_id', 'qr_text', 'lot_number', 'print_format']
-        
         # Write to CSV
-        with open(file_path, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=headers)
+        with timed("file"), open(file_path, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=HEADERS)
             writer.writeheader()
             
             for record in records:
@@ -49,11 +68,160 @@ class CSVGenerator:
                     'print_format': record['print_format']
                 })
         
+        self.progress.publish("lot_written", lot_number=lot_number, records=len(records))
+        return {
+            'file_path': file_path,
+            'file_name': filename
+        }
+    
+    def save_sidecar(self, file_path: str, records: Optional[Iterable[dict]] = None, header: bool = True) -> Optional[str]:
+        """
+        Write the Parquet/Arrow sidecar of a lot CSV or segment when LOT_SIDECAR_FORMAT is set
+        Records are read back from the CSV when not given
+        A failed sidecar never fails the upload, reports then read the CSV
+        Returns the sidecar path or None
+        """
+        from app.services import sidecar  # Imported here, sidecar imports HEADERS from this module
+        
+        if not sidecar.sidecar_enabled():
+            return None
+        
+        try:
+            with timed("file"):
+                if records is None:
+                    records = sidecar.read_csv_records(file_path, header)
+                return sidecar.write_sidecar(file_path, records)
+        except Exception:
+            logger.exception("Error writing lot sidecar", extra={"file_path": file_path})
+            return None
+    
+    def staging_dir(self, upload_session_id: int) -> str:
+        """Directory holding the staged chunks of a chunked upload session"""
+        return os.path.join(self.upload_dir, "staging", str(upload_session_id))
+    
+    def _staged_lot_dir(self, upload_session_id: int, lot_number: str) -> str:
+        # Lot numbers are client supplied, never use them as path components
+        lot_key = hashlib.sha256(lot_number.encode()).hexdigest()[:16]
+        return os.path.join(self.staging_dir(upload_session_id), lot_key)
+    
+    def stage_chunk(self, upload_session_id: int, chunk_number: int, lots_data: Dict[str, List[dict]]):
+        """
+        Write a chunk's records as headerless CSV fragments, one per lot
+        Layout: staging/{session_id}/{lot_key}/{chunk_number}.csv
+        Re-staging the same chunk number replaces its previous fragments
+        """
+        fragment_name = f"{chunk_number:06d}.csv"
+        
+        with timed("file"):
+            for stale in glob.glob(os.path.join(self.staging_dir(upload_session_id), "*", fragment_name)):
+                os.remove(stale)
+            
+            for lot_number, records in lots_data.items():
+                lot_dir = self._staged_lot_dir(upload_session_id, lot_number)
+                os.makedirs(lot_dir, exist_ok=True)
+                
+                fragment_path = os.path.join(lot_dir, fragment_name)
+                tmp_path = fragment_path + ".tmp"
+                with open(tmp_path, 'w', newline='', encoding='utf-8') as csvfile:
+                    writer = csv.DictWriter(csvfile, fieldnames=HEADERS, extrasaction='ignore')
+                    writer.writerows(records)
+                os.replace(tmp_path, fragment_path)
+    
+    def assemble_lot(self, upload_session_id: int, lot_number: str, chunk_numbers: List[int], header: bool = True) -> Dict[str, str]:
+        """
+        Concatenate the staged fragments of a lot from the given chunks, in order, into its final CSV
+        Plain byte copies, records are not parsed again
+        Without header the result is a segment to append to an existing lot
+        Returns: {file_path, file_name}
+        """
+        if header:
+            filename = self.generate_filename(lot_number)
+            file_path = os.path.join(self.upload_dir, filename)
+        else:
+            file_path = self._segment_path()
+            filename = os.path.basename(file_path)
+        lot_dir = self._staged_lot_dir(upload_session_id, lot_number)
+        fragments = [os.path.join(lot_dir, f"{chunk_number:06d}.csv") for chunk_number in sorted(chunk_numbers)]
+        
+        self._concatenate(fragments, file_path, header)
+        
+        self.progress.publish("lot_written", lot_number=lot_number, chunks=len(fragments))
         return {
             'file_path': file_path,
             'file_name': filename
         }
     
+    def _segment_path(self) -> str:
+        segment_dir = os.path.join(self.upload_dir, "segments")
+        os.makedirs(segment_dir, exist_ok=True)
+        return os.path.join(segment_dir, f"{uuid.uuid4().hex}.csv")
+    
+    def _concatenate(self, sources: List[str], file_path: str, header: bool):
+        try:
+            with timed("file"), open(file_path, 'wb') as csvfile:
+                if header:
+                    csvfile.write(HEADER_LINE)
+                for source in sources:
+                    with open(source, 'rb') as source_file:
+                        shutil.copyfileobj(source_file, csvfile, 1 << 20)
+        except OSError:
+            # Don't leave a partial file behind
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise
+    
+    def archive_lot_files(self, lot_id: int, file_paths: List[str]) -> str:
+        """
+        Write a lot file and its segments into one gzip compressed CSV
+        Returns the archive path
+        """
+        archive_dir = os.path.join(self.upload_dir, "archive")
+        os.makedirs(archive_dir, exist_ok=True)
+        archive_path = os.path.join(archive_dir, f"lot_{lot_id}_{uuid.uuid4().hex[:12]}.csv.gz")
+        tmp_path = archive_path + ".tmp"
+        
+        try:
+            with timed("file"), gzip.open(tmp_path, 'wb', compresslevel=6) as archive:
+                for file_path in file_paths:
+                    with open_lot_file(file_path) as source_file:
+                        shutil.copyfileobj(source_file, archive, 1 << 20)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        
+        os.replace(tmp_path, archive_path)
+        return archive_path
+    
+    def save_segment(self, records: List[dict]) -> str:
+        """
+        Save records appended to an existing lot as a headerless CSV
+        Returns the file path
+        """
+        file_path = self._segment_path()
+        
+        with timed("file"), open(file_path, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=HEADERS, extrasaction='ignore')
+            writer.writerows(records)
+        
+        if records:
+            self.progress.publish("lot_written", lot_number=records[0]['lot_number'], records=len(records), appended=True)
+        return file_path
+    
+    def merge_lot_files(self, lot_id: int, file_path: str, segment_paths: List[str]) -> str:
+        """
+        Write a lot file followed by its segments into a new lot file
+        The lot file keeps its header, segments are appended as is
+        Returns the new file path
+        """
+        merged_path = os.path.join(self.upload_dir, f"lot_{lot_id}_{uuid.uuid4().hex[:12]}.csv")
+        self._concatenate([file_path] + segment_paths, merged_path, header=False)
+        return merged_path
+    
+    def discard_staging(self, upload_session_id: int):
+        """Remove the staged chunks of a session"""
+        shutil.rmtree(self.staging_dir(upload_session_id), ignore_errors=True)
+    
     def file_exists(self, file_path: str) -> bool:
         """Check if file exists"""
         return os.path.exists(file_path)
@@ -0,0 +1,392 @@
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+from app.core.config import settings
+from app.core.filelock import file_lock
+from app.core.logger import get_logger
+from app.core.optional import optional_import
+
+logger = get_logger(__name__)
+
+# Digests are the first 8 bytes of SHA-256, stored as little-endian uint64
+DIGEST_WIDTH = 8
+_DIGEST_FORMAT = "<Q"
+KINDS = ("qr_id", "qr_text")
+MANIFEST_NAME = "manifest.json"
+
+
+def qr_id_digest(qr_id: str) -> int:
+    """Fixed-width digest of a QR ID"""
+    return int.from_bytes(hashlib.sha256(qr_id.encode()).digest()[:DIGEST_WIDTH], "big")
+
+
+def qr_text_digest(qr_text_hash: str) -> int:
+    """Fixed-width digest of a QR text, taken from its stored SHA-256 hex hash"""
+    return int(qr_text_hash[:DIGEST_WIDTH * 2], 16)
+
+
+class Segment:
+    """Immutable sorted array of digests in a file, read through mmap"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.length = os.path.getsize(path) // DIGEST_WIDTH
+        self._mmap = None
+        self.array = None
+
+        if self.length:
+            with open(path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Without numpy, lookups fall back to bisect over the mapped file
+            np = optional_import("numpy")
+            if np is not None:
+                self.array = np.frombuffer(self._mmap, dtype="<u8")
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, i: int) -> int:
+        return struct.unpack_from(_DIGEST_FORMAT, self._mmap, i * DIGEST_WIDTH)[0]
+
+    def contains(self, digests: Sequence[int]) -> List[bool]:
+        """Vectorized binary search of all digests"""
+        if not self.length:
+            return [False] * len(digests)
+
+        if self.array is not None:
+            np = optional_import("numpy")
+            queries = np.fromiter(digests, dtype=np.uint64, count=len(digests))
+            positions = np.searchsorted(self.array, queries)
+            clipped = np.minimum(positions, self.length - 1)
+            return ((positions < self.length) & (self.array[clipped] == queries)).tolist()
+
+        found = []
+        for digest in digests:
+            i = bisect.bisect_left(self, digest)
+            found.append(i < self.length and self[i] == digest)
+        return found
+
+    def __iter__(self) -> Iterator[int]:
+        for i in range(self.length):
+            yield self[i]
+
+    def close(self):
+        self.array = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+def write_segment(directory: str, kind: str, digests) -> str:
+    """Write sorted unique digests to a new segment file, returns its name"""
+    name = f"{kind}_{uuid.uuid4().hex[:12]}.seg"
+    tmp_path = os.path.join(directory, name + ".tmp")
+    np = optional_import("numpy")
+
+    with open(tmp_path, "wb") as f:
+        if np is not None and isinstance(digests, np.ndarray):
+            f.write(digests.astype("<u8").tobytes())
+        else:
+            buffer = bytearray()
+            for digest in digests:
+                buffer += struct.pack(_DIGEST_FORMAT, digest)
+                if len(buffer) >= 1 << 20:
+                    f.write(buffer)
+                    buffer.clear()
+            f.write(buffer)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, os.path.join(directory, name))
+    return name
+
+
+def _merge_segments(segments: List[Segment]):
+    """Merge sorted segments into one sorted, deduplicated sequence"""
+    np = optional_import("numpy")
+    if np is not None:
+        arrays = [s.array for s in segments if s.array is not None]
+        return np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.uint64)
+
+    import heapq
+
+    def unique(values):
+        last = None
+        for value in values:
+            if value != last:
+                yield value
+                last = value
+
+    return unique(heapq.merge(*segments))
+
+
+class DigestIndex:
+    """
+    Compact on-disk existence index of QR IDs and QR text hashes
+
+    Segment files hold sorted fixed-width digests and are searched through
+    mmap; identifiers inserted since the last flush are kept in an in-memory
+    delta. Digests are truncated, so a hit only means "maybe present" and must
+    be confirmed against qr_identifiers, which stays the source of truth.
+    The cold tier is followed with its own cursor, so a miss is definitive
+    for both tiers once the index is synced with them.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self.lock_path = os.path.join(directory, "index.lock")
+        self._lock = threading.RLock()
+        self._segments: Dict[str, List[Segment]] = {kind: [] for kind in KINDS}
+        self._delta: Dict[str, set] = {kind: set() for kind in KINDS}
+        self._cursor: Optional[List[int]] = None
+        self._cold_cursor = 0
+        self._manifest_mtime: Optional[int] = None
+        self._exclusive_depth = 0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the in-process lock and, once per nesting, the cross-process file lock"""
+        with self._lock:
+            if self._exclusive_depth:
+                self._exclusive_depth += 1
+                try:
+                    yield
+                finally:
+                    self._exclusive_depth -= 1
+                return
+
+            with file_lock(self.lock_path):
+                self._exclusive_depth = 1
+                try:
+                    yield
+                finally:
+                    self._exclusive_depth = 0
+
+    # Manifest handling
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, segments: Dict[str, List[str]], cursor: List[int], cold_cursor: int):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"segments": segments, "cursor": cursor, "cold_cursor": cold_cursor}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _reload_if_changed(self, partitions: int):
+        """Pick up segments flushed or compacted by other worker processes"""
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime == self._manifest_mtime and self._cursor is not None:
+            return
+
+        manifest = self._read_manifest()
+        if manifest is not None and len(manifest["cursor"]) != partitions:
+            # Partitioning changed, the index has to be rebuilt from scratch
+            logger.warning("Digest index partition count changed, rebuilding")
+            manifest = None
+
+        for segments in self._segments.values():
+            for segment in segments:
+                segment.close()
+
+        if manifest is None:
+            self._segments = {kind: [] for kind in KINDS}
+            self._cursor = [0] * partitions
+            self._cold_cursor = 0
+            self._delta = {kind: set() for kind in KINDS}
+        else:
+            self._segments = {
+                kind: [Segment(os.path.join(self.directory, name)) for name in manifest["segments"][kind]]
+                for kind in KINDS
+            }
+            # Rows up to the manifest cursor are in the segments
+            own_cursor = self._cursor or [0] * partitions
+            self._cursor = [max(a, b) for a, b in zip(own_cursor, manifest["cursor"])]
+            # Manifests written before the cold tier was indexed start it from scratch
+            self._cold_cursor = max(self._cold_cursor, manifest.get("cold_cursor", 0))
+
+        self._manifest_mtime = mtime
+
+    # Public API
+
+    def sync(self, store, cold_store=None):
+        """
+        Catch up with identifiers inserted since the last sync (by any worker)
+        and, when given, with those moved to the cold tier
+        On PostgreSQL ids may commit out of order, so an overlap window is re-read
+        """
+        with self._lock:
+            self._reload_if_changed(store.partitions)
+
+            overlap = settings.DIGEST_INDEX_SYNC_OVERLAP if store.db.get_bind().dialect.name == "postgresql" else 0
+            cursor = [max(0, c - overlap) for c in self._cursor]
+            limit = settings.DIGEST_INDEX_DELTA_LIMIT
+
+            while True:
+                rows, new_cursor = store.changes_since(cursor, limit)
+                for row in rows:
+                    self._delta["qr_id"].add(qr_id_digest(row.qr_id))
+                    self._delta["qr_text"].add(qr_text_digest(row.qr_text_hash))
+
+                self._cursor = [max(a, b) for a, b in zip(self._cursor, new_cursor)]
+                cursor = new_cursor
+
+                if len(self._delta["qr_id"]) >= limit:
+                    self.flush()
+                if len(rows) < limit:
+                    break
+
+            if cold_store is None:
+                return
+
+            cold_cursor = max(0, self._cold_cursor - overlap)
+            while True:
+                rows, cold_cursor = cold_store.changes_since(cold_cursor, limit)
+                for row in rows:
+                    self._delta["qr_id"].add(qr_id_digest(row.qr_id))
+                    self._delta["qr_text"].add(qr_text_digest(row.qr_text_hash))
+
+                self._cold_cursor = max(self._cold_cursor, cold_cursor)
+
+                if len(self._delta["qr_id"]) >= limit:
+                    self.flush()
+                if len(rows) < limit:
+                    break
+
+    def contains(self, qr_ids: Sequence[str], qr_text_hashes: Sequence[str]) -> List[bool]:
+        """For each (qr_id, qr_text_hash) pair, whether either may already be stored"""
+        id_digests = [qr_id_digest(qr_id) for qr_id in qr_ids]
+        text_digests = [qr_text_digest(h) for h in qr_text_hashes]
+
+        with self._lock:
+            found = [
+                a in self._delta["qr_id"] or b in self._delta["qr_text"]
+                for a, b in zip(id_digests, text_digests)
+            ]
+            for kind, digests in (("qr_id", id_digests), ("qr_text", text_digests)):
+                for segment in self._segments[kind]:
+                    found = [f or hit for f, hit in zip(found, segment.contains(digests))]
+
+        return found
+
+    def flush(self):
+        """Write the in-memory delta as new segments, compacting when there are too many"""
+        with self._exclusive():
+            self._reload_if_changed(len(self._cursor))
+
+            manifest = self._read_manifest()
+            if manifest is None or len(manifest["cursor"]) != len(self._cursor):
+                manifest = {"segments": {kind: [] for kind in KINDS}}
+            segments = {kind: list(manifest["segments"][kind]) for kind in KINDS}
+            for kind in KINDS:
+                if self._delta[kind]:
+                    segments[kind].append(write_segment(self.directory, kind, sorted(self._delta[kind])))
+
+            self._write_manifest(segments, self._cursor, self._cold_cursor)
+            self._delta = {kind: set() for kind in KINDS}
+            self._manifest_mtime = None
+            self._reload_if_changed(len(self._cursor))
+
+            if max(len(s) for s in self._segments.values()) > settings.DIGEST_INDEX_MAX_SEGMENTS:
+                self.compact()
+
+    def compact(self):
+        """Merge all segments of each kind into a single segment"""
+        with self._exclusive():
+            self._reload_if_changed(len(self._cursor))
+
+            old_segments = self._segments
+            segments = {
+                kind: [write_segment(self.directory, kind, _merge_segments(old_segments[kind]))]
+                for kind in KINDS
+            }
+            self._write_manifest(segments, self._cursor, self._cold_cursor)
+            self._manifest_mtime = None
+            self._reload_if_changed(len(self._cursor))
+
+            for kind_segments in old_segments.values():
+                for segment in kind_segments:
+                    segment.close()
+                    try:
+                        os.remove(segment.path)
+                    except OSError:
+                        # Still mapped by another process on platforms that forbid it
+                        pass
+
+            logger.info("Compacted digest index", extra={
+                "qr_id_digests": len(self._segments["qr_id"][0]),
+                "qr_text_digests": len(self._segments["qr_text"][0])
+            })
+
+    def rebuild(self, store, cold_store=None):
+        """Rebuild the index from the qr_identifiers table and, when given, the cold tier"""
+        with self._exclusive():
+            old_manifest = self._read_manifest()
+            if old_manifest is not None:
+                os.remove(self.manifest_path)
+            self._cursor = None
+            self._cold_cursor = 0
+            self._manifest_mtime = None
+
+            self.sync(store, cold_store)
+            self.flush()
+            self.compact()
+
+            if old_manifest is not None:
+                for names in old_manifest["segments"].values():
+                    for name in names:
+                        try:
+                            os.remove(os.path.join(self.directory, name))
+                        except OSError:
+                            pass
+
+
+_index: Optional[DigestIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_digest_index() -> Optional[DigestIndex]:
+    """Process-wide digest index, None when disabled"""
+    global _index
+
+    if not settings.DIGEST_INDEX_ENABLED:
+        return None
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DigestIndex(settings.DIGEST_INDEX_DIR)
+    return _index
+
+
+if __name__ == "__main__":
+    # python -m app.services.digest_index
+    from app.models.database import SessionLocal
+    from app.services.identifier_store import ColdIdentifierStore, get_identifier_store
+
+    db = SessionLocal()
+    try:
+        DigestIndex(settings.DIGEST_INDEX_DIR).rebuild(get_identifier_store(db), ColdIdentifierStore(db))
+        print("Digest index rebuilt")
+    finally:
+        db.close()
@@ -0,0 +1,68 @@
+import gzip
+import itertools
+import json
+import os
+import shutil
+from typing import Iterator, List, Optional, Tuple
+from app.core.config import settings
+from app.core.timing import timed
+
+# Fast level: the report is written while the upload request waits
+COMPRESS_LEVEL = 1
+# Part of a single request upload; chunks are parts of their own
+UPLOAD_PART = "upload"
+
+
+def chunk_part(chunk_number: int) -> str:
+    return f"chunk-{chunk_number:06d}"
+
+
+class DuplicateReport:
+    """
+    Full list of the duplicate records of an upload session, as gzip NDJSON
+    Layout: duplicates/{session_id}/{part}.ndjson.gz, one part for a single
+    request upload or one per chunk of a chunked upload, so a re-sent chunk
+    replaces its own part
+    """
+
+    def __init__(self, upload_session_id: int):
+        self.directory = os.path.join(settings.UPLOAD_DIR, "duplicates", str(upload_session_id))
+
+    def part_path(self, part: str) -> str:
+        return os.path.join(self.directory, f"{part}.ndjson.gz")
+
+    def write(self, part: str, duplicates: List[dict]) -> Optional[str]:
+        """Write a part, returns the report directory, None when there are no duplicates"""
+        if not duplicates:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.part_path(part)
+        tmp_path = path + ".tmp"
+        with timed("file"), gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=COMPRESS_LEVEL) as f:
+            f.writelines(json.dumps(record) + "\n" for record in duplicates)
+        os.replace(tmp_path, path)
+        return self.directory
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def iter_lines(self, parts: List[Tuple[str, int]], offset: int = 0, limit: Optional[int] = None) -> Iterator[str]:
+        """
+        NDJSON lines of the given (part, record count) pairs in order, from
+        offset on; parts entirely before offset are skipped without reading them
+        """
+        def lines():
+            skip = offset
+            for part, count in parts:
+                if skip >= count:
+                    skip -= count
+                    continue
+                path = self.part_path(part)
+                if not os.path.exists(path):
+                    continue
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    yield from itertools.islice(f, skip, None)
+                skip = 0
+
+        return itertools.islice(lines(), limit)
@@ -0,0 +1,188 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, BinaryIO, Iterator, List, Optional
+import anyio
+from sqlalchemy import func
+from sqlalchemy.orm import Query, Session
+from app.models.models import Lot, UploadSession
+from app.services.csv_generator import HEADERS
+from app.services.lot_search import filter_lot_number
+from app.services.lot_segments import open_lot_files
+from app.core.optional import optional_import
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Lots fetched per query and rows per NDJSON chunk / Arrow record batch
+LOT_PAGE_SIZE = 200
+ROW_BATCH_SIZE = 10000
+READ_SIZE = 1 << 20
+
+
+def arrow_available() -> bool:
+    return optional_import("pyarrow") is not None
+
+
+def export_query(
+    db: Session,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    token_id: Optional[int] = None,
+    lot_number: Optional[str] = None,
+    search: str = "substring"
+) -> Query:
+    """
+    Lots matching the export filters
+    The time range selects lots with records uploaded in it, i.e. created
+    before until and created or appended to after since
+    """
+    query = db.query(Lot)
+
+    if since is not None:
+        query = query.filter(func.coalesce(Lot.updated_at, Lot.uploaded_at) >= since)
+    if until is not None:
+        query = query.filter(Lot.uploaded_at < until)
+    if token_id is not None:
+        query = query.join(UploadSession, Lot.upload_session_id == UploadSession.id).filter(
+            UploadSession.token_id == token_id
+        )
+    if lot_number:
+        query = filter_lot_number(query, lot_number, search)
+
+    return query
+
+
+async def _iter_lot_files(query: Query) -> AsyncIterator[List[BinaryIO]]:
+    """
+    Open files of each matching lot, in id order
+    Keyset pagination keeps one page of lots in memory; the database work
+    runs in a worker thread so the event loop is never blocked
+    """
+    last_id = 0
+
+    def fetch_page():
+        return query.filter(Lot.id > last_id).order_by(Lot.id).limit(LOT_PAGE_SIZE).all()
+
+    while True:
+        lots = await anyio.to_thread.run_sync(fetch_page)
+        if not lots:
+            return
+
+        for lot in lots:
+            files = await anyio.to_thread.run_sync(open_lot_files, query.session, lot)
+            if files is None:
+                # Deleted while exporting
+                continue
+            try:
+                yield files
+            finally:
+                for f in files:
+                    f.close()
+
+        last_id = lots[-1].id
+
+
+def _iter_row_batches(files: List[BinaryIO]) -> Iterator[List[List[str]]]:
+    """Parsed rows of a lot's files, skipping the header of the lot file"""
+    batch = []
+    for position, f in enumerate(files):
+        reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+        if position == 0:
+            next(reader, None)
+        for row in reader:
+            batch.append(row)
+            if len(batch) >= ROW_BATCH_SIZE:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+async def _aiter_row_batches(query: Query) -> AsyncIterator[List[List[str]]]:
+    """
+    Row batches of all matching lots, each read in a worker thread only
+    when the previous one was sent, so a slow client slows reading down
+    instead of buffering the export in memory
+    """
+    async for files in _iter_lot_files(query):
+        batches = _iter_row_batches(files)
+        while True:
+            batch = await anyio.to_thread.run_sync(next, batches, None)
+            if batch is None:
+                break
+            yield batch
+
+
+async def _export_csv(query: Query) -> AsyncIterator[bytes]:
+    """Lot files byte for byte under a single header, without parsing them"""
+    yield (','.join(HEADERS) + '\r\n').encode('utf-8')
+
+    async for files in _iter_lot_files(query):
+        for position, f in enumerate(files):
+            async_file = anyio.wrap_file(f)
+            if position == 0:
+                await async_file.readline()
+            while chunk := await async_file.read(READ_SIZE):
+                yield chunk
+
+
+async def _export_ndjson(query: Query) -> AsyncIterator[bytes]:
+    async for batch in _aiter_row_batches(query):
+        lines = [json.dumps(dict(zip(HEADERS, row))) for row in batch]
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def arrow_schema():
+    """Record schema, lot_number and print_format dictionary encoded"""
+    pa = optional_import("pyarrow")
+    return pa.schema([
+        ('qr_id', pa.string()),
+        ('qr_text', pa.string()),
+        ('lot_number', pa.dictionary(pa.int32(), pa.string())),
+        ('print_format', pa.dictionary(pa.int32(), pa.string())),
+    ])
+
+
+def arrow_record_batch(rows: List[List[str]], schema) -> "pyarrow.RecordBatch":
+    pa = optional_import("pyarrow")
+    columns = list(zip(*rows)) if rows else [()] * len(HEADERS)
+    arrays = []
+    for column, field in zip(columns, schema):
+        array = pa.array(column, type=pa.string())
+        arrays.append(array.dictionary_encode() if pa.types.is_dictionary(field.type) else array)
+    return pa.record_batch(arrays, schema=schema)
+
+
+async def _export_arrow(query: Query) -> AsyncIterator[bytes]:
+    """Arrow IPC stream, one record batch per row batch"""
+    pa = optional_import("pyarrow")
+    schema = arrow_schema()
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def drain() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    yield drain()
+    async for batch in _aiter_row_batches(query):
+        writer.write_batch(arrow_record_batch(batch, schema))
+        yield drain()
+    writer.close()
+    yield drain()
+
+
+def stream_export(query: Query, export_format: str) -> AsyncIterator[bytes]:
+    """Async byte stream of all records of the matching lots in the given format"""
+    if export_format == "csv":
+        return _export_csv(query)
+    if export_format == "arrow":
+        return _export_arrow(query)
+    return _export_ndjson(query)
@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.models import UploadSession
+from app.services.cleanup import discard_upload_session
+from app.services.token_usage import as_utc
+
+
+class IdempotencyService:
+    """
+    Replay of upload responses for retried requests carrying an Idempotency-Key
+    The key, request body digest and response are stored on the UploadSession
+    the original request created; the response commits with the lots, so a
+    session without one never finished
+    """
+
+    def __init__(self, db: Session, token_id: int, key: Optional[str], request_digest: str):
+        self.db = db
+        self.token_id = token_id
+        self.key = key
+        self.request_digest = request_digest
+
+    def cached_response(self, locked: bool = False) -> Optional[str]:
+        """
+        Return the stored response JSON of an earlier request with the same key
+        Raises 400 if the key was used with a different body, 409 if that
+        request is still running. A request without a response after
+        IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS is presumed dead, but only a
+        caller holding the ingest lock (locked=True) takes its session over,
+        discards it and runs the upload again; without the lock None defers to
+        that check. An original still running after the lock then fails to
+        store its response (see store_response)
+        """
+        if not self.key:
+            return None
+
+        upload_session = self.db.query(UploadSession).filter(
+            UploadSession.token_id == self.token_id,
+            UploadSession.idempotency_key == self.key,
+            UploadSession.idempotency_expires_at > datetime.utcnow()
+        ).populate_existing().first()
+
+        if upload_session is None:
+            self._release_expired()
+            return None
+
+        if upload_session.request_digest != self.request_digest:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Idempotency-Key was already used with a different request body"
+            )
+
+        if upload_session.response_body is None:
+            started_at = as_utc(upload_session.uploaded_at)
+            if datetime.now(timezone.utc) - started_at > timedelta(seconds=settings.IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS):
+                if not locked:
+                    return None
+                if self._take_over(int(upload_session.id)):
+                    # The row stays until retention, its id can't be reused
+                    # by this retry's session while the original may still run
+                    discard_upload_session(self.db, int(upload_session.id), keep_session=True)
+                    return None
+                # The original stored its response meanwhile
+                return self.cached_response()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still being processed"
+            )
+
+        return upload_session.response_body
+
+    def _take_over(self, upload_session_id: int) -> bool:
+        """
+        Mark a keyed session without a response as being discarded and free its
+        key, False when its response was stored first; races with
+        store_response on the row
+        """
+        claimed = self.db.query(UploadSession).filter(
+            UploadSession.id == upload_session_id,
+            UploadSession.response_body.is_(None),
+            UploadSession.status != "aborting"
+        ).update({
+            UploadSession.status: "aborting",
+            UploadSession.idempotency_key: None,
+            UploadSession.request_digest: None,
+            UploadSession.idempotency_expires_at: None
+        }, synchronize_session=False)
+        self.db.commit()
+        return bool(claimed)
+
+    def _release_expired(self):
+        """Clear this token's expired keys so they can be reused"""
+        cleared = self.db.query(UploadSession).filter(
+            UploadSession.token_id == self.token_id,
+            UploadSession.idempotency_key.isnot(None),
+            UploadSession.idempotency_expires_at <= datetime.utcnow()
+        ).update({
+            UploadSession.idempotency_key: None,
+            UploadSession.request_digest: None,
+            UploadSession.response_body: None,
+            UploadSession.idempotency_expires_at: None
+        }, synchronize_session=False)
+        if cleared:
+            self.db.commit()
+
+    def attach(self, upload_session: UploadSession):
+        """Record the key on the session created for this request (before commit)"""
+        if not self.key:
+            return
+        upload_session.idempotency_key = self.key
+        upload_session.request_digest = self.request_digest
+        upload_session.idempotency_expires_at = datetime.utcnow() + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+
+    def store_response(self, upload_session: UploadSession, response: BaseModel):
+        """
+        Cache the response so retries get it without re-running the upload
+        Not committed: it commits with the lots it describes
+        Raises 409 when a retry took the session over as dead (see cached_response)
+        """
+        if not self.key:
+            return
+        stored = self.db.query(UploadSession).filter(
+            UploadSession.id == upload_session.id,
+            UploadSession.status != "aborting"
+        ).update({UploadSession.response_body: response.model_dump_json()}, synchronize_session=False)
+        if not stored:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A retry with this Idempotency-Key took over this request"
+            )
@@ -0,0 +1,435 @@
+import contextvars
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import (
+    Column, DateTime, Engine, Index, Integer, MetaData, String, Table,
+    create_engine, delete, insert, or_, select, text, tuple_
+)
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+from app.core.config import settings
+from app.core.timing import install_db_timing
+from app.models.models import QRIdentifier, QRIdentifierCold
+
+# Columns returned by every lookup
+LOOKUP_COLUMNS = ("qr_id", "qr_text_hash", "lot_number", "upload_session_id")
+ColdRow = namedtuple("ColdRow", LOOKUP_COLUMNS)
+ColdChange = namedtuple("ColdChange", ("id", "qr_id", "qr_text_hash"))
+
+# Table layout inside each SQLite shard file (no FK, upload_sessions lives in the main database)
+shard_metadata = MetaData()
+shard_table = Table(
+    "qr_identifiers",
+    shard_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("qr_id", String(100), nullable=False),
+    Column("qr_text_hash", String(64), nullable=False),
+    Column("lot_number", String(50), nullable=False),
+    Column("upload_session_id", Integer, nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Index("ix_shard_qr_id", "qr_id"),
+    Index("ix_shard_qr_text_hash", "qr_text_hash"),
+    Index("ix_shard_upload_session_id", "upload_session_id"),
+    Index("ix_shard_session_lot", "upload_session_id", "lot_number"),
+)
+
+
+def partition_for(qr_text_hash: str, partitions: int) -> int:
+    """Map a hex SHA-256 digest to its partition by hash prefix"""
+    return int(qr_text_hash[:8], 16) % partitions
+
+
+def is_sharded() -> bool:
+    """SQLite shard files are used when partitioning is enabled on a SQLite database"""
+    return settings.QR_PARTITIONS > 0 and "sqlite" in settings.DATABASE_URL.lower()
+
+
+class IdentifierStore:
+    """
+    Storage of QR identifiers in the main database
+    Used for the plain qr_identifiers table and for the PostgreSQL
+    hash-partitioned table, where partition pruning and tuple routing
+    are done by the server
+    """
+
+    partitions = 1
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def find_existing(self, qr_ids: Sequence[str], qr_text_hashes: Sequence[str]) -> List:
+        """Return stored identifiers matching any of the given QR IDs or text hashes"""
+        if not qr_ids and not qr_text_hashes:
+            return []
+
+        return self.db.query(
+            QRIdentifier.qr_id,
+            QRIdentifier.qr_text_hash,
+            QRIdentifier.lot_number,
+            QRIdentifier.upload_session_id
+        ).filter(
+            (QRIdentifier.qr_id.in_(qr_ids)) |
+            (QRIdentifier.qr_text_hash.in_(qr_text_hashes))
+        ).all()
+
+    def insert(self, rows: List[dict], commit: bool = True):
+        """
+        Insert identifier rows (qr_id, qr_text_hash, lot_number, upload_session_id)
+        With commit=False the rows are only flushed, so the caller can commit
+        them together with other changes; if the caller rolls back instead it
+        calls discard_uncommitted
+        """
+        if not rows:
+            return
+        self.db.bulk_save_objects([QRIdentifier(**row) for row in rows])
+        if commit:
+            self.db.commit()
+        else:
+            self.db.flush()
+
+    def discard_uncommitted(self):
+        """Undo inserts made with commit=False after the caller rolled back"""
+        # The rows were part of the caller's transaction, the rollback removed them
+
+    def changes_since(self, cursor: List[int], limit: int = 100000) -> Tuple[List, List[int]]:
+        """
+        Return identifiers (id, qr_id, qr_text_hash) inserted after the cursor and the advanced cursor
+        The cursor holds the last seen id per partition
+        """
+        rows = self.db.query(
+            QRIdentifier.id,
+            QRIdentifier.qr_id,
+            QRIdentifier.qr_text_hash
+        ).filter(
+            QRIdentifier.id > cursor[0]
+        ).order_by(QRIdentifier.id).limit(limit).all()
+
+        return rows, [rows[-1].id if rows else cursor[0]]
+
+    def created_before(self, cutoff: datetime, limit: int) -> List:
+        """
+        Oldest identifiers created before cutoff, with id and LOOKUP_COLUMNS
+        Ids grow with time, so walking the primary key stops at the first recent rows
+        """
+        return self.db.query(
+            QRIdentifier.id,
+            *(getattr(QRIdentifier, name) for name in LOOKUP_COLUMNS)
+        ).filter(
+            QRIdentifier.created_at < cutoff
+        ).order_by(QRIdentifier.id).limit(limit).all()
+
+    def delete_for_lots(self, keys: List[Tuple[int, str]]) -> int:
+        """Delete identifiers of (upload_session_id, lot_number) pairs, returns the number deleted"""
+        if not keys:
+            return 0
+        deleted = self.db.query(QRIdentifier).filter(
+            tuple_(QRIdentifier.upload_session_id, QRIdentifier.lot_number).in_(keys)
+        ).delete(synchronize_session=False)
+        self.db.commit()
+        return deleted
+
+    def delete_for_session(self, upload_session_id: int) -> int:
+        """Delete every identifier of an upload session, returns the number deleted"""
+        deleted = self.db.query(QRIdentifier).filter(
+            QRIdentifier.upload_session_id == upload_session_id
+        ).delete(synchronize_session=False)
+        self.db.commit()
+        return deleted
+
+    def delete(self, rows: List):
+        """Delete identifier rows returned by created_before"""
+        if not rows:
+            return
+        self.db.query(QRIdentifier).filter(
+            QRIdentifier.id.in_([row.id for row in rows])
+        ).delete(synchronize_session=False)
+        self.db.commit()
+
+
+class ShardedIdentifierStore(IdentifierStore):
+    """
+    Storage of QR identifiers across SQLite shard files keyed by hash prefix
+    Each shard has its own connection pool and write lock, so lookups and
+    inserts for one batch run in parallel across shards
+    """
+
+    _engines: Optional[List[Engine]] = None
+    _executor: Optional[ThreadPoolExecutor] = None
+    _init_lock = threading.Lock()
+
+    def __init__(self, db: Session):
+        super().__init__(db)
+        self.engines = self._get_engines()
+        self.partitions = len(self.engines)
+        # Rows inserted with commit=False, see discard_uncommitted
+        self._uncommitted: List[dict] = []
+
+    @classmethod
+    def _get_engines(cls) -> List[Engine]:
+        if cls._engines is None:
+            with cls._init_lock:
+                if cls._engines is None:
+                    cls._engines = create_shard_engines()
+                    cls._executor = ThreadPoolExecutor(
+                        max_workers=settings.QR_PARTITION_WORKERS,
+                        thread_name_prefix="qr-shard"
+                    )
+        return cls._engines
+
+    def _map(self, func, shard_args: Dict[int, tuple]) -> list:
+        """Run func(shard, *args) for each shard in parallel, keeping the request context"""
+        futures = [
+            self._executor.submit(contextvars.copy_context().run, func, shard, *args)
+            for shard, args in shard_args.items()
+        ]
+        return [future.result() for future in futures]
+
+    def _find_in_shard(self, shard: int, qr_ids: Sequence[str], qr_text_hashes: Sequence[str]) -> List:
+        conditions = []
+        if qr_text_hashes:
+            conditions.append(shard_table.c.qr_text_hash.in_(qr_text_hashes))
+        if qr_ids:
+            conditions.append(shard_table.c.qr_id.in_(qr_ids))
+
+        query = select(*(shard_table.c[name] for name in LOOKUP_COLUMNS)).where(or_(*conditions))
+        with self.engines[shard].connect() as conn:
+            return conn.execute(query).all()
+
+    def _insert_into_shard(self, shard: int, rows: List[dict]):
+        with self.engines[shard].begin() as conn:
+            conn.execute(insert(shard_table), rows)
+
+    def _changes_in_shard(self, shard: int, after_id: int, limit: int) -> List:
+        query = select(
+            shard_table.c.id, shard_table.c.qr_id, shard_table.c.qr_text_hash
+        ).where(shard_table.c.id > after_id).order_by(shard_table.c.id).limit(limit)
+        with self.engines[shard].connect() as conn:
+            return conn.execute(query).all()
+
+    def _created_before_in_shard(self, shard: int, cutoff: datetime, limit: int) -> List:
+        query = select(
+            shard_table.c.id, *(shard_table.c[name] for name in LOOKUP_COLUMNS)
+        ).where(shard_table.c.created_at < cutoff).order_by(shard_table.c.id).limit(limit)
+        with self.engines[shard].connect() as conn:
+            return conn.execute(query).all()
+
+    def _delete_from_shard(self, shard: int, ids: List[int]):
+        with self.engines[shard].begin() as conn:
+            conn.execute(delete(shard_table).where(shard_table.c.id.in_(ids)))
+
+    def _delete_lots_from_shard(self, shard: int, keys: List[Tuple[int, str]]) -> int:
+        condition = tuple_(shard_table.c.upload_session_id, shard_table.c.lot_number).in_(keys)
+        with self.engines[shard].begin() as conn:
+            return conn.execute(delete(shard_table).where(condition)).rowcount
+
+    def _delete_rows_from_shard(self, shard: int, rows: List[dict]):
+        condition = tuple_(shard_table.c.upload_session_id, shard_table.c.qr_text_hash).in_(
+            [(row['upload_session_id'], row['qr_text_hash']) for row in rows]
+        )
+        with self.engines[shard].begin() as conn:
+            conn.execute(delete(shard_table).where(condition))
+
+    def _delete_session_from_shard(self, shard: int, upload_session_id: int) -> int:
+        condition = shard_table.c.upload_session_id == upload_session_id
+        with self.engines[shard].begin() as conn:
+            return conn.execute(delete(shard_table).where(condition)).rowcount
+
+    def _group_by_shard(self, rows: List[dict]) -> Dict[int, List[dict]]:
+        grouped: Dict[int, List[dict]] = {}
+        for row in rows:
+            grouped.setdefault(partition_for(row['qr_text_hash'], self.partitions), []).append(row)
+        return grouped
+
+    def find_existing(self, qr_ids: Sequence[str], qr_text_hashes: Sequence[str]) -> List:
+        """
+        Text hashes are routed to their own shard; a QR ID can live in any
+        shard (the partition key is the text hash), so QR IDs are checked in all
+        """
+        if not qr_ids and not qr_text_hashes:
+            return []
+
+        hashes_by_shard: Dict[int, List[str]] = {shard: [] for shard in range(self.partitions)}
+        for qr_text_hash in qr_text_hashes:
+            hashes_by_shard[partition_for(qr_text_hash, self.partitions)].append(qr_text_hash)
+
+        results = self._map(self._find_in_shard, {
+            shard: (qr_ids, hashes)
+            for shard, hashes in hashes_by_shard.items()
+            if hashes or qr_ids
+        })
+        return [row for rows in results for row in rows]
+
+    def changes_since(self, cursor: List[int], limit: int = 100000) -> Tuple[List, List[int]]:
+        results = self._map(self._changes_in_shard, {
+            shard: (cursor[shard], limit)
+            for shard in range(self.partitions)
+        })
+        new_cursor = [
+            rows[-1].id if rows else cursor[shard]
+            for shard, rows in enumerate(results)
+        ]
+        return [row for rows in results for row in rows], new_cursor
+
+    def created_before(self, cutoff: datetime, limit: int) -> List:
+        # Up to limit rows per shard
+        results = self._map(self._created_before_in_shard, {
+            shard: (cutoff, limit)
+            for shard in range(self.partitions)
+        })
+        return [row for rows in results for row in rows]
+
+    def delete(self, rows: List):
+        # Ids are per shard, rows are routed back by their text hash
+        ids_by_shard: Dict[int, List[int]] = {}
+        for row in rows:
+            ids_by_shard.setdefault(partition_for(row.qr_text_hash, self.partitions), []).append(row.id)
+        self._map(self._delete_from_shard, {shard: (ids,) for shard, ids in ids_by_shard.items()})
+
+    def delete_for_lots(self, keys: List[Tuple[int, str]]) -> int:
+        # Sessions aren't tied to a shard, every shard is checked
+        if not keys:
+            return 0
+        return sum(self._map(self._delete_lots_from_shard, {
+            shard: (keys,)
+            for shard in range(self.partitions)
+        }))
+
+    def delete_for_session(self, upload_session_id: int) -> int:
+        return sum(self._map(self._delete_session_from_shard, {
+            shard: (upload_session_id,)
+            for shard in range(self.partitions)
+        }))
+
+    def insert(self, rows: List[dict], commit: bool = True):
+        # Shard files are separate databases, their writes always commit;
+        # with commit=False the rows are remembered so discard_uncommitted can delete them
+        if not rows:
+            return
+        self._map(self._insert_into_shard, {
+            shard: (shard_rows,)
+            for shard, shard_rows in self._group_by_shard(rows).items()
+        })
+        if not commit:
+            self._uncommitted += rows
+
+    def discard_uncommitted(self):
+        # Rows are new identifiers of their session, (session, text hash) matches only them
+        if not self._uncommitted:
+            return
+        self._map(self._delete_rows_from_shard, {
+            shard: (shard_rows,)
+            for shard, shard_rows in self._group_by_shard(self._uncommitted).items()
+        })
+        self._uncommitted = []
+
+
+def cold_digest(qr_text_hash: str) -> bytes:
+    """Cold tier text digest: the first 16 bytes of the hex SHA-256"""
+    return bytes.fromhex(qr_text_hash[:32])
+
+
+class ColdIdentifierStore:
+    """
+    Identifiers moved out of the hot store by retention, in the main database
+    Returns rows shaped like IdentifierStore.find_existing, with the full
+    qr_text_hash of the matching input
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def find_existing(self, qr_ids: Sequence[str], qr_text_hashes: Sequence[str]) -> List:
+        if not qr_ids and not qr_text_hashes:
+            return []
+
+        hashes_by_digest = {cold_digest(h): h for h in qr_text_hashes}
+        rows = self.db.query(
+            QRIdentifierCold.qr_id,
+            QRIdentifierCold.qr_text_digest,
+            QRIdentifierCold.lot_number,
+            QRIdentifierCold.upload_session_id
+        ).filter(
+            (QRIdentifierCold.qr_id.in_(qr_ids)) |
+            (QRIdentifierCold.qr_text_digest.in_(list(hashes_by_digest)))
+        ).all()
+
+        # Matched by qr_id only: the original hash is unknown, return the digest in hex
+        return [
+            ColdRow(
+                row.qr_id,
+                hashes_by_digest.get(row.qr_text_digest, row.qr_text_digest.hex()),
+                row.lot_number,
+                row.upload_session_id
+            )
+            for row in rows
+        ]
+
+    def changes_since(self, cursor: int, limit: int = 100000) -> Tuple[List, int]:
+        """
+        Return identifiers (id, qr_id, qr_text_hash) moved in after the cursor and the advanced cursor
+        qr_text_hash is the hex of the stored digest, a prefix of the original hash
+        """
+        rows = self.db.query(
+            QRIdentifierCold.id,
+            QRIdentifierCold.qr_id,
+            QRIdentifierCold.qr_text_digest
+        ).filter(
+            QRIdentifierCold.id > cursor
+        ).order_by(QRIdentifierCold.id).limit(limit).all()
+
+        changes = [ColdChange(row.id, row.qr_id, row.qr_text_digest.hex()) for row in rows]
+        return changes, (rows[-1].id if rows else cursor)
+
+    def has_rows(self) -> bool:
+        return self.db.query(QRIdentifierCold.id).first() is not None
+
+    def delete_for_lots(self, keys: List[Tuple[int, str]]) -> int:
+        if not keys:
+            return 0
+        deleted = self.db.query(QRIdentifierCold).filter(
+            tuple_(QRIdentifierCold.upload_session_id, QRIdentifierCold.lot_number).in_(keys)
+        ).delete(synchronize_session=False)
+        self.db.commit()
+        return deleted
+
+    def insert(self, rows: List):
+        """Insert rows returned by a hot store's created_before, not committed"""
+        if not rows:
+            return
+        self.db.execute(insert(QRIdentifierCold), [
+            {
+                'qr_id': row.qr_id,
+                'qr_text_digest': cold_digest(row.qr_text_hash),
+                'lot_number': row.lot_number,
+                'upload_session_id': row.upload_session_id
+            }
+            for row in rows
+        ])
+
+
+def get_identifier_store(db: Session) -> IdentifierStore:
+    """Return the identifier store for the configured partitioning mode"""
+    if is_sharded():
+        return ShardedIdentifierStore(db)
+    return IdentifierStore(db)
+
+
+def create_shard_engines() -> List[Engine]:
+    """Open (and create if needed) one SQLite file per identifier shard"""
+    if not os.path.exists(settings.QR_SHARD_DIR):
+        os.makedirs(settings.QR_SHARD_DIR, exist_ok=True)
+
+    engines = []
+    for shard in range(settings.QR_PARTITIONS):
+        path = os.path.join(settings.QR_SHARD_DIR, f"qr_identifiers_{shard:03d}.db")
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        install_db_timing(engine)
+        with engine.begin() as conn:
+            conn.execute(text("PRAGMA journal_mode=WAL"))
+        shard_metadata.create_all(bind=engine)
+        engines.append(engine)
+    return engines
@@ -0,0 +1,57 @@
+import os
+import zlib
+from contextlib import ExitStack, contextmanager
+from typing import List
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.filelock import file_lock
+from app.core.timing import timed
+
+# First key of the two-int pg_advisory_lock form, keeps our locks apart from other users
+ADVISORY_LOCK_NAMESPACE = 0x51524944  # "QRID"
+
+
+def lock_buckets(records: List[dict]) -> List[int]:
+    """
+    Advisory lock buckets touched by a batch of records, sorted so that
+    every uploader acquires them in the same order (no deadlocks)
+    Both keys map into the same bucket space since a record conflicts on either
+    """
+    buckets = settings.INGEST_LOCK_BUCKETS
+    touched = set()
+    for record in records:
+        touched.add(zlib.crc32(record['qr_id'].encode()) % buckets)
+        touched.add(zlib.crc32(record['qr_text'].encode()) % buckets)
+    return sorted(touched)
+
+
+@contextmanager
+def ingest_lock(db: Session, records: List[dict]):
+    """
+    Serialize duplicate check + identifier insert for uploads touching the same QR identifiers
+    PostgreSQL: session advisory locks per bucket, held on a dedicated connection
+    SQLite: one file lock shared by all worker processes (SQLite has a single writer anyway)
+    """
+    bind = db.get_bind()
+
+    if bind.dialect.name != "postgresql":
+        with ExitStack() as stack:
+            with timed("lock_wait"):
+                stack.enter_context(file_lock(os.path.join(settings.UPLOAD_DIR, ".ingest.lock")))
+            yield
+        return
+
+    with bind.connect() as conn:
+        with timed("lock_wait"):
+            for bucket in lock_buckets(records):
+                conn.execute(
+                    text("SELECT pg_advisory_lock(:namespace, :bucket)"),
+                    {"namespace": ADVISORY_LOCK_NAMESPACE, "bucket": bucket}
+                )
+        try:
+            yield
+        finally:
+            # Session-level locks outlive transactions, release before returning to the pool
+            conn.execute(text("SELECT pg_advisory_unlock_all()"))
+            conn.commit()
@@ -0,0 +1,57 @@
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Query
+from app.models.models import Lot
+
+# Trigram indexes only help for terms of at least 3 characters
+MIN_TRIGRAM_LENGTH = 3
+
+_fts_available: Optional[bool] = None
+
+
+def _sqlite_fts_available(query: Query) -> bool:
+    global _fts_available
+
+    if _fts_available is None:
+        # Created by migration 2 unless the trigram tokenizer is unavailable
+        _fts_available = query.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lots_fts'"
+        )).first() is not None
+    return _fts_available
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """Smallest string greater than every string starting with prefix (binary collation)"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def filter_lot_number(query: Query, term: str, mode: str = "substring") -> Query:
+    """
+    Restrict a Lot query to lot numbers matching term
+    - exact: equality on the lot_number B-tree
+    - prefix: B-tree range scan (SQLite compares binary, PostgreSQL LIKE
+      uses the varchar_pattern_ops index)
+    - substring: case-insensitive, through the pg_trgm GIN index or the
+      SQLite FTS5 trigram table; shorter terms than a trigram scan the table
+    """
+    if mode == "exact":
+        return query.filter(Lot.lot_number == term)
+
+    dialect = query.session.get_bind().dialect.name
+
+    if mode == "prefix":
+        if dialect == "sqlite":
+            return query.filter(Lot.lot_number >= term, Lot.lot_number < _prefix_upper_bound(term))
+        return query.filter(Lot.lot_number.startswith(term, autoescape=True))
+
+    if dialect == "postgresql":
+        # ILIKE '%x%' is answered by the trigram index
+        return query.filter(Lot.lot_number.icontains(term, autoescape=True))
+
+    if dialect == "sqlite" and len(term) >= MIN_TRIGRAM_LENGTH and _sqlite_fts_available(query):
+        phrase = '"' + term.replace('"', '""') + '"'
+        return query.filter(Lot.id.in_(
+            text("SELECT rowid FROM lots_fts WHERE lots_fts MATCH :phrase").bindparams(phrase=phrase)
+        ))
+
+    return query.filter(Lot.lot_number.icontains(term, autoescape=True))
@@ -0,0 +1,167 @@
+import os
+from datetime import datetime, timezone
+from typing import BinaryIO, List, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.models.database import SessionLocal
+from app.models.models import Lot, LotSegment, LotSource, UploadSession
+from app.services.csv_generator import CSVGenerator, open_lot_file
+from app.services import sidecar
+
+logger = get_logger(__name__)
+
+# Append mode
+# A lot's content is its file_path (with the CSV header) followed by the
+# headerless segment files appended by later uploads, in id order.
+# Compaction merges them back into a single file.
+
+
+def find_append_target(db: Session, token_id: int, lot_number: str) -> Optional[Lot]:
+    """Most recent lot with this lot_number uploaded by the same token, archived lots excluded"""
+    return db.query(Lot).join(UploadSession, Lot.upload_session_id == UploadSession.id).filter(
+        Lot.lot_number == lot_number,
+        UploadSession.token_id == token_id,
+        Lot.archived_at.is_(None)
+    ).order_by(Lot.id.desc()).first()
+
+
+def append_segment(db: Session, lot_id: int, upload_session_id: int, file_path: str, record_count: int,
+                   sidecar_path: Optional[str] = None):
+    """
+    Attach a segment file to a lot and bump its record count
+    The count is incremented in SQL so concurrent appends don't lose updates
+    The session is recorded as a LotSource, which compaction keeps
+    Not committed
+    """
+    db.add(LotSegment(
+        lot_id=lot_id,
+        upload_session_id=upload_session_id,
+        record_count=record_count,
+        file_path=file_path,
+        sidecar_path=sidecar_path
+    ))
+    db.add(LotSource(lot_id=lot_id, upload_session_id=upload_session_id))
+    db.query(Lot).filter(Lot.id == lot_id).update({
+        Lot.record_count: Lot.record_count + record_count,
+        Lot.updated_at: datetime.now(timezone.utc)
+    }, synchronize_session=False)
+
+
+def needs_compaction(db: Session, lot_id: int) -> bool:
+    segment_count = db.query(func.count(LotSegment.id)).filter(LotSegment.lot_id == lot_id).scalar()
+    return segment_count >= settings.LOT_COMPACT_SEGMENTS
+
+
+def lot_file_paths(db: Session, lot: Lot) -> List[str]:
+    """Files making up a lot, in download order"""
+    segments = db.query(LotSegment.file_path).filter(LotSegment.lot_id == lot.id).order_by(LotSegment.id).all()
+    return [str(lot.file_path)] + [segment.file_path for segment in segments]
+
+
+def lot_sidecar_paths(db: Session, lot: Lot) -> List[str]:
+    """Sidecars of a lot and its segments"""
+    segments = db.query(LotSegment.sidecar_path).filter(LotSegment.lot_id == lot.id).all()
+    paths = [lot.sidecar_path] + [segment.sidecar_path for segment in segments]
+    return [path for path in paths if path]
+
+
+def open_lot_files(db: Session, lot: Lot) -> Optional[List[BinaryIO]]:
+    """
+    Open every file of a lot for a download, None if the lot file is missing
+    An archived lot file is read decompressed
+    Open files stay readable when a concurrent compaction unlinks them, if the
+    compaction wins between reading the paths and opening, the paths are read again
+    """
+    for attempt in range(2):
+        files = []
+        try:
+            for path in lot_file_paths(db, lot):
+                files.append(open_lot_file(path))
+            return files
+        except FileNotFoundError:
+            for f in files:
+                f.close()
+            if attempt:
+                return None
+            db.refresh(lot)
+    return None
+
+
+def remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.exception("Error deleting lot file", extra={"file_path": path})
+
+
+def merge_lot_sidecars(lot: Lot, segments: List[LotSegment], merged_path: str) -> Optional[str]:
+    """
+    Sidecar for a lot file merged from the lot and its segments, None when
+    a part has no sidecar (reports then read the merged CSV)
+    """
+    sidecar_paths = [lot.sidecar_path] + [segment.sidecar_path for segment in segments]
+    if not all(sidecar_paths) or not sidecar.sidecar_enabled():
+        return None
+    try:
+        return sidecar.merge_sidecars(sidecar_paths, merged_path)
+    except Exception:
+        logger.exception("Error merging lot sidecars", extra={"lot_id": lot.id})
+        return None
+
+
+def compact_lot(lot_id: int):
+    """
+    Merge a lot's segments into a new lot file
+    Runs as a background task with its own session. The switch to the merged
+    file only succeeds if the lot file is still the one that was merged, so
+    concurrent compactions (other workers) can't both apply. Segments appended
+    meanwhile are not part of the merge and stay attached.
+    """
+    db = SessionLocal()
+    try:
+        lot = db.query(Lot).filter(Lot.id == lot_id).first()
+        if lot is None or lot.archived_at is not None:
+            return
+
+        segments = db.query(LotSegment).filter(LotSegment.lot_id == lot_id).order_by(LotSegment.id).all()
+        if len(segments) < settings.LOT_COMPACT_SEGMENTS:
+            return
+
+        old_path = str(lot.file_path)
+        segment_paths = [segment.file_path for segment in segments]
+        try:
+            merged_path = CSVGenerator().merge_lot_files(lot_id, old_path, segment_paths)
+        except FileNotFoundError:
+            # Compacted or deleted by someone else meanwhile
+            return
+
+        old_sidecars = [lot.sidecar_path] + [segment.sidecar_path for segment in segments]
+        merged_sidecar = merge_lot_sidecars(lot, segments, merged_path)
+
+        won = db.query(Lot).filter(
+            Lot.id == lot_id,
+            Lot.file_path == old_path
+        ).update({Lot.file_path: merged_path, Lot.sidecar_path: merged_sidecar}, synchronize_session=False)
+
+        if not won:
+            db.rollback()
+            remove_files([path for path in (merged_path, merged_sidecar) if path])
+            return
+
+        db.query(LotSegment).filter(
+            LotSegment.id.in_([segment.id for segment in segments])
+        ).delete(synchronize_session=False)
+        db.commit()
+
+        remove_files([old_path] + segment_paths + [path for path in old_sidecars if path])
+        logger.info("Compacted lot", extra={"lot_id": lot_id, "segments": len(segments)})
+    except Exception:
+        db.rollback()
+        logger.exception("Lot compaction failed", extra={"lot_id": lot_id})
+    finally:
+        db.close()
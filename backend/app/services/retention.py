@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.response_cache import bump_generation
+from app.models.models import Lot, LotSegment, UploadSession
+from app.services.cleanup import expire_upload_sessions
+from app.services.csv_generator import CSVGenerator
+from app.services.duplicate_report import DuplicateReport
+from app.services.identifier_store import ColdIdentifierStore, get_identifier_store
+from app.services.lot_segments import merge_lot_sidecars, remove_files
+
+logger = get_logger(__name__)
+
+
+class RetentionEngine:
+    """
+    Age based retention, run periodically (e.g. from cron):
+        python -m app.services.retention
+
+    - Lots without uploads for RETENTION_ARCHIVE_LOTS_DAYS are rewritten, with
+      their appended segments, into one gzip archive that download_lot serves
+    - Identifiers older than RETENTION_COLD_IDENTIFIERS_DAYS move from the hot
+      store to qr_identifiers_cold, which dedupe checks only after the hot tier
+    - Chunked sessions left open for UPLOAD_SESSION_TTL_HOURS without a chunk
+      are aborted, releasing the identifiers their chunks reserved
+    - Full duplicate lists of uploads older than RETENTION_DUPLICATE_REPORTS_DAYS
+      are deleted (upload responses still carry the first 100)
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.csv_generator = CSVGenerator()
+
+    def archive_lot(self, lot: Lot) -> bool:
+        """
+        Replace a lot's files with a gzip archive
+        Same conditional switch as compaction, so a lot compacted or archived
+        concurrently is left alone
+        """
+        segments = self.db.query(LotSegment).filter(LotSegment.lot_id == lot.id).order_by(LotSegment.id).all()
+        old_path = str(lot.file_path)
+        old_files = [old_path] + [segment.file_path for segment in segments]
+
+        try:
+            archive_path = self.csv_generator.archive_lot_files(lot.id, old_files)
+        except FileNotFoundError:
+            logger.warning("Lot file missing, not archived", extra={"lot_id": lot.id, "file_path": old_path})
+            return False
+
+        old_sidecars = [lot.sidecar_path] + [segment.sidecar_path for segment in segments]
+        archive_sidecar = merge_lot_sidecars(lot, segments, archive_path) if segments else lot.sidecar_path
+
+        won = self.db.query(Lot).filter(
+            Lot.id == lot.id,
+            Lot.file_path == old_path,
+            Lot.archived_at.is_(None)
+        ).update({
+            Lot.file_path: archive_path,
+            Lot.sidecar_path: archive_sidecar,
+            Lot.archived_at: datetime.now(timezone.utc)
+        }, synchronize_session=False)
+
+        if not won:
+            self.db.rollback()
+            new_files = [archive_path] + ([archive_sidecar] if archive_sidecar != lot.sidecar_path else [])
+            remove_files([path for path in new_files if path])
+            return False
+
+        self.db.query(LotSegment).filter(
+            LotSegment.id.in_([segment.id for segment in segments])
+        ).delete(synchronize_session=False)
+        self.db.commit()
+        bump_generation()
+
+        stale_sidecars = [path for path in old_sidecars if path and path != archive_sidecar]
+        remove_files(old_files + stale_sidecars)
+        return True
+
+    def archive_lots(self, older_than: datetime, limit: Optional[int] = None) -> int:
+        """Archive lots whose last upload is older than the cutoff, returns the number archived"""
+        limit = limit or settings.RETENTION_BATCH_SIZE
+        archived = 0
+        last_id = 0
+
+        while True:
+            lots = self.db.query(Lot).filter(
+                Lot.id > last_id,
+                Lot.archived_at.is_(None),
+                func.coalesce(Lot.updated_at, Lot.uploaded_at) < older_than
+            ).order_by(Lot.id).limit(limit).all()
+            if not lots:
+                break
+            last_id = lots[-1].id
+
+            for lot in lots:
+                if self.archive_lot(lot):
+                    archived += 1
+
+        return archived
+
+    def cool_identifiers(self, older_than: datetime, batch_size: Optional[int] = None) -> int:
+        """
+        Move identifiers created before the cutoff to the cold tier, in batches
+        Rows are committed to the cold tier before they leave the hot one; an
+        interruption in between only leaves them in both tiers, never in neither
+        """
+        batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+        hot = get_identifier_store(self.db)
+        cold = ColdIdentifierStore(self.db)
+        moved = 0
+
+        while True:
+            rows = hot.created_before(older_than, batch_size)
+            if not rows:
+                break
+
+            cold.insert(rows)
+            self.db.commit()
+            hot.delete(rows)
+            moved += len(rows)
+
+        return moved
+
+    def expire_duplicate_reports(self, older_than: datetime, limit: Optional[int] = None) -> int:
+        """Delete the duplicate reports of sessions uploaded before the cutoff, returns the number deleted"""
+        limit = limit or settings.RETENTION_BATCH_SIZE
+        expired = 0
+
+        while True:
+            session_ids = [row.id for row in self.db.query(UploadSession.id).filter(
+                UploadSession.duplicates_path.isnot(None),
+                UploadSession.uploaded_at < older_than
+            ).order_by(UploadSession.id).limit(limit)]
+            if not session_ids:
+                break
+
+            # Cleared first: a crash in between leaves a directory, never a path to a deleted one
+            self.db.query(UploadSession).filter(UploadSession.id.in_(session_ids)).update(
+                {UploadSession.duplicates_path: None}, synchronize_session=False
+            )
+            self.db.commit()
+            for session_id in session_ids:
+                DuplicateReport(session_id).remove()
+            expired += len(session_ids)
+
+        return expired
+
+    def run(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Apply every configured policy"""
+        now = now or datetime.now(timezone.utc)
+        result = {"lots_archived": 0, "identifiers_moved": 0, "upload_sessions_expired": 0, "duplicate_reports_deleted": 0}
+
+        if settings.RETENTION_ARCHIVE_LOTS_DAYS > 0:
+            cutoff = now - timedelta(days=settings.RETENTION_ARCHIVE_LOTS_DAYS)
+            result["lots_archived"] = self.archive_lots(cutoff)
+
+        if settings.RETENTION_COLD_IDENTIFIERS_DAYS > 0:
+            cutoff = now - timedelta(days=settings.RETENTION_COLD_IDENTIFIERS_DAYS)
+            result["identifiers_moved"] = self.cool_identifiers(cutoff)
+
+        if settings.UPLOAD_SESSION_TTL_HOURS > 0:
+            cutoff = now - timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS)
+            result["upload_sessions_expired"] = expire_upload_sessions(self.db, cutoff)
+
+        if settings.RETENTION_DUPLICATE_REPORTS_DAYS > 0:
+            cutoff = now - timedelta(days=settings.RETENTION_DUPLICATE_REPORTS_DAYS)
+            result["duplicate_reports_deleted"] = self.expire_duplicate_reports(cutoff)
+
+        logger.info("Retention run completed", extra=result)
+        return result
+
+
+if __name__ == "__main__":
+    # python -m app.services.retention
+    from app.models.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        print(RetentionEngine(db).run())
+    finally:
+        db.close()
@@ -0,0 +1,173 @@
+import csv
+import io
+import os
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy.orm import Query
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.models.models import Lot, LotSegment
+from app.core.optional import optional_import
+from app.services.csv_generator import HEADERS, open_lot_file
+
+logger = get_logger(__name__)
+
+# Columnar copy of a lot CSV (or segment) for reporting, written next to it
+# qr_text is left out: reports never read it and it dominates the size
+SIDECAR_EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow"}
+DATASET_FORMATS = {".parquet": "parquet", ".arrow": "ipc"}
+
+# Sidecar column read for each aggregation
+GROUP_COLUMNS = {"print_format": "print_format", "lot_number": "lot_number", "day": "uploaded_at"}
+
+
+def _pyarrow():
+    """pyarrow, None when it isn't installed: sidecars are not written and reports scan the CSVs"""
+    return optional_import("pyarrow")
+
+
+def sidecar_enabled() -> bool:
+    return settings.LOT_SIDECAR_FORMAT in SIDECAR_EXTENSIONS and _pyarrow() is not None
+
+
+def _schema():
+    pa = _pyarrow()
+    return pa.schema([
+        ("qr_id", pa.string()),
+        ("lot_number", pa.dictionary(pa.int32(), pa.string())),
+        ("print_format", pa.dictionary(pa.int32(), pa.string())),
+        ("uploaded_at", pa.timestamp("us", tz="UTC")),
+    ])
+
+
+def _write_table(table, path: str):
+    pa = _pyarrow()
+    tmp_path = path + ".tmp"
+    if path.endswith(".parquet"):
+        optional_import("pyarrow.parquet").write_table(table, tmp_path, use_dictionary=["lot_number", "print_format"])
+    else:
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def write_sidecar(csv_path: str, records: Iterable[dict]) -> str:
+    """Write the sidecar of a CSV file from its records, returns the sidecar path"""
+    pa = _pyarrow()
+    path = os.path.splitext(csv_path)[0] + SIDECAR_EXTENSIONS[settings.LOT_SIDECAR_FORMAT]
+    qr_ids, lot_numbers, print_formats = [], [], []
+    for record in records:
+        qr_ids.append(record['qr_id'])
+        lot_numbers.append(record['lot_number'])
+        print_formats.append(record['print_format'])
+
+    uploaded_at = datetime.now(timezone.utc)
+    table = pa.table([
+        pa.array(qr_ids, type=pa.string()),
+        pa.array(lot_numbers, type=pa.string()).dictionary_encode(),
+        pa.array(print_formats, type=pa.string()).dictionary_encode(),
+        pa.array([uploaded_at] * len(qr_ids), type=pa.timestamp("us", tz="UTC")),
+    ], schema=_schema())
+    _write_table(table, path)
+    return path
+
+
+def read_csv_records(csv_path: str, header: bool = True) -> Iterable[dict]:
+    """Records of a lot CSV (header=True) or of a headerless segment"""
+    with io.TextIOWrapper(open_lot_file(csv_path), encoding='utf-8', newline='') as csvfile:
+        yield from csv.DictReader(csvfile, fieldnames=None if header else HEADERS)
+
+
+def merge_sidecars(sidecar_paths: List[str], csv_path: str) -> str:
+    """Concatenate sidecars into the sidecar of a merged CSV, returns its path"""
+    base_path = csv_path[:-len('.gz')] if csv_path.endswith('.gz') else csv_path
+    path = os.path.splitext(base_path)[0] + os.path.splitext(sidecar_paths[0])[1]
+    tables = [_read_table(sidecar_path, None) for sidecar_path in sidecar_paths]
+    _write_table(_pyarrow().concat_tables(tables).unify_dictionaries(), path)
+    return path
+
+
+def _read_table(path: str, columns: Optional[List[str]]):
+    pa = _pyarrow()
+    if path.endswith(".parquet"):
+        return optional_import("pyarrow.parquet").read_table(path, columns=columns)
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.select(columns) if columns else table
+
+
+def count_sidecars(sidecar_paths: List[str], group_by: str) -> Counter:
+    """Record counts per group, reading only the grouped column"""
+    pa = _pyarrow()
+    pc = optional_import("pyarrow.compute")
+    ds = optional_import("pyarrow.dataset")
+    counts = Counter()
+    column = GROUP_COLUMNS[group_by]
+
+    for extension, dataset_format in DATASET_FORMATS.items():
+        paths = [path for path in sidecar_paths if path.endswith(extension)]
+        if not paths:
+            continue
+
+        table = ds.dataset(paths, format=dataset_format).to_table(columns=[column])
+        keys = table[column]
+        if group_by == "day":
+            keys = pc.cast(keys, pa.date32())
+        else:
+            keys = keys.cast(pa.string())
+        grouped = pa.table({"key": keys}).group_by("key").aggregate([([], "count_all")])
+        for key, count in zip(grouped["key"].to_pylist(), grouped["count_all"].to_pylist()):
+            counts[key.isoformat() if group_by == "day" else key] += count
+
+    return counts
+
+
+def count_csv(csv_path: str, header: bool, group_by: str, uploaded_at: Optional[datetime]) -> Counter:
+    """Same counts from a CSV file without a sidecar (full parse)"""
+    counts = Counter()
+    if group_by == "day":
+        day = uploaded_at.date().isoformat() if uploaded_at else None
+        counts[day] = sum(1 for _ in read_csv_records(csv_path, header))
+        return counts
+
+    for record in read_csv_records(csv_path, header):
+        counts[record[group_by]] += 1
+    return counts
+
+
+def aggregate_lots(query: Query, group_by: str, page_size: int = 500) -> Dict:
+    """
+    Record counts per print_format, lot_number or upload day over the lots of a query
+    Files with a sidecar are read column-wise, the others fall back to parsing the CSV
+    Returns: {counts, lots, csv_files}
+    """
+    counts = Counter()
+    lot_count = 0
+    csv_files = 0
+    last_id = 0
+
+    while True:
+        lots = query.filter(Lot.id > last_id).order_by(Lot.id).limit(page_size).all()
+        if not lots:
+            break
+        last_id = lots[-1].id
+        lot_count += len(lots)
+
+        segments = query.session.query(LotSegment).filter(
+            LotSegment.lot_id.in_([lot.id for lot in lots])
+        ).all()
+        parts = [(lot.sidecar_path, lot.file_path, True, lot.uploaded_at) for lot in lots]
+        parts += [(segment.sidecar_path, segment.file_path, False, segment.created_at) for segment in segments]
+
+        sidecar_paths = []
+        for sidecar_path, file_path, header, uploaded_at in parts:
+            if sidecar_path and os.path.exists(sidecar_path) and _pyarrow() is not None:
+                sidecar_paths.append(sidecar_path)
+            elif os.path.exists(file_path):
+                counts.update(count_csv(file_path, header, group_by, uploaded_at))
+                csv_files += 1
+
+        if sidecar_paths:
+            counts.update(count_sidecars(sidecar_paths, group_by))
+
+    return {"counts": counts, "lots": lot_count, "csv_files": csv_files}
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.models.database import SessionLocal
+from app.models.models import APIToken, TokenUsageHourly
+
+logger = get_logger(__name__)
+
+
+class TokenUsageRecorder:
+    """
+    Buffers API token usage_count / last_used_at in memory and writes them
+    every TOKEN_USAGE_FLUSH_SECONDS from a background thread, so validating
+    a token never writes to the database
+    Counts buffered when a process is killed are lost; flush() runs at shutdown
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending: Dict[int, Tuple[int, datetime]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def _ensure_started(self):
+        # Started in the process that records: a thread doesn't survive fork
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="token-usage", daemon=True)
+        self._thread.start()
+
+    def record(self, token_id: int):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            count, _ = self._pending.get(token_id, (0, now))
+            self._pending[token_id] = (count + 1, now)
+            self._ensure_started()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        db = SessionLocal()
+        try:
+            for token_id, (count, last_used_at) in pending.items():
+                db.execute(
+                    update(APIToken)
+                    .where(APIToken.id == token_id)
+                    .values(usage_count=APIToken.usage_count + count, last_used_at=last_used_at)
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("Token usage flush failed", extra={"tokens": len(pending)})
+            self._requeue(pending)
+        finally:
+            db.close()
+
+    def _requeue(self, pending: Dict[int, Tuple[int, datetime]]):
+        with self._lock:
+            for token_id, (count, last_used_at) in pending.items():
+                newer_count, newer_used_at = self._pending.get(token_id, (0, last_used_at))
+                self._pending[token_id] = (count + newer_count, max(last_used_at, newer_used_at))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+_recorder: Optional[TokenUsageRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def get_usage_recorder() -> TokenUsageRecorder:
+    global _recorder
+
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = TokenUsageRecorder(settings.TOKEN_USAGE_FLUSH_SECONDS)
+    return _recorder
+
+
+ROLLUP_COLUMNS = ("uploads", "total_records", "valid_records", "duplicate_records", "bytes")
+
+
+def as_utc(moment: datetime) -> datetime:
+    """moment in UTC, naive values are taken as UTC"""
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def hour_bucket(moment: datetime) -> datetime:
+    """Start of the UTC hour containing moment"""
+    return as_utc(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def record_upload_usage(db: Session, token_id: int, uploads: int = 0, total_records: int = 0,
+                        valid_records: int = 0, duplicate_records: int = 0, body_bytes: int = 0):
+    """
+    Add to the token's rollup for the current hour with one upsert statement
+    Runs in the caller's transaction, so it commits (or rolls back) with the upload
+    """
+    values = {
+        "uploads": uploads,
+        "total_records": total_records,
+        "valid_records": valid_records,
+        "duplicate_records": duplicate_records,
+        "bytes": body_bytes,
+    }
+    bucket_start = hour_bucket(datetime.now(timezone.utc))
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(TokenUsageHourly).values(token_id=token_id, bucket_start=bucket_start, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[TokenUsageHourly.token_id, TokenUsageHourly.bucket_start],
+            set_={column: getattr(TokenUsageHourly, column) + stmt.excluded[column] for column in ROLLUP_COLUMNS}
+        )
+        db.execute(stmt)
+        return
+
+    updated = db.query(TokenUsageHourly).filter(
+        TokenUsageHourly.token_id == token_id,
+        TokenUsageHourly.bucket_start == bucket_start
+    ).update({
+        getattr(TokenUsageHourly, column): getattr(TokenUsageHourly, column) + value
+        for column, value in values.items()
+    }, synchronize_session=False)
+    if not updated:
+        db.add(TokenUsageHourly(token_id=token_id, bucket_start=bucket_start, **values))
@@ -1,13 +1,23 @@
 import hashlib
-from typing import List, Dict, Set, Tuple
+from typing import Iterator, List, Dict, Set, Tuple
 from sqlalchemy.orm import Session
-from app.models.models import QRIdentifier
+from app.services.identifier_store import get_identifier_store, ColdIdentifierStore
+from app.services.digest_index import get_digest_index
+from app.core.timing import timed
+from app.core.progress import NULL_PUBLISHER
+
+# Records hashed between records_hashed progress events
+HASH_PROGRESS_EVERY = 10000
 
 class DataValidator:
     """Service for validating and checking duplicates in uploaded data"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, progress=NULL_PUBLISHER):
         self.db = db
+        self.progress = progress
+        self.store = get_identifier_store(db)
+        self.cold_store = ColdIdentifierStore(db)
+        self.index = get_digest_index()
     
     @staticmethod
     def hash_qr_text(qr_text: str) -> str:
@@ -24,22 +34,31 @@ class DataValidator:
         valid_records = []
         duplicates = []
         
-        for record in records:
-            qr_id = record['qr_id']
-            qr_text_hash = self.hash_qr_text(record['qr_text'])
+        # Progress is published between slices, the per-record loop stays untouched
+        for start in range(0, len(records), HASH_PROGRESS_EVERY):
+            for record in records[start:start + HASH_PROGRESS_EVERY]:
+                qr_id = record['qr_id']
+                qr_text_hash = self.hash_qr_text(record['qr_text'])
+                
+                # Check if QR ID or QR text already seen in this batch
+                if qr_id in seen_qr_ids or qr_text_hash in seen_qr_text_hashes:
+                    duplicates.append({
+                        'qr_id': qr_id,
+                        'lot_number': record['lot_number'],
+                        'reason': 'duplicate_in_upload'
+                    })
+                else:
+                    seen_qr_ids.add(qr_id)
+                    seen_qr_text_hashes.add(qr_text_hash)
+                    record['qr_text_hash'] = qr_text_hash
+                    valid_records.append(record)
             
-            # Check if QR ID or QR text already seen in this batch
-            if qr_id in seen_qr_ids or qr_text_hash in seen_qr_text_hashes:
-                duplicates.append({
-                    'qr_id': qr_id,
-                    'lot_number': record['lot_number'],
-                    'reason': 'duplicate_in_upload'
-                })
-            else:
-                seen_qr_ids.add(qr_id)
-                seen_qr_text_hashes.add(qr_text_hash)
-                record['qr_text_hash'] = qr_text_hash
-                valid_records.append(record)
+            self.progress.publish(
+                "records_hashed",
+                done=min(start + HASH_PROGRESS_EVERY, len(records)),
+                total=len(records),
+                duplicates=len(duplicates)
+            )
         
         return valid_records, duplicates
     
@@ -47,11 +66,20 @@ class DataValidator:
         """
         Check for duplicates against existing database records
         Uses batch processing for efficiency with large datasets
+        When the digest index is enabled, only records it reports as
+        possibly stored (in either tier) are looked up in the database
         Returns: (valid_records, duplicate_records)
         """
         valid_records = []
         duplicates = []
         
+        if self.index is not None:
+            with timed("index"):
+                self.index.sync(self.store, self.cold_store)
+            check_cold = True
+        else:
+            check_cold = self.cold_store.has_rows()
+        
         # Process in batches to avoid memory issues
         for i in range(0, len(records), batch_size):
             batch = records[i:i + batch_size]
@@ -60,19 +88,34 @@ class DataValidator:
             qr_ids = [r['qr_id'] for r in batch]
             qr_text_hashes = [r['qr_text_hash'] for r in batch]
             
-            # Query database for existing records
-            existing = self.db.query(
-                QRIdentifier.qr_id,
-                QRIdentifier.qr_text_hash
-            ).filter(
-                (QRIdentifier.qr_id.in_(qr_ids)) |
-                (QRIdentifier.qr_text_hash.in_(qr_text_hashes))
-            ).all()
+            candidates = batch
+            if self.index is not None:
+                with timed("index"):
+                    maybe_stored = self.index.contains(qr_ids, qr_text_hashes)
+                candidates = [r for r, maybe in zip(batch, maybe_stored) if maybe]
+                qr_ids = [r['qr_id'] for r in candidates]
+                qr_text_hashes = [r['qr_text_hash'] for r in candidates]
+            
+            # Query existing records, routed to the partitions holding them
+            existing = self.store.find_existing(qr_ids, qr_text_hashes)
             
             # Create sets for faster lookup
             existing_qr_ids = {e.qr_id for e in existing}
             existing_qr_text_hashes = {e.qr_text_hash for e in existing}
             
+            # Candidates not in the hot tier are checked against the cold tier
+            remaining = [
+                r for r in candidates
+                if r['qr_id'] not in existing_qr_ids and r['qr_text_hash'] not in existing_qr_text_hashes
+            ]
+            if remaining and check_cold:
+                cold = self.cold_store.find_existing(
+                    [r['qr_id'] for r in remaining],
+                    [r['qr_text_hash'] for r in remaining]
+                )
+                existing_qr_ids.update(e.qr_id for e in cold)
+                existing_qr_text_hashes.update(e.qr_text_hash for e in cold)
+            
             # Check each record in batch
             for record in batch:
                 if (record['qr_id'] in existing_qr_ids or 
@@ -84,6 +127,13 @@ class DataValidator:
                     })
                 else:
                     valid_records.append(record)
+            
+            self.progress.publish(
+                "batch_checked",
+                done=i + len(batch),
+                total=len(records),
+                duplicates=len(duplicates)
+            )
         
         return valid_records, duplicates
     
@@ -111,31 +161,82 @@ class DataValidator:
             'duplicate_count': len(all_duplicates)
         }
     
-    def save_identifiers(self, records: List[dict], upload_session_id: int, batch_size: int = 5000):
+    def save_identifiers(self, records: List[dict], upload_session_id: int, batch_size: int = 5000, commit: bool = True):
         """
         Save QR identifiers to database for future duplicate checking
-        Uses batch inserts for efficiency
+        Uses batch inserts for efficiency, each batch routed to its partitions
+        With commit=False the caller commits them in its own transaction
         """
         identifiers = []
+        saved = 0
         
         for record in records:
-            identifiers.append(QRIdentifier(
-                qr_id=record['qr_id'],
-                qr_text_hash=record['qr_text_hash'],
-                lot_number=record['lot_number'],
-                upload_session_id=upload_session_id
-            ))
+            identifiers.append({
+                'qr_id': record['qr_id'],
+                'qr_text_hash': record['qr_text_hash'],
+                'lot_number': record['lot_number'],
+                'upload_session_id': upload_session_id
+            })
             
             # Batch insert when reaching batch_size
             if len(identifiers) >= batch_size:
-                self.db.bulk_save_objects(identifiers)
-                self.db.commit()
+                self.store.insert(identifiers, commit=commit)
+                saved += len(identifiers)
+                self.progress.publish("identifiers_saved", done=saved, total=len(records))
                 identifiers = []
         
         # Insert remaining records
         if identifiers:
-            self.db.bulk_save_objects(identifiers)
-            self.db.commit()
+            self.store.insert(identifiers, commit=commit)
+            saved += len(identifiers)
+            self.progress.publish("identifiers_saved", done=saved, total=len(records))
+    
+    def discard_unsaved_identifiers(self):
+        """
+        Undo save_identifiers(commit=False) after the caller rolled back
+        Needed for shard files, which commit their inserts on their own
+        """
+        self.store.discard_uncommitted()
+    
+    def _find_in_tiers(self, kind: str, keys: Set[str]) -> Dict[str, object]:
+        """Stored identifiers by qr_id or qr_text_hash, hot tier first, then the cold tier for the rest"""
+        found = {}
+        for store in (self.store, self.cold_store):
+            missing = [key for key in keys if key not in found]
+            if not missing:
+                break
+            if kind == 'qr_id':
+                found.update((e.qr_id, e) for e in store.find_existing(missing, []))
+            else:
+                found.update((e.qr_text_hash, e) for e in store.find_existing([], missing))
+        return found
+    
+    def lookup_identifiers(self, qr_ids: List[str], qr_texts: List[str], batch_size: int = 1000) -> Iterator[dict]:
+        """
+        Registration status of QR IDs and QR texts, one result per input in order
+        (IDs first), looked up in batches through the qr_id / qr_text_hash indexes
+        Yields: {kind, value, status, qr_id, lot_number, upload_session_id}
+        """
+        for kind, values in (('qr_id', qr_ids), ('qr_text', qr_texts)):
+            for i in range(0, len(values), batch_size):
+                batch = values[i:i + batch_size]
+                
+                if kind == 'qr_id':
+                    keys = batch
+                else:
+                    keys = [self.hash_qr_text(qr_text) for qr_text in batch]
+                found = self._find_in_tiers(kind, set(keys))
+                
+                for value, key in zip(batch, keys):
+                    match = found.get(key)
+                    yield {
+                        'kind': kind,
+                        'value': value,
+                        'status': 'registered' if match else 'not_registered',
+                        'qr_id': match.qr_id if match else None,
+                        'lot_number': match.lot_number if match else None,
+                        'upload_session_id': match.upload_session_id if match else None
+                    }
     
     def group_by_lot(self, records: List[dict]) -> Dict[str, List[dict]]:
         """Group records by lot_number for CSV generation"""
@@ -0,0 +1,111 @@
+"""
+Measure cold-start time of the API
+
+    python benchmark_startup.py                 5 runs of each measurement
+    python benchmark_startup.py --runs 10 --importtime
+
+Each run uses a fresh interpreter:
+- import: time to import main (what every worker and reload pays)
+- first response: uvicorn start until GET /health answers, including the
+  startup schema version check
+Run python migrate.py first, startup fails on a database that is behind
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure API cold-start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="Also list the slowest imports (python -X importtime)")
+    parser.add_argument("--top", type=int, default=15, help="Imports listed with --importtime")
+    return parser.parse_args()
+
+
+def worker_env():
+    # Measure what a production worker does: check the version, never migrate
+    return dict(os.environ, INIT_DB_ON_STARTUP="false")
+
+
+def measure_import() -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=BACKEND_DIR, env=worker_env(), capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_first_response(timeout: float = 30.0) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=worker_env(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited during startup:\n{server.stderr.read().decode()}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1):
+                    return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        raise RuntimeError("Server did not answer within the timeout")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def slowest_imports(top: int):
+    """(cumulative seconds, module) of the slowest imports of main"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=worker_env(), capture_output=True, text=True, check=True
+    )
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line.split("|")
+        if cumulative.strip().isdigit():
+            timings.append((int(cumulative) / 1e6, module.strip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def report(name: str, samples):
+    print(f"{name:>16}: min {min(samples) * 1000:7.1f} ms   median {statistics.median(samples) * 1000:7.1f} ms")
+
+
+def main():
+    args = parse_args()
+
+    report("import", [measure_import() for _ in range(args.runs)])
+    report("first response", [measure_first_response() for _ in range(args.runs)])
+
+    if args.importtime:
+        print("\nSlowest imports (cumulative):")
+        for seconds, module in slowest_imports(args.top):
+            print(f"  {seconds * 1000:7.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,50 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
-from app.models.database import init_db
-from app.api import auth, tokens, upload, lots
+from app.core.timing import ServerTimingMiddleware
+from app.core.logger import setup_logging, RequestIdMiddleware
+from app.core.compression import UploadBodyMiddleware
+from app.core.admission import UploadAdmissionMiddleware
+from app.core.lanes import configure_default_limiter
+from app.core.rate_limit import RateLimitHeadersMiddleware
+from app.services.token_usage import get_usage_recorder
+from app.services.cleanup import get_cleanup_worker
+from app.models.migrations import check_schema
+from app.api import auth, tokens, upload, lots, qr, metrics
 
-# Initialize database tables
-init_db()
+# Configure structured logging
+setup_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One query comparing schema versions; migrations run from migrate.py,
+    # or here in development (INIT_DB_ON_STARTUP)
+    check_schema(apply=settings.INIT_DB_ON_STARTUP)
+    configure_default_limiter()
+    # Resumes bulk delete cleanups left queued or abandoned by a stopped process
+    get_cleanup_worker().start()
+    yield
+    # Token usage buffered since the last periodic write
+    get_usage_recorder().flush()
 
 # Create FastAPI app
 app = FastAPI(
     title="Data Validation API",
     description="API for validating and managing QR data uploads",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Size limits and gzip/zstd decoding for upload bodies
+app.add_middleware(UploadBodyMiddleware, path_prefix="/api/upload")
+
+# Upload admission control: bounded in-flight bytes with per-token fair share, 429 when saturated
+app.add_middleware(UploadAdmissionMiddleware, path_prefix="/api/upload")
+
+# X-RateLimit-* headers of the per-token limits checked while handling the request
+app.add_middleware(RateLimitHeadersMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -21,13 +52,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "Server-Timing", "X-Request-ID", "Retry-After",
+        "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset",
+        "X-RateLimit-Records-Limit", "X-RateLimit-Records-Remaining", "X-RateLimit-Records-Reset",
+    ],
 )
 
+# Per-request Server-Timing breakdown and sampled profiling
+app.add_middleware(ServerTimingMiddleware)
+
+# Request id correlation for logs, outermost so every log line carries it
+app.add_middleware(RequestIdMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api")
 app.include_router(tokens.router, prefix="/api")
 app.include_router(upload.router, prefix="/api")
 app.include_router(lots.router, prefix="/api")
+app.include_router(qr.router, prefix="/api")
+app.include_router(metrics.router, prefix="/api")
 
 @app.get("/")
 def root():
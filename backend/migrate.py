@@ -0,0 +1,48 @@
+"""
+Apply database schema migrations
+
+    python migrate.py            apply pending migrations
+    python migrate.py --status   show applied and pending migrations
+    python migrate.py --check    exit with status 1 when migrations are pending
+
+Run it before starting a new version of the server in production; the
+server itself only checks that the schema version is current
+"""
+
+import argparse
+import sys
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Apply database schema migrations")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--status", action="store_true", help="Show applied and pending migrations")
+    group.add_argument("--check", action="store_true", help="Exit with status 1 when migrations are pending")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+
+    from app.core.logger import setup_logging
+    from app.models.database import engine
+    from app.models.migrations import LATEST_VERSION, current_version, migrate, pending_migrations
+
+    setup_logging()
+
+    if args.status or args.check:
+        pending = pending_migrations(engine)
+        print(f"Schema version: {current_version(engine)} (latest: {LATEST_VERSION})")
+        for migration in pending:
+            print(f"  pending {migration.version}: {migration.description}")
+        return 1 if args.check and pending else 0
+
+    applied = migrate(engine)
+    for migration in applied:
+        print(f"Applied {migration.version}: {migration.description}")
+    print(f"Schema version: {current_version(engine)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,127 @@
 """
 Simple script to run the FastAPI server
+
+Development (auto-reload, single worker):
+    python run_server.py
+
+Production (N worker processes, graceful shutdown, worker recycling):
+    python migrate.py
+    python run_server.py --prod --workers 4
 """
 
+import argparse
+import multiprocessing
+import os
+
 import uvicorn
 
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the Data Validation API server")
+    parser.add_argument("--prod", action="store_true", help="Production mode with multiple workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: SERVER_WORKERS or CPU count)")
+    return parser.parse_args()
+
+
+def prepare_workers():
+    """
+    Check the schema version once in the master process before any worker starts
+    Migrations are not applied here: long index builds belong to migrate.py, run
+    before the new version is started, and workers only repeat the version check
+    """
+    from app.models.migrations import check_schema
+
+    check_schema()
+    os.environ["INIT_DB_ON_STARTUP"] = "false"
+
+
+def run_gunicorn(host: str, port: int, workers: int):
+    """Gunicorn master with uvicorn workers: preloaded app, recycling and graceful shutdown"""
+    from gunicorn.app.base import BaseApplication
+    from app.core.config import settings
+
+    class ProductionApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+            self.cfg.set("preload_app", True)
+            self.cfg.set("max_requests", settings.SERVER_MAX_REQUESTS)
+            self.cfg.set("max_requests_jitter", settings.SERVER_MAX_REQUESTS_JITTER)
+            self.cfg.set("graceful_timeout", settings.SERVER_GRACEFUL_TIMEOUT)
+            self.cfg.set("post_fork", post_fork)
+
+        def load(self):
+            from main import app
+            return app
+
+    def post_fork(server, worker):
+        # Connections inherited from the preloading master must not be shared
+        from app.models.database import engine, read_engine
+        engine.dispose(close=False)
+        read_engine.dispose(close=False)
+
+    ProductionApplication().run()
+
+
+def run_uvicorn_workers(host: str, port: int, workers: int):
+    """
+    Uvicorn's own process manager, used where gunicorn is unavailable (e.g. Windows)
+    Workers are restarted when they exit, which recycles them after max requests,
+    but the app is imported in each worker instead of being preloaded
+    """
+    from app.core.config import settings
+
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        limit_max_requests=settings.SERVER_MAX_REQUESTS,
+        timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+    )
+
+
+def run_production(host: str, port: int, workers: int):
+    prepare_workers()
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        run_uvicorn_workers(host, port, workers)
+    else:
+        run_gunicorn(host, port, workers)
+
+
 if __name__ == "__main__":
+    args = parse_args()
+
     print("="*60)
     print("Starting Data Validation Backend Server")
     print("="*60)
     print("\n📡 Server starting...")
-    print("   API: http://localhost:8000")
-    print("   Docs: http://localhost:8000/docs")
-    print("\n🔐 Default Login:")
-    print("   Username: admin")
-    print("   Password: admin123")
-    print("\n⚠️  Press Ctrl+C to stop the server")
-    print("="*60 + "\n")
-    
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True
-    )
\ No newline at end of file
+    print(f"   API: http://localhost:{args.port}")
+    print(f"   Docs: http://localhost:{args.port}/docs")
+
+    if args.prod:
+        from app.core.config import settings
+        workers = args.workers or settings.SERVER_WORKERS or multiprocessing.cpu_count()
+        print(f"   Mode: production, {workers} workers")
+        print("="*60 + "\n")
+        run_production(args.host, args.port, workers)
+    else:
+        print("\n🔐 Default Login:")
+        print("   Username: admin")
+        print("   Password: admin123")
+        print("\n⚠️  Press Ctrl+C to stop the server")
+        print("="*60 + "\n")
+
+        uvicorn.run(
+            "main:app",
+            host=args.host,
+            port=args.port,
+            reload=True
+        )
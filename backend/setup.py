@@ -60,13 +60,14 @@ def create_admin_user():
         # Add the app directory to Python path
         sys.path.append(os.path.dirname(os.path.abspath(__file__)))
         
-        from app.models.database import SessionLocal, init_db
+        from app.models.database import SessionLocal
+        from app.models.migrations import migrate
         from app.models.models import AdminUser
         from app.core.security import get_hashed_password 
         
         # Initialize database tables
         print("Initializing database...")
-        init_db()
+        migrate()
         print("✓ Database tables created")
         
         # Create admin user
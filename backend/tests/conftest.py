@@ -0,0 +1,77 @@
+import os
+import tempfile
+
+# Settings are read when app modules are imported, point them at a scratch
+# directory before anything imports app
+_work_dir = tempfile.mkdtemp(prefix="qr-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_work_dir, 'data.db')}"
+os.environ["UPLOAD_DIR"] = os.path.join(_work_dir, "uploads")
+os.environ["QR_SHARD_DIR"] = os.path.join(_work_dir, "qr_shards")
+os.environ["RATE_LIMIT_SQLITE_PATH"] = os.path.join(_work_dir, "rate_limits.db")
+os.environ["PASSWORD_POOL_WORKERS"] = "0"
+os.environ["LOG_LEVEL"] = "WARNING"
+
+import itertools
+import time
+import pytest
+from fastapi.testclient import TestClient
+
+_record_prefixes = itertools.count()
+
+
+@pytest.fixture(scope="session")
+def client():
+    import main
+
+    with TestClient(main.app, raise_server_exceptions=False) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def admin_headers(client):
+    credentials = {"username": "admin", "password": "test-password"}
+    client.post("/api/auth/init-admin", json=credentials)
+    response = client.post("/api/auth/login", json=credentials)
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def bulk_delete(client, admin_headers):
+    """Bulk delete one lot with the identifier cascade, returns the finished cleanup job"""
+    def run(lot_id):
+        response = client.post(
+            "/api/lots/bulk-delete",
+            json={"lot_ids": [lot_id], "cascade_identifiers": True},
+            headers=admin_headers
+        )
+        assert response.status_code == 200
+        job_id = response.json()["cleanup_job_id"]
+
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            job = client.get(f"/api/lots/bulk-delete/{job_id}", headers=admin_headers).json()
+            if job["status"] not in ("queued", "running"):
+                return job
+            time.sleep(0.05)
+        raise AssertionError("cleanup job did not finish")
+    return run
+
+
+@pytest.fixture
+def token(client):
+    response = client.post("/api/tokens/generate", json={"name": "tests", "validation_string": "lotdata"})
+    assert response.status_code == 200
+    return response.json()["token"]
+
+
+@pytest.fixture
+def make_records():
+    """Records with QR ids and texts no other test uses"""
+    def make(count, lot_number="L1"):
+        prefix = next(_record_prefixes)
+        return [
+            {"qr_id": f"Q{prefix}_{i}", "qr_text": f"text {prefix} {i}", "lot_number": lot_number, "print_format": "F"}
+            for i in range(count)
+        ]
+    return make
@@ -0,0 +1,66 @@
+import anyio
+from app.core import admission
+from app.core.admission import (
+    AdmissionController, UNVERIFIED_KEY, UploadAdmissionMiddleware, admission_key, estimate_body_size
+)
+from app.core.config import settings
+
+
+def test_full_queue_without_waiters_rejects():
+    # ADMISSION_MAX_QUEUED=0: reject instead of queueing
+    controller = AdmissionController(100, 0, 0.1)
+
+    async def run():
+        assert await controller.acquire("a", 80)
+        assert not await controller.acquire("b", 80)
+
+    anyio.run(run)
+    assert controller.rejected == 1
+
+
+def test_unverified_tokens_share_one_fair_share(client, token):
+    assert admission_key("made-up-token") == UNVERIFIED_KEY
+    assert admission_key("") == UNVERIFIED_KEY
+
+    # Any authenticated request verifies the token
+    assert client.get(f"/api/upload/sessions/0?token={token}").status_code == 404
+    assert admission_key(token) == token
+
+
+def test_session_opens_bypass_a_full_budget(monkeypatch):
+    # Budget held by an upload and no room to queue: bodiless requests still go through
+    controller = AdmissionController(100, 0, 0.1)
+    controller._take("busy", 100)
+    monkeypatch.setattr(admission, "get_admission_controller", lambda: controller)
+
+    statuses = []
+
+    async def app(scope, receive, send):
+        await anyio.sleep(0.01)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = UploadAdmissionMiddleware(app)
+
+    async def open_session():
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+        scope = {"type": "http", "method": "POST", "path": "/api/upload/sessions", "query_string": b"token=t", "headers": []}
+        await middleware(scope, None, send)
+
+    async def run():
+        async with anyio.create_task_group() as group:
+            for _ in range(10):
+                group.start_soon(open_session)
+
+    anyio.run(run)
+    assert statuses == [200] * 10
+    assert controller.rejected == 0
+
+
+def test_body_size_estimate():
+    assert estimate_body_size([]) == 0
+    assert estimate_body_size([(b"content-length", b"0")]) == 0
+    assert estimate_body_size([(b"content-length", b"1000")]) == 1000
+    assert estimate_body_size([(b"transfer-encoding", b"chunked")]) == settings.MAX_UPLOAD_SIZE
@@ -0,0 +1,61 @@
+from app.models.database import SessionLocal
+from app.services.digest_index import DigestIndex
+from app.services.identifier_store import ColdIdentifierStore, ColdRow
+from app.services.validator import DataValidator
+
+
+def move_to_cold(db, records):
+    ColdIdentifierStore(db).insert([
+        ColdRow(r["qr_id"], DataValidator.hash_qr_text(r["qr_text"]), r["lot_number"], 0)
+        for r in records
+    ])
+    db.commit()
+
+
+def test_index_covers_cold_tier(client, make_records, tmp_path, monkeypatch):
+    cold_records = make_records(5)
+    new_records = make_records(5)
+
+    db = SessionLocal()
+    try:
+        move_to_cold(db, cold_records)
+
+        validator = DataValidator(db)
+        validator.index = DigestIndex(str(tmp_path))
+        looked_up = []
+        find_existing = validator.cold_store.find_existing
+        def counting_find_existing(qr_ids, qr_text_hashes):
+            looked_up.extend(qr_ids)
+            return find_existing(qr_ids, qr_text_hashes)
+        monkeypatch.setattr(validator.cold_store, "find_existing", counting_find_existing)
+
+        result = validator.validate_records(cold_records + new_records)
+    finally:
+        db.close()
+
+    assert {d["qr_id"] for d in result["duplicate_records"]} == {r["qr_id"] for r in cold_records}
+    assert {r["qr_id"] for r in result["valid_records"]} == {r["qr_id"] for r in new_records}
+    # Clean records are cleared by the index, only flagged ones reach the cold tier
+    assert not set(looked_up) & {r["qr_id"] for r in new_records}
+
+
+def test_index_picks_up_rows_cooled_after_sync(client, make_records, tmp_path):
+    records = make_records(3)
+    index = DigestIndex(str(tmp_path))
+
+    db = SessionLocal()
+    try:
+        validator = DataValidator(db)
+        validator.index = index
+        assert len(validator.validate_records(records)["valid_records"]) == 3
+
+        move_to_cold(db, records)
+        index.flush()
+
+        # A new process reads the cold cursor back from the manifest
+        validator.index = DigestIndex(str(tmp_path))
+        result = validator.validate_records(records)
+    finally:
+        db.close()
+
+    assert len(result["duplicate_records"]) == 3
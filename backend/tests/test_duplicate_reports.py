@@ -0,0 +1,63 @@
+import os
+from datetime import datetime, timedelta, timezone
+from app.core.config import settings
+from app.models.database import SessionLocal
+from app.models.models import Lot
+from app.services.duplicate_report import DuplicateReport
+from app.services.retention import RetentionEngine
+
+
+def upload_with_duplicates(client, token, make_records):
+    records = make_records(10)
+    response = client.post(f"/api/upload?token={token}", json={"data": records + records[:3]})
+    assert response.status_code == 200
+    session_id = int(response.json()["duplicates_url"].split("/")[3])
+    assert os.path.isdir(DuplicateReport(session_id).directory)
+    return session_id
+
+
+def lot_id_of(session_id):
+    db = SessionLocal()
+    try:
+        return db.query(Lot.id).filter(Lot.upload_session_id == session_id).one().id
+    finally:
+        db.close()
+
+
+def test_lot_delete_removes_duplicate_report(client, token, admin_headers, make_records):
+    session_id = upload_with_duplicates(client, token, make_records)
+
+    assert client.delete(f"/api/lots/{lot_id_of(session_id)}", headers=admin_headers).status_code == 200
+    assert not os.path.exists(DuplicateReport(session_id).directory)
+
+
+def test_bulk_delete_removes_duplicate_report(client, token, bulk_delete, make_records):
+    session_id = upload_with_duplicates(client, token, make_records)
+
+    job = bulk_delete(lot_id_of(session_id))
+    assert job["status"] == "completed"
+    assert job["failed_files"] == 0
+    assert not os.path.exists(DuplicateReport(session_id).directory)
+
+
+def test_retention_removes_old_duplicate_reports(client, token, make_records):
+    session_id = upload_with_duplicates(client, token, make_records)
+
+    db = SessionLocal()
+    try:
+        later = datetime.now(timezone.utc) + timedelta(days=settings.RETENTION_DUPLICATE_REPORTS_DAYS + 1)
+        assert RetentionEngine(db).run(now=later)["duplicate_reports_deleted"] >= 1
+    finally:
+        db.close()
+
+    assert not os.path.exists(DuplicateReport(session_id).directory)
+    response = client.get(f"/api/upload/{session_id}/duplicates?token={token}")
+    assert response.status_code == 200
+    assert response.headers["x-total-count"] == "0"
+
+
+def test_chunk_number_is_rejected_for_single_uploads(client, token, make_records):
+    session_id = upload_with_duplicates(client, token, make_records)
+
+    response = client.get(f"/api/upload/{session_id}/duplicates?token={token}&chunk_number=0")
+    assert response.status_code == 400
@@ -0,0 +1,120 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from app.core.config import settings
+from app.models.database import SessionLocal
+from app.models.models import APIToken, CleanupJob, Lot, LotSegment, UploadSession
+from app.services import cleanup
+from app.services.retention import RetentionEngine
+
+
+def upload(client, token, records, append=False):
+    response = client.post(f"/api/upload?token={token}&append={str(append).lower()}", json={"data": records})
+    assert response.status_code == 200
+    return response.json()
+
+
+def only_lot_id(token):
+    db = SessionLocal()
+    try:
+        return db.query(Lot.id).join(UploadSession, Lot.upload_session_id == UploadSession.id).join(
+            APIToken, UploadSession.token_id == APIToken.id
+        ).filter(APIToken.token == token).one().id
+    finally:
+        db.close()
+
+
+def segment_count(lot_id):
+    db = SessionLocal()
+    try:
+        return db.query(LotSegment).filter(LotSegment.lot_id == lot_id).count()
+    finally:
+        db.close()
+
+
+def test_cascade_deletes_identifiers_of_compacted_appends(client, token, bulk_delete, make_records, monkeypatch):
+    monkeypatch.setattr(settings, "LOT_COMPACT_SEGMENTS", 2)
+    batches = [make_records(5) for _ in range(3)]
+    for i, records in enumerate(batches):
+        upload(client, token, records, append=i > 0)
+
+    lot_id = only_lot_id(token)
+    assert segment_count(lot_id) == 0  # compacted after the second append
+
+    job = bulk_delete(lot_id)
+    assert job["status"] == "completed"
+    assert job["deleted_identifiers"] == 15
+
+    result = upload(client, token, [record for records in batches for record in records])
+    assert result["valid_records"] == 15
+
+
+def test_cascade_deletes_identifiers_of_archived_appends(client, token, bulk_delete, make_records):
+    batches = [make_records(5) for _ in range(2)]
+    for i, records in enumerate(batches):
+        upload(client, token, records, append=i > 0)
+
+    lot_id = only_lot_id(token)
+    db = SessionLocal()
+    try:
+        assert RetentionEngine(db).archive_lot(db.query(Lot).filter(Lot.id == lot_id).one())
+    finally:
+        db.close()
+    assert segment_count(lot_id) == 0
+
+    job = bulk_delete(lot_id)
+    assert job["deleted_identifiers"] == 10
+
+    result = upload(client, token, [record for records in batches for record in records])
+    assert result["valid_records"] == 10
+
+
+def wait_for_job(job_id):
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        db = SessionLocal()
+        try:
+            job = db.query(CleanupJob).filter(CleanupJob.id == job_id).one()
+        finally:
+            db.close()
+        if job.status not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("cleanup job did not finish")
+
+
+def test_failing_cleanup_job_is_marked_failed(client, token, bulk_delete, make_records, monkeypatch):
+    upload(client, token, make_records(5))
+
+    def fail(db):
+        raise RuntimeError("identifier store unavailable")
+
+    monkeypatch.setattr(cleanup, "get_identifier_store", fail)
+    job = bulk_delete(only_lot_id(token))
+    assert job["status"] == "failed"
+    assert "identifier store unavailable" in job["error"]
+
+
+def test_abandoned_cleanup_job_is_requeued(client, tmp_path):
+    leftover = tmp_path / "lot.csv"
+    leftover.write_text("qr_id\n")
+
+    db = SessionLocal()
+    try:
+        job = CleanupJob(
+            status="running",
+            file_paths=json.dumps([str(leftover)]),
+            total_files=1,
+            heartbeat_at=datetime.now(timezone.utc) - timedelta(seconds=settings.CLEANUP_JOB_STALE_SECONDS + 60)
+        )
+        db.add(job)
+        db.commit()
+        job_id = job.id
+    finally:
+        db.close()
+
+    cleanup.get_cleanup_worker()._resume_queued()
+    job = wait_for_job(job_id)
+    assert job.status == "completed"
+    assert job.removed_files == 1
+    assert not leftover.exists()
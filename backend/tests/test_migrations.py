@@ -0,0 +1,46 @@
+from sqlalchemy import create_engine, inspect, text
+from app.models import migrations
+from app.models.database import Base
+
+
+def make_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_missing_indexes_are_built_online(tmp_path, monkeypatch):
+    engine = make_engine(tmp_path)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX idx_qr_id_lot"))
+        conn.execute(text("DROP INDEX uq_upload_session_idempotency_key"))
+
+    built = []
+    create_index_online = migrations.create_index_online
+    def recording_create_index_online(engine, name, table, definition, unique=False):
+        built.append(name)
+        create_index_online(engine, name, table, definition, unique=unique)
+    monkeypatch.setattr(migrations, "create_index_online", recording_create_index_online)
+
+    migrations._add_missing_columns(engine)
+
+    assert sorted(built) == ["idx_qr_id_lot", "uq_upload_session_idempotency_key"]
+    assert "idx_qr_id_lot" in index_names(engine, "qr_identifiers")
+    unique = {i["name"]: i["unique"] for i in inspect(engine).get_indexes("upload_sessions")}
+    assert unique["uq_upload_session_idempotency_key"]
+
+
+def test_partitioned_identifiers_keep_their_indexes(tmp_path, monkeypatch):
+    engine = make_engine(tmp_path)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX idx_qr_id_lot"))
+        conn.execute(text("DROP INDEX idx_qr_text_hash_lot"))
+
+    monkeypatch.setattr(migrations, "_is_partitioned", lambda engine, table: table == "qr_identifiers")
+    migrations._add_missing_columns(engine)
+
+    assert not {"idx_qr_id_lot", "idx_qr_text_hash_lot"} & index_names(engine, "qr_identifiers")
@@ -0,0 +1,32 @@
+from app.core.config import settings
+from app.core.response_cache import bump_generation
+
+
+def test_stats_are_not_cached_while_a_replica_may_lag(client, admin_headers, monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_READ_URL", "sqlite:///replica.db")
+    monkeypatch.setattr(settings, "READ_YOUR_WRITES_SECONDS", 60.0)
+    bump_generation()
+
+    response = client.get("/api/lots/stats", headers=admin_headers)
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+    assert response.headers["cache-control"] == "no-store"
+
+    monkeypatch.setattr(settings, "READ_YOUR_WRITES_SECONDS", 0.0)
+    response = client.get("/api/lots/stats", headers=admin_headers)
+    assert "etag" in response.headers
+
+
+def test_admin_reads_use_the_read_engine(client, admin_headers):
+    from app.models.database import get_write_db
+
+    def no_write_db():
+        raise AssertionError("admin read used the write engine")
+        yield
+
+    client.app.dependency_overrides[get_write_db] = no_write_db
+    try:
+        for path in ("/api/lots", "/api/lots/stats"):
+            assert client.get(path, headers=admin_headers).status_code == 200
+    finally:
+        del client.app.dependency_overrides[get_write_db]
@@ -0,0 +1,136 @@
+from app.api import upload
+from app.core.config import settings
+from app.models.database import SessionLocal
+from app.models.models import APIToken, UploadSession
+from app.services.csv_generator import CSVGenerator
+from app.services.idempotency import IdempotencyService
+
+
+def fail_save_to_csv(self, lot_number, records):
+    raise OSError("disk full")
+
+
+def test_failed_upload_can_be_retried(client, token, make_records, monkeypatch):
+    records = make_records(20)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(CSVGenerator, "save_to_csv", fail_save_to_csv)
+        response = client.post(f"/api/upload?token={token}", json={"data": records})
+    assert response.status_code == 500
+
+    response = client.post(f"/api/upload?token={token}", json={"data": records})
+    assert response.status_code == 200
+    assert response.json()["valid_records"] == 20
+    assert response.json()["duplicate_records"] == 0
+
+
+def test_failed_keyed_upload_can_be_retried(client, token, make_records, monkeypatch):
+    records = make_records(5)
+    headers = {"Idempotency-Key": f"retry-{token}"}
+
+    with monkeypatch.context() as patch:
+        patch.setattr(CSVGenerator, "save_to_csv", fail_save_to_csv)
+        assert client.post(f"/api/upload?token={token}", json={"data": records}, headers=headers).status_code == 500
+
+    first = client.post(f"/api/upload?token={token}", json={"data": records}, headers=headers)
+    assert first.status_code == 200
+    assert first.json()["valid_records"] == 5
+
+    replay = client.post(f"/api/upload?token={token}", json={"data": records}, headers=headers)
+    assert replay.status_code == 200
+    assert replay.json() == first.json()
+
+
+def test_keyed_upload_of_a_dead_request_is_retried_after_timeout(client, token, make_records, monkeypatch):
+    records = make_records(5)
+    headers = {"Idempotency-Key": f"crash-{token}"}
+
+    # A process dying mid-upload leaves the keyed session without a response
+    with monkeypatch.context() as patch:
+        patch.setattr(CSVGenerator, "save_to_csv", fail_save_to_csv)
+        patch.setattr(upload, "discard_upload_session", lambda *args, **kwargs: None)
+        assert client.post(f"/api/upload?token={token}", json={"data": records}, headers=headers).status_code == 500
+
+    assert client.post(f"/api/upload?token={token}", json={"data": records}, headers=headers).status_code == 409
+
+    monkeypatch.setattr(settings, "IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS", -1)
+    response = client.post(f"/api/upload?token={token}", json={"data": records}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["valid_records"] == 5
+
+
+def token_id_of(token):
+    db = SessionLocal()
+    try:
+        return db.query(APIToken.id).filter(APIToken.token == token).one().id
+    finally:
+        db.close()
+
+
+def keyed_session(token_id, key):
+    db = SessionLocal()
+    try:
+        return db.query(UploadSession).filter(
+            UploadSession.token_id == token_id,
+            UploadSession.idempotency_key == key
+        ).first()
+    finally:
+        db.close()
+
+
+def test_dead_request_is_discarded_only_under_the_ingest_lock(client, token, make_records, monkeypatch):
+    records = make_records(5)
+    key = f"unlocked-{token}"
+
+    with monkeypatch.context() as patch:
+        patch.setattr(CSVGenerator, "save_to_csv", fail_save_to_csv)
+        patch.setattr(upload, "discard_upload_session", lambda *args, **kwargs: None)
+        response = client.post(f"/api/upload?token={token}", json={"data": records}, headers={"Idempotency-Key": key})
+        assert response.status_code == 500
+
+    monkeypatch.setattr(settings, "IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS", -1)
+    pending = keyed_session(token_id_of(token), key)
+
+    db = SessionLocal()
+    try:
+        idempotency = IdempotencyService(db, pending.token_id, key, pending.request_digest)
+        assert idempotency.cached_response() is None
+        assert keyed_session(pending.token_id, key) is not None
+
+        assert idempotency.cached_response(locked=True) is None
+        assert keyed_session(pending.token_id, key) is None
+    finally:
+        db.close()
+
+    # Its identifiers were released
+    response = client.post(f"/api/upload?token={token}", json={"data": records})
+    assert response.status_code == 200
+    assert response.json()["valid_records"] == 5
+
+
+def test_retry_during_a_slow_original_is_ingested_once(client, token, make_records, monkeypatch):
+    records = make_records(5)
+    headers = {"Idempotency-Key": f"slow-{token}"}
+    save_to_csv = CSVGenerator.save_to_csv
+    retries = []
+    calls = []
+
+    # The retry arrives while the original writes its CSV, after the ingest lock
+    def slow_save_to_csv(self, lot_number, lot_records):
+        calls.append(lot_number)
+        if len(calls) == 1:
+            retries.append(client.post(f"/api/upload?token={token}", json={"data": records}, headers=headers))
+        return save_to_csv(self, lot_number, lot_records)
+
+    monkeypatch.setattr(settings, "IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS", -1)
+    monkeypatch.setattr(CSVGenerator, "save_to_csv", slow_save_to_csv)
+    original = client.post(f"/api/upload?token={token}", json={"data": records}, headers=headers)
+
+    assert retries[0].status_code == 200
+    assert retries[0].json()["valid_records"] == 5
+    # The original's session was taken over, its commit fails instead of adding the records again
+    assert original.status_code == 409
+
+    replay = client.post(f"/api/upload?token={token}", json={"data": records}, headers=headers)
+    assert replay.json() == retries[0].json()
+    assert client.post(f"/api/upload?token={token}", json={"data": records}).status_code == 400
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta, timezone
+from app.api import upload
+from app.core.config import settings
+from app.models.database import SessionLocal
+from app.services.retention import RetentionEngine
+
+
+def open_session(client, token):
+    response = client.post(f"/api/upload/sessions?token={token}")
+    assert response.status_code == 200
+    return response.json()["upload_session_id"]
+
+
+def test_aborted_session_releases_identifiers(client, token, make_records):
+    records = make_records(10)
+    session_id = open_session(client, token)
+    assert client.put(f"/api/upload/sessions/{session_id}/chunks/0?token={token}", json={"data": records}).status_code == 200
+
+    response = client.delete(f"/api/upload/sessions/{session_id}?token={token}")
+    assert response.status_code == 200
+    assert client.get(f"/api/upload/sessions/{session_id}?token={token}").status_code == 404
+
+    response = client.post(f"/api/upload?token={token}", json={"data": records})
+    assert response.status_code == 200
+    assert response.json()["valid_records"] == 10
+
+
+def test_idle_session_expires(client, token, make_records):
+    records = make_records(10)
+    session_id = open_session(client, token)
+    assert client.put(f"/api/upload/sessions/{session_id}/chunks/0?token={token}", json={"data": records}).status_code == 200
+
+    db = SessionLocal()
+    try:
+        later = datetime.now(timezone.utc) + timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS + 1)
+        assert RetentionEngine(db).run(now=later)["upload_sessions_expired"] >= 1
+    finally:
+        db.close()
+
+    assert client.get(f"/api/upload/sessions/{session_id}?token={token}").status_code == 404
+    assert client.post(f"/api/upload?token={token}", json={"data": records}).json()["valid_records"] == 10
+
+
+def test_failed_chunk_releases_sharded_identifiers(client, token, make_records, monkeypatch):
+    monkeypatch.setattr(settings, "QR_PARTITIONS", 2)
+    records = make_records(10)
+    session_id = open_session(client, token)
+    chunk_url = f"/api/upload/sessions/{session_id}/chunks/0?token={token}"
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("usage rollup failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(upload, "record_upload_usage", fail)
+        assert client.put(chunk_url, json={"data": records}).status_code == 500
+
+    response = client.put(chunk_url, json={"data": records})
+    assert response.status_code == 200
+    assert response.json()["valid_records"] == 10
+
+
+def test_aborted_session_leaves_the_stats(client, token, admin_headers):
+    session_id = open_session(client, token)
+    before = client.get("/api/lots/stats", headers=admin_headers)
+
+    assert client.delete(f"/api/upload/sessions/{session_id}?token={token}").status_code == 200
+
+    response = client.get("/api/lots/stats", headers={**admin_headers, "If-None-Match": before.headers["etag"]})
+    assert response.status_code == 200
+    assert response.json()["total_uploads"] == before.json()["total_uploads"] - 1